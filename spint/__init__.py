@@ -4,14 +4,27 @@ import contextlib
 from importlib.metadata import PackageNotFoundError, version
 
 from .dispersion import alpha_disp, phi_disp
-from .flow_accessibility import Accessibility
+from .eigenfilter import EigenFilter
+from .flow_accessibility import (
+    Accessibility,
+    IncrementalAccessibility,
+    bipartite_accessibility,
+    chunked_accessibility,
+    competing_destinations,
+    decay_accessibility,
+    sparse_accessibility,
+)
+from .flow_SA import FlowMoran
 from .gravity import Attraction, Doubly, Gravity, Production
+from .od_lag import ODLag
+from .spintW import ODW, mat2L, netW, vecW
 from .utils import (
     # CPC,  # problem -- `Y` not defined inside function -- inoperable
     sorensen,
     srmse,
 )
 from .vec_SA import VecMoran as Moran_Vector
+from .vec_SA import VecMoranBatch, VecMoranCorrelogram
 
 with contextlib.suppress(PackageNotFoundError):
     __version__ = version("spint")
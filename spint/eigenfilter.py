@@ -0,0 +1,303 @@
+"""
+Eigenvector spatial filtering for spatial interaction models: extraction of the
+eigenvectors of MCM for origin-destination weights and forward selection of the
+eigenvectors that are included as covariates of a gravity-type model.
+"""
+
+__author__ = "Taylor Oshan tayoshan@gmail.com"
+
+import numpy as np
+import scipy.stats as stats
+from scipy import sparse as sp
+from scipy.linalg import solve_triangular
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+from .spintW import ODW
+from .utils import LagOperator
+
+# factors up to this size are decomposed densely rather than with Lanczos
+DENSE_MAX = 1000
+
+
+class EigenFilter:
+    """
+    Eigenvector spatial filter (ESF) built from the eigenvectors of MCM, where
+    C = (W + W')/2 and M = I - 11'/n, for a spatial weight on the n OD pairs of
+    a gravity-type model.
+
+    For an ODW weight Wo (x) Wd the candidates are the eigenvectors of
+    (MoCoMo) (x) (MdCdMd), i.e. the Kronecker products of the eigenvectors of
+    the origin and destination factors (Fischer and Griffith, 2008), whose
+    eigenvalues are the products of the factor eigenvalues; only the o x o and
+    d x d factors are decomposed and the n x n weight is never formed. For
+    other weights the leading eigenvectors of MCM are extracted with Lanczos
+    iterations on the sparse (or matrix-free) weight.
+
+    Candidates are selected by forward stepwise selection: at each step every
+    remaining candidate is scored with a (quasi-)score test evaluated at the
+    current IRLS solution, the best one is added if significant and the IRLS
+    iterations restart from the current fitted values.
+
+    Parameters
+    ----------
+    w               : ODW, W, WSP, sparse matrix or LinearOperator
+                      n x n spatial weight for the OD pairs in the same order
+                      as the flows; a LinearOperator must support w.T
+    k               : int
+                      maximum number of eigenvectors extracted as candidates;
+                      default is 50
+    threshold       : float
+                      candidates are limited to eigenvectors with eigenvalue
+                      of at least threshold times the largest eigenvalue,
+                      i.e. those representing substantial positive
+                      autocorrelation; default is 0.25
+    alpha           : float
+                      significance level of the score test used to add
+                      eigenvectors; default is 0.05
+    max_vectors     : int
+                      maximum number of eigenvectors selected; default is None
+                      for no limit
+    chunk_size      : int
+                      number of candidates formed and scored at once; default
+                      is 64
+
+    Attributes
+    ----------
+    w               : object
+                      original w object
+    n               : integer
+                      number of OD pairs
+    evals           : array
+                      eigenvalues of the candidate eigenvectors, in
+                      descending order
+    selected        : list
+                      indices of selected candidates (in order of selection)
+    scores          : list
+                      score statistic of each selected candidate when added
+    vectors         : array
+                      n x q; selected eigenvectors
+
+    References
+    ----------
+    Fischer, M. M. and Griffith, D. A. (2008). Modeling spatial autocorrelation
+        in spatial interaction data: an application to patent citation data in
+        the European Union. Journal of Regional Science, 48(5), 969-989.
+    """
+
+    def __init__(
+        self,
+        w,
+        k=50,
+        threshold=0.25,
+        alpha=0.05,
+        max_vectors=None,
+        chunk_size=64,
+    ):
+        self.w = w
+        self.k = k
+        self.threshold = threshold
+        self.alpha = alpha
+        self.max_vectors = max_vectors
+        self.chunk_size = chunk_size
+        if isinstance(w, ODW):
+            self.n = w.n
+            evals, self._evo, self._evd, self._pairs = _kron_mcm_eigs(w, k)
+        else:
+            lag = LagOperator(w)
+            self.n = lag.n
+            evals, self._evecs = mcm_eigs(lag, k)
+        keep = evals >= threshold * evals[0]
+        self.evals = evals[keep]
+        if isinstance(w, ODW):
+            self._pairs = self._pairs[keep]
+        else:
+            self._evecs = self._evecs[:, keep]
+        self.selected = []
+        self.scores = []
+
+    def candidates(self, idx):
+        """
+        n x len(idx) array of candidate eigenvectors
+        """
+        idx = np.atleast_1d(np.asarray(idx, dtype=int))
+        if isinstance(self.w, ODW):
+            i, j = self._pairs[idx].T
+            vecs = self._evo[:, i][:, None, :] * self._evd[:, j][None, :, :]
+            return vecs.reshape((self.n, len(idx)))
+        return self._evecs[:, idx]
+
+    @property
+    def vectors(self):
+        return self.candidates(self.selected)
+
+    def select(self, y, X, mu, tol=1e-8, max_iter=200):
+        """
+        Forward selection of eigenvectors for a Poisson log-linear model
+
+        Parameters
+        ----------
+        y               : array
+                          n x 1; observed flows
+        X               : array or sparse matrix
+                          n x k; design matrix of the fitted model, including
+                          any constant
+        mu              : array
+                          n x 1; fitted values of the model
+        tol             : float
+                          convergence tolerance of the IRLS iterations
+        max_iter        : int
+                          maximum number of IRLS iterations per refit
+
+        Returns
+        -------
+        vectors         : array
+                          n x q; selected eigenvectors
+        """
+        y = np.asarray(y, dtype=float).ravel()
+        mu = np.asarray(mu, dtype=float).ravel()
+        dense = not sp.issparse(X)
+        if dense:
+            X = np.asarray(X, dtype=float)
+        remaining = np.arange(len(self.evals))
+        self.selected = []
+        self.scores = []
+        max_vectors = len(remaining) if self.max_vectors is None else self.max_vectors
+        critical = stats.chi2.isf(self.alpha, 1)
+        while len(remaining) and len(self.selected) < max_vectors:
+            scores = self._score(y, X, mu, remaining)
+            best = np.argmax(scores)
+            if scores[best] < critical:
+                break
+            self.selected.append(int(remaining[best]))
+            self.scores.append(float(scores[best]))
+            e = self.candidates(remaining[best])
+            X = np.hstack((X, e)) if dense else sp.hstack((X, e), format="csr")
+            remaining = np.delete(remaining, best)
+            mu = _poisson_irls(y, X, mu, tol, max_iter)
+        return self.vectors
+
+    def _score(self, y, X, mu, idx):
+        # score statistic U^2 / Var(U) for adding each candidate e to the model
+        # at the current fit: U = e'(y - mu) and
+        # Var(U) = phi * (e'Ve - e'VX (X'VX)^-1 X'Ve), V = diag(mu), with phi the
+        # Pearson dispersion so that overdispersed flows do not inflate scores
+        n, k = X.shape
+        r = y - mu
+        phi = max(np.sum(r**2 / mu) / (n - k), 1.0)
+        R = np.linalg.cholesky(_xtvx(X, mu))
+        scores = np.empty(len(idx))
+        for start in range(0, len(idx), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            E = self.candidates(idx[chunk])
+            VE = E * mu.reshape((-1, 1))
+            B = solve_triangular(R, np.asarray(X.T @ VE), lower=True)
+            eve = np.sum(E * VE, axis=0)
+            var = eve - np.sum(B**2, axis=0)
+            # candidates (nearly) in the span of X, e.g. of the origin or
+            # destination indicators, cannot be added
+            collinear = var <= 1e-8 * eve
+            scores[chunk] = np.where(
+                collinear, 0.0, (E.T @ r) ** 2 / (phi * np.where(collinear, 1.0, var))
+            )
+        return scores
+
+
+def mcm_eigs(w, k):
+    """
+    Leading eigenpairs of MCM, C = (W + W')/2, M = I - 11'/n
+
+    Parameters
+    ----------
+    w               : W, WSP, sparse matrix, LinearOperator or LagOperator
+                      n x n spatial weight
+    k               : int
+                      number of eigenpairs
+
+    Returns
+    -------
+    evals           : array
+                      k largest eigenvalues in descending order
+    evecs           : array
+                      n x k; corresponding eigenvectors
+    """
+    lag = LagOperator(w)
+    n = lag.n
+    k = min(k, n - 2)
+    if n <= DENSE_MAX:
+        evals, evecs = np.linalg.eigh(_center(_center(_symmetric(lag, np.eye(n))).T))
+        return evals[::-1][:k], evecs[:, ::-1][:, :k]
+    mcm = LinearOperator(
+        (n, n),
+        matvec=lambda x: _center(_symmetric(lag, _center(x))),
+        matmat=lambda x: _center(_symmetric(lag, _center(x))),
+        dtype=float,
+    )
+    evals, evecs = eigsh(mcm, k=k, which="LA")
+    order = np.argsort(evals)[::-1]
+    return evals[order], evecs[:, order]
+
+
+def _kron_mcm_eigs(w, k):
+    # eigenpairs of (MoCoMo) (x) (MdCdMd) are products of the eigenpairs of the
+    # factors; the k largest products come from the k largest positive or the
+    # k most negative eigenvalues of each factor
+    evo = _factor_eigs(w.Wo, k)
+    evd = _factor_eigs(w.Wd, k)
+    prods = np.multiply.outer(evo[0], evd[0]).ravel()
+    order = np.argsort(prods)[::-1][:k]
+    order = order[prods[order] > 0]
+    pairs = np.column_stack(np.unravel_index(order, (len(evo[0]), len(evd[0]))))
+    return prods[order], evo[1], evd[1], pairs
+
+
+def _factor_eigs(W, k):
+    m = W.shape[0]
+    if m <= DENSE_MAX:
+        evals, evecs = np.linalg.eigh(
+            _center(_center(_symmetric(LagOperator(W), np.eye(m))).T)
+        )
+    else:
+        lag = LagOperator(W)
+        mcm = LinearOperator(
+            (m, m),
+            matvec=lambda x: _center(_symmetric(lag, _center(x))),
+            matmat=lambda x: _center(_symmetric(lag, _center(x))),
+            dtype=float,
+        )
+        kf = min(k, (m - 2) // 2)
+        la, va = eigsh(mcm, k=kf, which="LA")
+        sa, vs = eigsh(mcm, k=kf, which="SA")
+        evals, evecs = np.concatenate((sa, la)), np.hstack((vs, va))
+    # the constant vector has eigenvalue 0 and is dropped with other null vectors
+    keep = np.abs(evals) > 1e-10 * np.abs(evals).max()
+    return evals[keep], evecs[:, keep]
+
+
+def _symmetric(lag, x):
+    return (lag.lag(x) + lag.rlag(x)) / 2.0
+
+
+def _center(x):
+    return x - x.mean(axis=0)
+
+
+def _xtvx(X, mu):
+    if sp.issparse(X):
+        return (X.T @ X.multiply(mu.reshape((-1, 1)))).toarray()
+    return X.T @ (X * mu.reshape((-1, 1)))
+
+
+def _poisson_irls(y, X, mu, tol, max_iter):
+    # IRLS for the log link started from the current fitted values, so adding
+    # one column only takes a few iterations
+    eta = np.log(mu)
+    for _i in range(max_iter):
+        z = eta + (y - mu) / mu
+        XtVz = np.asarray(X.T @ (mu * z)).ravel()
+        betas = np.linalg.solve(_xtvx(X, mu), XtVz)
+        eta_new = np.asarray(X @ betas).ravel()
+        if np.max(np.abs(eta_new - eta)) < tol:
+            break
+        eta = eta_new
+        mu = np.exp(eta)
+    return np.exp(eta_new)
@@ -0,0 +1,323 @@
+"""
+Classes for statistics for testing hypotheses of spatial autocorrelation amongst
+flow values (or model residuals) observed on origin-destination pairs.
+"""
+
+import numpy as np
+import scipy.stats as stats
+from scipy import sparse as sp
+from scipy.linalg import solve_triangular
+
+from .utils import LagOperator
+
+PERMUTATIONS = 0
+
+
+class FlowMoran:
+    """Moran's I Global Autocorrelation Statistic For Flows
+
+    The spatial weight relates the n origin-destination pairs, e.g., an ODW
+    (Kronecker) or netW (network) weight. Lags are computed through the weight's
+    operator so that Kronecker weights are never densified and the analytical
+    moments use weight sums computed from Wo and Wd separately.
+
+    Parameters
+    ----------
+    y               : array
+                      n x 1 (or o x d); flows or model residuals for n
+                      origin-destination pairs, ordered as the weight
+    w               : ODW, W, WSP, sparse matrix or LinearOperator
+                      n x n spatial weight for the origin-destination pairs;
+                      a LinearOperator must provide the sums s0, s1 and s2
+    permutations    : int
+                      number of random permutations for calculation of
+                      pseudo-p_values; default is 0
+    batch_size      : int
+                      number of permutations lagged at once; default is 100
+    two_tailed      : boolean
+                      If True (default) analytical p-values for Moran are two
+                      tailed, otherwise if False, they are one-tailed.
+
+    Attributes
+    ----------
+    y               : array
+                      original variable
+    w               : object
+                      original w object
+    n               : integer
+                      number of origin-destination pairs
+    z               : array
+                      deviations from the mean of y
+    s0              : float
+                      sum of weights
+    s1              : float
+                      1/2 sum_ij (w_ij + w_ji)^2
+    s2              : float
+                      sum_i (w_i. + w_.i)^2
+    I               : float
+                      value of Moran's I
+    EI              : float
+                      expected value of I under normality and randomization
+    VI_norm         : float
+                      variance of I under normality assumption
+    seI_norm        : float
+                      standard deviation of I under normality assumption
+    z_norm          : float
+                      z-value of I under normality assumption
+    p_norm          : float
+                      p-value of I under normality assumption
+    VI_rand         : float
+                      variance of I under randomization assumption
+    seI_rand        : float
+                      standard deviation of I under randomization assumption
+    z_rand          : float
+                      z-value of I under randomization assumption
+    p_rand          : float
+                      p-value of I under randomization assumption
+    two_tailed      : boolean
+                      If True p_norm and p_rand are two-tailed, otherwise they
+                      are one-tailed.
+    sim             : array
+                      (if permutations>0)
+                      vector of I values for permuted samples
+    p_sim           : array
+                      (if permutations>0)
+                      p-value based on permutations (one-tailed)
+    EI_sim          : float
+                      (if permutations>0)
+                      average value of I from permutations
+    VI_sim          : float
+                      (if permutations>0)
+                      variance of I from permutations
+    seI_sim         : float
+                      (if permutations>0)
+                      standard deviation of I under permutations.
+    z_sim           : float
+                      (if permutations>0)
+                      standardized I based on permutations
+    p_z_sim         : float
+                      (if permutations>0)
+                      p-value based on standard normal approximation from
+                      permutations
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from libpysal.weights import lat2W
+    >>> from spint.spintW import ODW
+    >>> from spint.flow_SA import FlowMoran
+    >>> flows = np.add.outer(np.arange(9.0), np.arange(25.0))
+    >>> fm = FlowMoran(flows, ODW(lat2W(3, 3), lat2W(5, 5)))
+    >>> np.round(fm.I, 6)
+    np.float64(0.807677)
+
+    """
+
+    def __init__(
+        self, y, w, permutations=PERMUTATIONS, batch_size=100, two_tailed=True
+    ):
+        self.y = y = np.asarray(y, dtype=float).ravel()
+        self.w = w
+        self._lag = LagOperator(w)
+        if self._lag.n != len(y):
+            raise ValueError("Number of flows does not match spatial weight, W")
+        self.n = n = len(y)
+        self.permutations = permutations
+        self.two_tailed = two_tailed
+        self.z = z = y - y.mean()
+        self.s0 = s0 = self._lag.s0
+        self.s1 = s1 = self._lag.s1
+        self.s2 = s2 = self._lag.s2
+        self.z2ss = np.dot(z, z)
+        self.I = self.__calc(z)
+
+        self.EI = -1.0 / (n - 1)
+        self.VI_norm = (n**2 * s1 - n * s2 + 3 * s0**2) / (
+            (n**2 - 1) * s0**2
+        ) - self.EI**2
+        k = (np.sum(z**4) / n) / (self.z2ss / n) ** 2
+        A = n * ((n**2 - 3 * n + 3) * s1 - n * s2 + 3 * s0**2)
+        B = k * ((n**2 - n) * s1 - 2 * n * s2 + 6 * s0**2)
+        self.VI_rand = (A - B) / ((n - 1) * (n - 2) * (n - 3) * s0**2) - self.EI**2
+        self.seI_norm = self.VI_norm ** (1 / 2.0)
+        self.seI_rand = self.VI_rand ** (1 / 2.0)
+        self.z_norm = (self.I - self.EI) / self.seI_norm
+        self.z_rand = (self.I - self.EI) / self.seI_rand
+        self.p_norm = stats.norm.sf(abs(self.z_norm))
+        self.p_rand = stats.norm.sf(abs(self.z_rand))
+        if self.two_tailed:
+            self.p_norm *= 2.0
+            self.p_rand *= 2.0
+
+        if permutations:
+            self.sim = sim = self.__permute(batch_size)
+            above = sim >= self.I
+            larger = above.sum()
+            if (self.permutations - larger) < larger:
+                larger = self.permutations - larger
+            self.p_sim = (larger + 1.0) / (permutations + 1.0)
+            self.EI_sim = sim.sum() / permutations
+            self.seI_sim = sim.std()
+            self.VI_sim = self.seI_sim**2
+            self.z_sim = (self.I - self.EI_sim) / self.seI_sim
+            self.p_z_sim = stats.norm.sf(abs(self.z_sim))
+
+    def __calc(self, z):
+        # z may hold k permuted columns, giving k values of I
+        inum = np.sum(z * self._lag.lag(z), axis=0)
+        return self.n / self.s0 * inum / self.z2ss
+
+    def __permute(self, batch_size):
+        sims = []
+        for start in range(0, self.permutations, batch_size):
+            size = min(batch_size, self.permutations - start)
+            zp = np.column_stack([np.random.permutation(self.z) for i in range(size)])
+            sims.append(self.__calc(zp))
+        return np.concatenate(sims)
+
+
+class FlowMoranResid:
+    """Moran's I and Lagrange Multiplier Tests For Residuals of a Fitted Gravity
+    Model
+
+    Uses the fitted means and IRLS weights of a gravity-type model, so nothing
+    is refitted. The residuals are treated as those of the weighted least squares
+    regression from the final IRLS step, for which the moments of Moran's I follow
+    from the projection M = I - H, H = V^(1/2) X (X'VX)^-1 X' V^(1/2). The traces
+    involving H are reduced to k x k matrices, so only k lags of W (and of W')
+    are needed and the weight is never densified.
+
+    Parameters
+    ----------
+    model           : BaseGravity
+                      fitted Gravity, Production, Attraction or Doubly model
+    w               : ODW, W, WSP, sparse matrix or LinearOperator
+                      n x n spatial weight for the origin-destination pairs of
+                      the model; a LinearOperator must provide the sums s0, s1
+                      and s2 and the traces trW, trWtW and trWW
+    resid           : string
+                      'pearson' (default) | 'deviance'; residuals to test
+    chunk_size      : int
+                      number of columns of X lagged at once; default is 64
+    two_tailed      : boolean
+                      If True (default) the p-value for Moran is two tailed,
+                      otherwise if False, it is one-tailed.
+
+    Attributes
+    ----------
+    model           : BaseGravity
+                      original model
+    w               : object
+                      original w object
+    n               : integer
+                      number of origin-destination pairs
+    k               : integer
+                      number of parameters of the model
+    e               : array
+                      n x 1; residuals that are tested
+    s0              : float
+                      sum of weights
+    I               : float
+                      value of Moran's I for the residuals
+    EI              : float
+                      expected value of I given the design of the model
+    VI              : float
+                      variance of I given the design of the model
+    seI             : float
+                      standard deviation of I
+    z               : float
+                      z-value of I
+    p               : float
+                      p-value of I
+    LM              : float
+                      Lagrange multiplier test for spatial error dependence
+    p_LM            : float
+                      p-value of LM (chi-squared with one degree of freedom)
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from libpysal.weights import lat2W
+    >>> from spint.gravity import Doubly
+    >>> from spint.spintW import ODW
+    >>> o = np.repeat(np.arange(6), 6)
+    >>> d = np.tile(np.arange(6), 6)
+    >>> cost = np.abs(o - d) + 1.0
+    >>> flows = np.round(1000 * np.exp(-0.5 * cost + 0.1 * d)).astype(int)
+    >>> model = Doubly(flows, o, d, cost, "exp")
+    >>> res = model.resid_moran(ODW(lat2W(2, 3), lat2W(2, 3)))
+    >>> np.round(res.I, 6)
+    np.float64(0.047704)
+    >>> np.round(res.EI, 6)
+    np.float64(0.030801)
+
+    """
+
+    def __init__(self, model, w, resid="pearson", chunk_size=64, two_tailed=True):
+        self.model = model
+        self.w = w
+        self._lag = LagOperator(w)
+        mu = np.asarray(model.yhat, dtype=float).ravel()
+        y = np.asarray(model.y, dtype=float).ravel()
+        if self._lag.n != len(y):
+            raise ValueError("Number of flows does not match spatial weight, W")
+        family = model.results.family
+        if resid.lower() == "pearson":
+            e = (y - mu) / np.sqrt(family.variance(mu))
+        elif resid.lower() == "deviance":
+            e = np.asarray(model.resid_dev, dtype=float).ravel()
+        else:
+            raise ValueError("resid must be 'pearson' or 'deviance'")
+        self.e = e.reshape((-1, 1))
+        self.two_tailed = two_tailed
+        self.n = n = len(y)
+        X = model.results.X
+        self.k = k = X.shape[1]
+        self.s0 = s0 = self._lag.s0
+
+        ete = np.dot(e, e)
+        ewe = np.dot(e, self._lag.lag(e))
+        self.I = n / s0 * ewe / ete
+
+        trMW, trMWMWt, trMWMW = self.__traces(X, family.weights(mu), chunk_size)
+        self.EI = n / s0 * trMW / (n - k)
+        self.VI = (n / s0) ** 2 * (trMWMWt + trMWMW + trMW**2) / (
+            (n - k) * (n - k + 2)
+        ) - self.EI**2
+        self.seI = self.VI ** (1 / 2.0)
+        self.z = (self.I - self.EI) / self.seI
+        self.p = stats.norm.sf(abs(self.z))
+        if self.two_tailed:
+            self.p *= 2.0
+
+        self.LM = (ewe / (ete / n)) ** 2 / (self._lag.trWtW + self._lag.trWW)
+        self.p_LM = stats.chi2.sf(self.LM, 1)
+
+    def __traces(self, X, weights, chunk_size):
+        # Z = V^(1/2) X R^-1 has orthonormal columns and H = ZZ', so every trace
+        # involving H reduces to sums over the columns of WZ and W'Z
+        if sp.issparse(X):
+            Xw = sp.csr_matrix(X.multiply(np.sqrt(weights).reshape((-1, 1))))
+            G = (Xw.T @ Xw).toarray()
+        else:
+            Xw = np.asarray(X, dtype=float) * np.sqrt(weights).reshape((-1, 1))
+            G = Xw.T @ Xw
+        k = G.shape[0]
+        Rinv = solve_triangular(np.linalg.cholesky(G).T, np.eye(k))
+        trHW = trHWWt = trWtHW = trHWW = 0.0
+        ZtWZ = np.empty((k, k))
+        for start in range(0, k, chunk_size):
+            cols = slice(start, min(start + chunk_size, k))
+            Z = np.asarray(Xw @ Rinv[:, cols])
+            WZ = self._lag.lag(Z)
+            WtZ = self._lag.rlag(Z)
+            trHW += np.sum(Z * WZ)
+            trHWWt += np.sum(WtZ**2)
+            trWtHW += np.sum(WZ**2)
+            trHWW += np.sum(WtZ * WZ)
+            ZtWZ[:, cols] = Rinv.T @ np.asarray(Xw.T @ WZ)
+        lag = self._lag
+        trMW = lag.trW - trHW
+        trMWMWt = lag.trWtW - trHWWt - trWtHW + np.sum(ZtWZ**2)
+        trMWMW = lag.trWW - 2 * trHWW + np.sum(ZtWZ * ZtWZ.T)
+        return trMW, trMWMWt, trMWMW
@@ -1,8 +1,13 @@
 # 3. FlowAccessibility = Accessibility of flow taking existing destinations
 import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
+from scipy import sparse as sp
+from scipy.spatial.distance import cdist
 
 # ----------------------------------------------------------------------
 
@@ -161,18 +166,27 @@ def Accessibility(
     weights : array of numbers
         n x 1; the flow volume column in the origin-destination edgelist
     masses : array of numbers
-        n x 1; the DESTINATION masses column in the origin-destination edgelist
+        n x 1; the DESTINATION masses column in the origin-destination edgelist,
+        or n x K for K mass definitions (e.g. jobs, population, years), which
+        share the existence mask and are computed in one matrix product
     all_destinations : bolean, Deafult is False
         True to consider all the existing destinations as a competing destinations,
         even those where flows does not exist in the data. False to consider only
         those destinations as a competing destinations, which exists in the data.
-        This option is only available for flow data that can be represented
-        as unipartite graph.
+        With is_bipartite, the competing destinations are all the nodes with at
+        least one incoming flow, so nodes that are only origins do not compete.
     is_bipartite : bolean, Deafult is False
         True to predefine the flow graph as bipartite: one where origins and
         destinations are separate entities and where interaction can happen
         only in one direction, from origin to destination.
         False to keep assumption for regular unipartite graph.
+        See bipartite_accessibility for rectangular origin x destination
+        inputs that do not need the COMPLETE edgelist.
+
+    Returns
+    -------
+    accessibility : array
+        n x 1 (or n x K for K columns of masses); accessibility of each flow
     """
 
     # convert numbers to integers
@@ -188,62 +202,710 @@ def Accessibility(
             "but they should all be the same length. See notebook example "
             "if you are unsure what the input should look like "
         )
-    if all_destinations & is_bipartite:
-        raise ValueError("This option has not been implemented yet")
 
     # define number of rows
     nrows = len(dest_nodes)
-    uniques = len(np.unique(np.array(dest_nodes)))
+    uniques = len(pd.unique(dest_nodes))
 
     # create binary for weight
     v_bin = np.ones(nrows)
     weights[np.isnan(weights)] = 0
     v_bin[weights <= 0] = 0
 
-    # define the base matrices
-    distance = distances.reshape(uniques, uniques)
-    mass = masses.reshape(uniques, uniques).T
-
-    # define the identity array
-    idn = np.identity(uniques)
-    idn = np.where((idn == 1), 0, 1)
-    idn = (
-        np.concatenate(uniques * [idn.ravel()], axis=0)
-        .reshape(uniques, uniques, uniques)
-        .T
-    )
+    # dm[y, z, k] = distance from y to z times the k-th mass of y
+    ncols = 1 if masses.ndim == 1 else masses.shape[1]
+    distance = distances.reshape(uniques, uniques, 1)
+    mass = masses.reshape(uniques, uniques, ncols).transpose(1, 0, 2)
+    dm = (distance * mass).astype(float).reshape(uniques, uniques * ncols)
 
-    # multiply the distance by mass
-    dm = distance * mass
-
-    # combine all matrices for either all or existing destinations
-    if is_bipartite:
-        exists = v_bin.reshape(uniques, uniques).T
-        output = (
-            (
-                np.concatenate(uniques * [exists], axis=0)
-                .reshape(uniques, uniques, uniques)
-                .T
-            )
-            * idn
-            * (uniques * [dm])
-        )
-    elif all_destinations:
+    # the accessibility of the flow from x to z sums dm[y, z] over the
+    # competing nodes y != x, which is a (masked) matrix product minus the
+    # diagonal correction for y == x, so only O(N^2 K) memory is used; the K
+    # mass columns are stacked so that all of them take a single product
+    if all_destinations and is_bipartite:
+        # only nodes that receive a flow are destinations that can compete
         exists = v_bin.reshape(uniques, uniques)
-        output = idn * (nrows * [dm])
+        is_dest = exists.any(axis=0).astype(float)
+        output = (is_dest @ dm)[None, :] - is_dest[:, None] * dm
+    elif all_destinations:
+        output = dm.sum(axis=0)[None, :] - dm
     else:
         exists = v_bin.reshape(uniques, uniques)
-        output = (
-            (
-                np.concatenate(uniques * [exists], axis=0)
-                .reshape(uniques, uniques, uniques)
-                .T
-            )
-            * idn
-            * (uniques * [dm])
-        )
+        if not is_bipartite:
+            exists = exists.T
+        # sparse flows only cost O(nnz) in the product
+        if np.count_nonzero(v_bin) < 0.1 * nrows:
+            exists = sp.csr_matrix(exists)
+        output = exists @ dm - exists.diagonal()[:, None] * dm
 
     # get the sum and covert to series
-    output = (np.sum(output, axis=1)).reshape(nrows).T
+    output = output.reshape((nrows, ncols) if masses.ndim > 1 else nrows)
 
     return output
+
+
+def competing_destinations(origins, destinations, cost, masses, decay="pow"):
+    """
+    Competing destinations accessibility term for each flow of a unipartite
+    origin-destination edgelist, A_ij = sum_{k != i, j} m_k f(c_jk), i.e. the
+    accessibility of destination j to all other destinations k, excluding the
+    origin i. The separation c_jk is the cost of the flow from j to k in the
+    edgelist, so destinations that j has no flow to do not compete. Computed as
+    the row sums of a sparse node x node matrix minus the origin's own term, so
+    memory is linear in the number of flows.
+
+    Parameters
+    ----------
+    origins : array of strings or numeric codes
+        n x 1; the ORIGIN column in the origin-destination edgelist
+    destinations : array of strings or numeric codes
+        n x 1; the DESTINATION column in the origin-destination edgelist
+    cost : array of numbers
+        n x 1; the cost (e.g. distance) column in the origin-destination edgelist
+    masses : array of numbers
+        n x 1; the DESTINATION masses column in the origin-destination edgelist
+    decay : string or function, Default is 'pow'
+        distance-decay function f of the cost; 'pow' for 1/c, 'exp' for exp(-c),
+        None for c, or a function (e.g. a numpy ufunc) applied to the cost array
+
+    Returns
+    -------
+    accessibility : array
+        n x 1; competing destinations accessibility of each flow
+    """
+    origins = np.asarray(origins).ravel()
+    destinations = np.asarray(destinations).ravel()
+    cost = np.asarray(cost, dtype=float).ravel()
+    masses = np.asarray(masses, dtype=float).ravel()
+    n = len(origins)
+    if not (len(destinations) == len(cost) == len(masses) == n):
+        raise ValueError(
+            "One of the input array is different length then the others, "
+            "but they should all be the same length."
+        )
+    if decay == "pow" and (cost[origins != destinations] == 0).any():
+        raise ValueError(
+            "Zero values detected: decay 'pow' requires the inverse of the"
+            " cost which is undefined at 0"
+        )
+    f = _decay(cost, decay)
+
+    nodes, codes = np.unique(
+        np.concatenate((origins, destinations)), return_inverse=True
+    )
+    o, d = codes[:n], codes[n:]
+    m = np.zeros(len(nodes))
+    m[d] = masses
+    keep = o != d
+    # D[j, k] = m_k f(c_jk) for the flows j -> k
+    D = sp.csr_matrix(
+        (m[d[keep]] * f[keep], (o[keep], d[keep])), shape=(len(nodes), len(nodes))
+    )
+    total = np.asarray(D.sum(axis=1)).ravel()
+    own = np.asarray(D[d, o]).ravel()
+    return (total[d] - own).reshape((-1, 1))
+
+
+def sparse_accessibility(
+    origins,
+    destinations,
+    distances,
+    masses,
+    weights=None,
+    all_destinations=False,
+    is_bipartite=False,
+    chunk_size=100000,
+):
+    """
+    Accessibility for Competing Destination model from an incomplete
+    origin-destination edgelist that only holds the observed pairs, in any row
+    order. Results are those of Accessibility on the COMPLETE edgelist in which
+    the missing pairs have no flow and a distance of 0, returned for the input
+    rows only. The edgelist is never densified: sparse node x node matrices of
+    the flows and of distance times mass are combined row by row, so memory is
+    O(nnz) rather than O(N^2).
+
+    Parameters
+    ----------
+    origins : array of strings or numeric codes
+        n x 1; the ORIGIN column in the origin-destination edgelist
+    destinations : array of strings or numeric codes
+        n x 1; the DESTINATION column in the origin-destination edgelist
+    distances : array of numbers
+        n x 1; the distance column in the origin-destination edgelist
+    masses : array of numbers
+        n x 1; the DESTINATION masses column in the origin-destination edgelist;
+        nodes that are never a destination have a mass of 0
+    weights : array of numbers, Default is None
+        n x 1; the flow volume column in the origin-destination edgelist; rows
+        with volume of 0 (or NaN) do not count as existing flows. None treats
+        every row as an existing flow
+    all_destinations : bolean, Deafult is False
+        True to consider all the destinations as a competing destinations,
+        even those where flows does not exist in the data. With is_bipartite,
+        the competing destinations are all the nodes with at least one incoming
+        flow, so nodes that are only origins do not compete.
+    is_bipartite : bolean, Deafult is False
+        True to predefine the flow graph as bipartite: one where origins and
+        destinations are separate entities and where interaction can happen
+        only in one direction, from origin to destination.
+    chunk_size : int, Default is 100000
+        number of rows computed at once
+
+    Returns
+    -------
+    accessibility : array
+        n x 1; accessibility of each row of the edgelist
+    """
+    origins = np.asarray(origins).ravel()
+    destinations = np.asarray(destinations).ravel()
+    distances = np.asarray(distances, dtype=float).ravel()
+    masses = np.asarray(masses, dtype=float).ravel()
+    n = len(origins)
+    if weights is None:
+        weights = np.ones(n)
+    weights = np.nan_to_num(np.asarray(weights, dtype=float).ravel())
+    if not (len(destinations) == len(distances) == len(masses) == len(weights) == n):
+        raise ValueError(
+            "One of the input array is different length then the others, "
+            "but they should all be the same length."
+        )
+
+    nodes, codes = np.unique(
+        np.concatenate((origins, destinations)), return_inverse=True
+    )
+    N = len(nodes)
+    o, d = codes[:n], codes[n:]
+    m = np.zeros(N)
+    m[d] = masses
+
+    # dm[y, z] = distance from y to z times the mass of y
+    dm = sp.csr_matrix((distances * m[o], (o, d)), shape=(N, N))
+    if all_destinations:
+        is_dest = np.ones(N)
+        if is_bipartite:
+            # only nodes that receive a flow are destinations that can compete
+            is_dest = np.zeros(N)
+            is_dest[d[weights > 0]] = 1.0
+        total = dm.T @ is_dest
+        return (total[d] - is_dest[o] * distances * m[o]).reshape((-1, 1))
+
+    # competitors of the flow from x are the nodes y != x with a flow to x
+    # (unipartite) or from x (bipartite)
+    keep = (weights > 0) & (o != d)
+    rows, cols = (o, d) if is_bipartite else (d, o)
+    exists = sp.csr_matrix(
+        (np.ones(keep.sum()), (rows[keep], cols[keep])), shape=(N, N)
+    )
+    exists.data[:] = 1.0
+    dmt = dm.T.tocsr()
+    output = np.empty(n)
+    for start in range(0, n, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        output[chunk] = np.asarray(
+            exists[o[chunk]].multiply(dmt[d[chunk]]).sum(axis=1)
+        ).ravel()
+    return output.reshape((-1, 1))
+
+
+def bipartite_accessibility(
+    weights, distances, masses, all_destinations=False, chunk_size=1000
+):
+    """
+    Accessibility for Competing Destination model for bipartite flows between
+    disjoint sets of o origins and d destinations (e.g. housing to jobs) given
+    as rectangular o x d flows and d x d distances between the destinations.
+    The accessibility of the flow from origin x to destination z sums distance
+    times mass, d_yz m_y, over the competing destinations y != z: all
+    destinations, or those with a flow from x. This is the bipartite option of
+    Accessibility without the COMPLETE node x node edgelist: A = E (D * m)
+    minus the own term E_xz d_zz m_z, where E is the o x d flow indicator
+    matrix, computed in chunks of origins so no o x d x d tensor is built.
+    With all destinations every row of A is the column sums of D * m minus
+    the own term.
+
+    Parameters
+    ----------
+    weights : array of numbers or sparse matrix
+        o x d; the flow volumes, where a volume of 0 (or NaN) denotes a flow
+        that does not exist in the data; only its shape is used if
+        all_destinations is True
+    distances : array of numbers
+        d x d; distances from each destination y to each destination z; may be
+        a memory-mapped array
+    masses : array of numbers
+        d x 1; the destination masses, or d x K for K mass definitions
+    all_destinations : bolean, Deafult is False
+        True to consider all the destinations as a competing destinations,
+        even those where flows does not exist in the data. False to consider
+        only the destinations that the origin has a flow to.
+    chunk_size : int, Default is 1000
+        number of origins computed at once
+
+    Returns
+    -------
+    accessibility : array
+        o x d (or o x d x K for K > 1 columns of masses); accessibility of each
+        flow, with the dtype of the distances and masses if floating point,
+        otherwise float64
+    """
+    o, d = weights.shape
+    masses = np.asarray(masses)
+    masses = masses.reshape((len(masses), -1))
+    k = masses.shape[1]
+    if len(masses) != d:
+        raise ValueError("Number of masses does not match number of destinations")
+    if distances.shape != (d, d):
+        raise ValueError("distances must be d x d for the d columns of weights")
+    dtype = np.result_type(distances.dtype, masses.dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    masses = masses.astype(dtype)
+    distances = np.asarray(distances, dtype=dtype)
+    # own term d_zz m_z of each destination
+    own = np.diagonal(distances)[:, None] * masses
+
+    output = np.empty((o, d) if k == 1 else (o, d, k), dtype=dtype)
+    if all_destinations:
+        output[:] = ((masses.T @ distances).T - own).reshape(output.shape[1:])
+        return output
+    for start in range(0, o, chunk_size):
+        rows = slice(start, min(start + chunk_size, o))
+        if sp.issparse(weights):
+            # sparse flows only cost O(nnz) in the product
+            exists = sp.csr_matrix(weights[rows], dtype=dtype)
+            exists.data = (np.nan_to_num(exists.data) > 0).astype(dtype)
+            exists.eliminate_zeros()
+        else:
+            exists = _links(weights, rows).astype(dtype)
+        for j in range(k):
+            # E (D * m) as (E * m) D, so D * m is never formed
+            if sp.issparse(exists):
+                total = exists.multiply(masses[:, j]).tocsr() @ distances
+                own_j = exists.multiply(own[:, j]).toarray()
+            else:
+                total = (exists * masses[:, j]) @ distances
+                own_j = exists * own[:, j]
+            output.reshape((o, d, k))[rows, :, j] = total - own_j
+    return output
+
+
+def decay_accessibility(
+    distances,
+    masses,
+    weights=None,
+    decay="pow",
+    beta=1.0,
+    exclude_self=True,
+    per_flow=False,
+    chunk_size=1000,
+):
+    """
+    Accessibility of o origins to d destinations with distance decay,
+    A_i = sum_j E_ij f(d_ij) m_j, from o x d matrices of floats. The decay is
+    evaluated once per OD cell in a vectorised pass over chunks of origins, in
+    the precision of the inputs: float32 distances and masses give float32
+    results with half the memory of float64, and nothing is cast to int.
+    Several mass definitions are passed as the columns of a d x K matrix and
+    share the decay and existence mask, so all of them take a single
+    matrix-matrix product per chunk.
+
+    Parameters
+    ----------
+    distances : array of numbers
+        o x d; distances (or travel times) from each origin to each destination;
+        may be a memory-mapped array
+    masses : array of numbers
+        d x 1; the destination masses, or d x K for K mass definitions
+    weights : array of numbers or sparse matrix, Default is None
+        o x d; the flow volumes; destinations without a flow from an origin
+        (volume of 0) are not accessible from it. None makes every destination
+        accessible
+    decay : string or function, Default is 'pow'
+        distance-decay function f; 'pow' for d^-beta, 'exp' for exp(-beta * d),
+        None for the linear distance * mass weighting of Accessibility, or a
+        function (e.g. a numpy ufunc) applied to a chunk of distances
+    beta : float, Default is 1.0
+        distance-decay parameter of 'pow' and 'exp'
+    exclude_self : bolean, Default is True
+        True to exclude j == i, i.e. the diagonal of square matrices where
+        origins and destinations are the same nodes
+    per_flow : bolean, Default is False
+        True to return the competing destinations accessibility of each flow,
+        A_i - E_iz f(d_iz) m_z, i.e. excluding the destination z of the flow
+    chunk_size : int, Default is 1000
+        number of origins computed at once
+
+    Returns
+    -------
+    accessibility : array
+        o x K (or o x d if per_flow, o x d x K for K > 1 columns of masses);
+        accessibility with the dtype of the distances and masses if floating
+        point, otherwise float64
+    """
+    o, d = distances.shape
+    masses = np.asarray(masses)
+    masses = masses.reshape((len(masses), -1))
+    k = masses.shape[1]
+    if len(masses) != d:
+        raise ValueError("Number of masses does not match number of destinations")
+    if weights is not None and weights.shape != (o, d):
+        raise ValueError("weights and distances must have the same shape")
+    dtype = np.result_type(distances.dtype, masses.dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    masses = masses.astype(dtype)
+    if per_flow:
+        output = np.empty((o, d) if k == 1 else (o, d, k), dtype=dtype)
+    else:
+        output = np.empty((o, k), dtype=dtype)
+    for start in range(0, o, chunk_size):
+        rows = slice(start, min(start + chunk_size, o))
+        f = _decayed_rows(
+            np.asarray(distances[rows], dtype=dtype),
+            start,
+            _links(weights, rows),
+            decay,
+            beta,
+            exclude_self,
+        )
+        total = f @ masses
+        if per_flow:
+            fm = f[:, :, None] * masses[None, :, :]
+            output[rows] = (total[:, None, :] - fm).reshape(output[rows].shape)
+        else:
+            output[rows] = total
+    return output
+
+
+def chunked_accessibility(
+    distances,
+    masses,
+    weights=None,
+    decay="pow",
+    beta=1.0,
+    exclude_self=True,
+    coordinates=None,
+    metric="euclidean",
+    chunk_size=1000,
+    n_jobs=1,
+):
+    """
+    Accessibility of o origins to d destinations with distance decay,
+    A_i = sum_j E_ij f(d_ij) m_j (see decay_accessibility), for grids too large
+    to hold the o x d distances in memory. Row blocks of distances are streamed
+    from a .npy file opened as a memory map, or computed on the fly from the
+    coordinates of the origins and destinations, and only the o x K results
+    are accumulated, so memory is bounded by chunk_size x d per worker. Row
+    blocks can be spread across a pool of n_jobs processes.
+
+    Parameters
+    ----------
+    distances : array, path or None
+        o x d; distances from each origin to each destination, as an array
+        (possibly memory-mapped) or the path of a .npy file, which is opened
+        with mmap_mode='r' by each worker; None to compute the distances from
+        coordinates
+    masses : array of numbers
+        d x 1; the destination masses, or d x K for K mass definitions
+    weights : array of numbers or sparse matrix, Default is None
+        o x d; the flow volumes; destinations without a flow from an origin
+        (volume of 0) are not accessible from it. None makes every destination
+        accessible
+    decay : string or function, Default is 'pow'
+        distance-decay function f; 'pow' for d^-beta, 'exp' for exp(-beta * d),
+        None for linear distance * mass, or a function (e.g. a numpy ufunc)
+        applied to a chunk of distances, which must be picklable if n_jobs > 1
+    beta : float, Default is 1.0
+        distance-decay parameter of 'pow' and 'exp'
+    exclude_self : bolean, Default is True
+        True to exclude j == i, i.e. the diagonal of square matrices where
+        origins and destinations are the same nodes
+    coordinates : array or tuple of arrays, Default is None
+        n x 2 coordinates of nodes that are both origins and destinations, or
+        a tuple of o x 2 origin and d x 2 destination coordinates; only used
+        if distances is None
+    metric : string, Default is 'euclidean'
+        distance metric of scipy.spatial.distance.cdist for coordinates
+    chunk_size : int, Default is 1000
+        number of origins computed at once
+    n_jobs : int, Default is 1
+        number of worker processes; 1 computes all blocks in this process
+
+    Returns
+    -------
+    accessibility : array
+        o x K; accessibility with the dtype of the distances (or coordinates)
+        and masses if floating point, otherwise float64
+    """
+    if distances is None:
+        if coordinates is None:
+            raise ValueError("Either distances or coordinates are required")
+        if not isinstance(coordinates, tuple):
+            coordinates = (coordinates, coordinates)
+        source = tuple(np.asarray(c) for c in coordinates)
+        shape = (len(source[0]), len(source[1]))
+        dtype = np.result_type(source[0].dtype, source[1].dtype)
+    elif isinstance(distances, (str, os.PathLike)):
+        source = os.fspath(distances)
+        header = np.load(source, mmap_mode="r")
+        shape, dtype = header.shape, header.dtype
+        del header
+    else:
+        source = distances
+        shape, dtype = distances.shape, distances.dtype
+    o, d = shape
+    masses = np.asarray(masses)
+    masses = masses.reshape((len(masses), -1))
+    if len(masses) != d:
+        raise ValueError("Number of masses does not match number of destinations")
+    if weights is not None and weights.shape != (o, d):
+        raise ValueError("weights and distances must have the same shape")
+    dtype = np.result_type(dtype, masses.dtype)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    masses = masses.astype(dtype)
+
+    def blocks():
+        for start in range(0, o, chunk_size):
+            rows = slice(start, min(start + chunk_size, o))
+            # in-memory arrays are sliced here, files and coordinates are
+            # read by the worker
+            block = source[rows] if hasattr(source, "shape") else source
+            yield (block, rows, _links(weights, rows))
+
+    args = (masses, decay, beta, exclude_self, metric, dtype)
+    output = np.empty((o, masses.shape[1]), dtype=dtype)
+    if n_jobs == 1:
+        for block, rows, links in blocks():
+            output[rows] = _accessibility_block(block, rows, links, *args)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            # at most 2 * n_jobs row blocks are pending at any time
+            pending = deque()
+            for block, rows, links in blocks():
+                pending.append(
+                    (rows, pool.submit(_accessibility_block, block, rows, links, *args))
+                )
+                if len(pending) >= 2 * n_jobs:
+                    rows, future = pending.popleft()
+                    output[rows] = future.result()
+            while pending:
+                rows, future = pending.popleft()
+                output[rows] = future.result()
+    return output
+
+
+def _accessibility_block(
+    source, rows, links, masses, decay, beta, exclude_self, metric, dtype
+):
+    # accessibility of one row block of origins; module-level so that it can
+    # run in a worker process
+    if isinstance(source, str):
+        distances = np.load(source, mmap_mode="r")[rows]
+    elif isinstance(source, tuple):
+        distances = cdist(source[0][rows], source[1], metric=metric)
+    else:
+        distances = source
+    f = _decayed_rows(
+        np.asarray(distances, dtype=dtype), rows.start, links, decay, beta, exclude_self
+    )
+    return f @ masses
+
+
+def _links(weights, rows):
+    # dense boolean links of a row block, or None if all links exist
+    if weights is None:
+        return None
+    exists = weights[rows]
+    exists = exists.toarray() if sp.issparse(exists) else np.asarray(exists)
+    return np.nan_to_num(exists) > 0
+
+
+def _decayed_rows(distances, start, links, decay, beta, exclude_self):
+    # decayed distances of the row block of origins start, start + 1, ...
+    f = _decay(distances, decay, beta)
+    if exclude_self:
+        diag = np.arange(start, min(start + len(f), f.shape[1]))
+        f[diag - start, diag] = 0
+    if links is not None:
+        f *= links
+    if not np.isfinite(f).all():
+        raise ValueError(
+            "Non-finite distance decay detected, e.g. decay 'pow' at a distance of 0"
+        )
+    return f
+
+
+def _decay(distances, decay, beta=1.0):
+    # evaluate the distance decay in the precision of the distances
+    beta = distances.dtype.type(beta)
+    if decay is None:
+        return np.array(distances, copy=True)
+    if decay == "pow":
+        with np.errstate(divide="ignore"):
+            return np.power(distances, -beta)
+    if decay == "exp":
+        return np.exp(-beta * distances)
+    if callable(decay):
+        # copied, as callers zero excluded cells of the result in place
+        return np.array(decay(distances), dtype=distances.dtype, copy=True)
+    raise ValueError("decay must be 'pow', 'exp', None or a function")
+
+
+class IncrementalAccessibility:
+    """
+    Stateful accessibility of o origins to d destinations with distance decay,
+    A_i = sum_j E_ij f(d_ij) m_j (see decay_accessibility), for scenario
+    analysis. The decayed distances f(d_ij), the links E_ij and the current
+    sums are cached, so changing the mass of a destination is a rank-one update
+    of A costing O(o), and changing a link or a distance costs O(1), instead of
+    recomputing the O(o * d) sums.
+
+    Parameters
+    ----------
+    distances : array of numbers
+        o x d; distances (or travel times) from each origin to each destination
+    masses : array of numbers
+        d x 1; the destination masses
+    weights : array of numbers or sparse matrix, Default is None
+        o x d; the flow volumes; destinations without a flow from an origin
+        (volume of 0) are not accessible from it. None makes every destination
+        accessible
+    decay : string or function, Default is 'pow'
+        distance-decay function f; 'pow' for d^-beta, 'exp' for exp(-beta * d),
+        None for linear distance * mass, or a function (e.g. a numpy ufunc)
+    beta : float, Default is 1.0
+        distance-decay parameter of 'pow' and 'exp'
+    exclude_self : bolean, Default is True
+        True to exclude j == i, i.e. the diagonal of square matrices where
+        origins and destinations are the same nodes
+    chunk_size : int, Default is 1000
+        number of origins computed at once when the cache is built
+
+    Attributes
+    ----------
+    accessibility : array
+        o x 1; current accessibility of each origin
+    masses : array
+        d x 1; current destination masses
+    decayed : array
+        o x d; cached decayed distances f(d_ij), 0 where j == i is excluded
+    links : array
+        o x d; boolean links E_ij, or None if every destination is accessible
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from spint.flow_accessibility import IncrementalAccessibility
+    >>> distances = np.array([[0.0, 1.0, 2.0], [1.0, 0.0, 4.0], [2.0, 4.0, 0.0]])
+    >>> acc = IncrementalAccessibility(distances, [10.0, 20.0, 40.0])
+    >>> acc.accessibility.ravel()
+    array([40., 20., 10.])
+    >>> acc.set_mass(2, 80.0)
+    >>> acc.accessibility.ravel()
+    array([60., 30., 10.])
+    """
+
+    def __init__(
+        self,
+        distances,
+        masses,
+        weights=None,
+        decay="pow",
+        beta=1.0,
+        exclude_self=True,
+        chunk_size=1000,
+    ):
+        o, d = distances.shape
+        masses = np.asarray(masses).ravel()
+        if len(masses) != d:
+            raise ValueError("Number of masses does not match number of destinations")
+        if weights is not None and weights.shape != (o, d):
+            raise ValueError("weights and distances must have the same shape")
+        dtype = np.result_type(distances.dtype, masses.dtype)
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+        self.decay = decay
+        self.beta = beta
+        self.exclude_self = exclude_self
+        self.masses = masses.astype(dtype)
+        self.decayed = np.empty((o, d), dtype=dtype)
+        self.links = None if weights is None else np.empty((o, d), dtype=bool)
+        self.accessibility = np.empty((o, 1), dtype=dtype)
+        for start in range(0, o, chunk_size):
+            rows = slice(start, min(start + chunk_size, o))
+            # links are cached separately so that they can be changed later
+            self.decayed[rows] = _decayed_rows(
+                np.asarray(distances[rows], dtype=dtype),
+                start,
+                None,
+                decay,
+                beta,
+                exclude_self,
+            )
+            if weights is not None:
+                self.links[rows] = _links(weights, rows)
+        self.refresh(chunk_size)
+
+    def _decay(self, distances):
+        return _decay(distances, self.decay, self.beta)
+
+    def _column(self, j):
+        column = self.decayed[:, j]
+        return column if self.links is None else column * self.links[:, j]
+
+    def refresh(self, chunk_size=1000):
+        """
+        Recompute the sums from the cache, e.g. to remove the rounding errors
+        accumulated over many updates
+        """
+        o = self.decayed.shape[0]
+        for start in range(0, o, chunk_size):
+            rows = slice(start, min(start + chunk_size, o))
+            kernel = self.decayed[rows]
+            if self.links is not None:
+                kernel = kernel * self.links[rows]
+            self.accessibility[rows, 0] = kernel @ self.masses
+
+    def set_mass(self, j, mass):
+        """
+        Change the mass of destination(s) j; O(o) per destination
+        """
+        for dest, new in zip(np.atleast_1d(j), np.atleast_1d(mass), strict=True):
+            change = self.masses.dtype.type(new) - self.masses[dest]
+            self.accessibility[:, 0] += self._column(dest) * change
+            self.masses[dest] = new
+
+    def set_link(self, i, j, exists=True):
+        """
+        Add (exists=True) or remove (exists=False) the link from origin i to
+        destination j; O(1)
+        """
+        if self.links is None:
+            self.links = np.ones(self.decayed.shape, dtype=bool)
+        if self.links[i, j] != bool(exists):
+            sign = 1 if exists else -1
+            self.accessibility[i, 0] += sign * self.decayed[i, j] * self.masses[j]
+            self.links[i, j] = bool(exists)
+
+    def set_distance(self, i, j, distance):
+        """
+        Change the distance from origin i to destination j; O(1)
+        """
+        if self.exclude_self and i == j:
+            return
+        decayed = self._decay(np.asarray([distance], dtype=self.decayed.dtype))[0]
+        if not np.isfinite(decayed):
+            raise ValueError("Non-finite distance decay detected")
+        if self.links is None or self.links[i, j]:
+            self.accessibility[i, 0] += (decayed - self.decayed[i, j]) * self.masses[j]
+        self.decayed[i, j] = decayed
+
+    def per_flow(self):
+        """
+        Competing destinations accessibility of each flow, A_i - E_iz f(d_iz) m_z,
+        i.e. excluding the destination z of the flow; o x d
+        """
+        kernel = self.decayed if self.links is None else self.decayed * self.links
+        return self.accessibility - kernel * self.masses
@@ -25,6 +25,10 @@ from spreg import (
 from spreg.utils import sphstack
 
 from .count_model import CountModel
+from .eigenfilter import EigenFilter
+from .flow_accessibility import competing_destinations
+from .flow_SA import FlowMoranResid
+from .od_lag import ODLag
 from .utils import sorensen, spcategorical, srmse
 
 
@@ -61,21 +65,29 @@ class BaseGravity(CountModel):
                       True to estimate QuasiPoisson model; should result in same
                       parameters as Poisson but with altered covariance; default
                       to true which estimates Poisson model
-    SF              : array
-                      n x 1; eigenvector spatial filter to include in the model;
-                      default to None which does not include a filter; not yet
-                      implemented
-    CD              : array
-                      n x 1; competing destination term that accounts for the
+    SF              : array, EigenFilter or spatial weight
+                      n x q eigenvectors to include in the model as a spatial
+                      filter, or an EigenFilter (or a spatial weight for the OD
+                      pairs, e.g. ODW or netW, used with the EigenFilter
+                      defaults) from which eigenvectors are selected; default to
+                      None which does not include a filter
+    CD              : boolean, string, function or array
+                      competing destination term that accounts for the
                       likelihood that alternative destinations are considered
                       along with each destination under consideration for every
-                      OD pair; defaults to None which does not include a CD
-                      term; not yet implemented
-    Lag             : W object
-                      spatial weight for n observations (OD pairs) used to
-                      construct a spatial autoregressive model and estimator;
-                      defaults to None which does not include an autoregressive
-                      term; not yet implemented
+                      OD pair, included as a log covariate; True, 'pow', 'exp'
+                      or a decay function computes the term from the origins,
+                      destinations, cost and first destination variable (mass)
+                      of the model (see competing_destinations; True is 'pow'),
+                      or an n x 1 array gives the term directly; defaults to
+                      None which does not include a CD term
+    Lag             : ODW object
+                      origin-destination weight for the n observations (OD
+                      pairs) used to construct a spatial autoregressive model
+                      with origin, destination and network dependence that is
+                      estimated by maximum likelihood on the logged flows (see
+                      ODLag); defaults to None which does not include an
+                      autoregressive term
 
 
     Attributes
@@ -140,6 +152,16 @@ class BaseGravity(CountModel):
                       standardized root mean square error
     SSI             : float
                       Sorensen similarity index
+    cd              : array
+                      (if CD) n x 1; competing destinations term
+    SF              : array or EigenFilter
+                      spatial filter included in the model; for an
+                      EigenFilter, SF.vectors holds the selected eigenvectors
+    rho             : array
+                      (if Lag) estimated origin, destination and network
+                      autoregressive parameters; also the last three params.
+                      Deviance-based attributes are not available for Lag
+                      models
     results         : object
                       full results from estimated model. May contain addtional
                       diagnostics
@@ -262,23 +284,52 @@ class BaseGravity(CountModel):
             X = X[:, 1:]  # because empty array instantiated with extra column
         if not isinstance(self, (Gravity, Production, Attraction, Doubly)):
             X = self.cf(np.reshape(self.c, (-1, 1)))
-        if SF:
-            raise NotImplementedError("Spatial filter model not yet implemented")
-        if CD:
-            raise NotImplementedError("Competing destination model not yet implemented")
-        if Lag:
-            raise NotImplementedError(
-                "Spatial Lag autoregressive model not yet implemented"
-            )
-
-        CountModel.__init__(self, y, X, constant=constant)
-        if framework.lower() == "glm":
-            if not Quasi:
-                results = self.fit(framework="glm")
+        if SF is not None and (isinstance(SF, np.ndarray) or sp.issparse(SF)):
+            X = self._add_columns(X, SF)
+        if CD is not None and CD is not False:
+            if isinstance(CD, np.ndarray):
+                self.cd = np.reshape(CD, (-1, 1))
             else:
-                results = self.fit(framework="glm", Quasi=True)
-        else:
+                if origins is None or destinations is None or self.dv is None:
+                    raise ValueError(
+                        "Competing destinations term requires origins, destinations"
+                        " and destination variables"
+                    )
+                self.cd = competing_destinations(
+                    origins,
+                    destinations,
+                    self.c,
+                    self.dv[:, 0],
+                    decay="pow" if CD is True else CD,
+                )
+            if (self.cd <= 0).any():
+                raise ValueError(
+                    "Zero values detected in competing destinations term, which"
+                    " are undefined for Poisson log-linear spatial interaction"
+                    " models"
+                )
+            X = self._add_columns(X, np.log(self.cd))
+        if Lag is not None and SF is not None:
+            raise ValueError("Spatial filter and spatial lag terms cannot be combined")
+
+        if framework.lower() != "glm":
             raise NotImplementedError("Only GLM is currently implemented")
+        CountModel.__init__(self, y, X, constant=constant)
+        if Lag is not None:
+            results = ODLag(self.y, self.X, Lag, constant=constant)
+        else:
+            results = self.fit(framework="glm", Quasi=Quasi)
+        if SF is not None and not (isinstance(SF, np.ndarray) or sp.issparse(SF)):
+            if not isinstance(SF, EigenFilter):
+                SF = EigenFilter(SF)
+            if SF.n != self.n:
+                raise ValueError("Number of flows does not match spatial weight, W")
+            vectors = SF.select(results.y, results.X, results.yhat)
+            if vectors.shape[1]:
+                X = self._add_columns(X, vectors)
+                CountModel.__init__(self, y, X, constant=constant)
+                results = self.fit(framework="glm", Quasi=Quasi)
+        self.SF = SF
 
         self.params = results.params
         self.yhat = results.yhat
@@ -286,16 +337,19 @@ class BaseGravity(CountModel):
         self.std_err = results.std_err
         self.pvalues = results.pvalues
         self.tvalues = results.tvalues
-        self.deviance = results.deviance
-        self.resid_dev = results.resid_dev
         self.llf = results.llf
-        self.llnull = results.llnull
         self.AIC = results.AIC
         self.k = results.k
-        self.D2 = results.D2
-        self.adj_D2 = results.adj_D2
-        self.pseudoR2 = results.pseudoR2
-        self.adj_pseudoR2 = results.adj_pseudoR2
+        if Lag is not None:
+            self.rho = results.rho
+        else:
+            self.deviance = results.deviance
+            self.resid_dev = results.resid_dev
+            self.llnull = results.llnull
+            self.D2 = results.D2
+            self.adj_D2 = results.adj_D2
+            self.pseudoR2 = results.pseudoR2
+            self.adj_pseudoR2 = results.adj_pseudoR2
         self.results = results
         self._cache = {}
 
@@ -307,6 +361,47 @@ class BaseGravity(CountModel):
     def SRMSE(self):
         return srmse(self)
 
+    def resid_moran(self, w, resid="pearson", chunk_size=64, two_tailed=True):
+        """
+        Test the residuals of the fitted model for spatial autocorrelation using
+        Moran's I and a Lagrange multiplier test; the fitted means and IRLS
+        weights are reused, so the model is not refitted. Not available for
+        models fitted with a spatial lag (Lag), which are not GLMs
+
+        Parameters
+        ----------
+        w               : ODW, W, WSP, sparse matrix or LinearOperator
+                          n x n spatial weight for the origin-destination pairs
+                          in the same order as the flows
+        resid           : string
+                          'pearson' (default) | 'deviance'; residuals to test
+        chunk_size      : int
+                          number of columns of X lagged at once; default is 64
+        two_tailed      : boolean
+                          If True (default) the p-value for Moran is two tailed
+
+        Returns
+        -------
+        results         : FlowMoranResid
+                          Moran's I (I, EI, VI, z, p) and LM test (LM, p_LM)
+        """
+        if isinstance(self.results, ODLag):
+            raise ValueError(
+                "Residual Moran's I requires a GLM fit and is not available for"
+                " models fitted with a spatial lag (Lag)"
+            )
+        return FlowMoranResid(
+            self, w, resid=resid, chunk_size=chunk_size, two_tailed=two_tailed
+        )
+
+    def _add_columns(self, X, columns):
+        if sp.issparse(columns):
+            columns = columns.toarray()
+        columns = np.reshape(columns, (self.n, -1))
+        if not sp.issparse(X):
+            return np.hstack((X, columns))
+        return sphstack(X, sp.csr_matrix(columns), array_out=False)
+
     def reshape(self, array):
         if isinstance(array, np.ndarray):
             return array.reshape((-1, 1))
@@ -347,21 +442,35 @@ class Gravity(BaseGravity):
                       True to estimate QuasiPoisson model; should result in same
                       parameters as Poisson but with altered covariance; default
                       to true which estimates Poisson model
-    SF              : array
-                      n x 1; eigenvector spatial filter to include in the model;
-                      default to None which does not include a filter; not yet
-                      implemented
-    CD              : array
-                      n x 1; competing destination term that accounts for the
+    SF              : array, EigenFilter or spatial weight
+                      n x q eigenvectors to include in the model as a spatial
+                      filter, or an EigenFilter (or a spatial weight for the OD
+                      pairs, e.g. ODW or netW, used with the EigenFilter
+                      defaults) from which eigenvectors are selected; default to
+                      None which does not include a filter
+    CD              : boolean, string, function or array
+                      competing destination term that accounts for the
                       likelihood that alternative destinations are considered
                       along with each destination under consideration for every
-                      OD pair; defaults to None which does not include a CD
-                      term; not yet implemented
-    Lag             : W object
-                      spatial weight for n observations (OD pairs) used to
-                      construct a spatial autoregressive model and estimator;
-                      defaults to None which does not include an autoregressive
-                      term; not yet implemented
+                      OD pair, included as a log covariate; True, 'pow', 'exp'
+                      or a decay function computes the term from the origins,
+                      destinations, cost and first destination variable (mass)
+                      of the model (see competing_destinations; True is 'pow'),
+                      or an n x 1 array gives the term directly; defaults to
+                      None which does not include a CD term
+    Lag             : ODW object
+                      origin-destination weight for the n observations (OD
+                      pairs) used to construct a spatial autoregressive model
+                      with origin, destination and network dependence that is
+                      estimated by maximum likelihood on the logged flows (see
+                      ODLag); defaults to None which does not include an
+                      autoregressive term
+    origins         : array of strings (optional)
+                      n x 1; unique identifiers of origins of n flows; only
+                      used for the CD term; default is None
+    destinations    : array of strings (optional)
+                      n x 1; unique identifiers of destinations of n flows;
+                      only used for the CD term; default is None
 
     Attributes
     ----------
@@ -457,6 +566,8 @@ class Gravity(BaseGravity):
         CD=None,
         Lag=None,
         Quasi=False,
+        origins=None,
+        destinations=None,
     ):
         self.f = np.reshape(flows, (-1, 1))
         p = o_vars.shape[1] if len(o_vars.shape) > 1 else 1
@@ -473,6 +584,8 @@ class Gravity(BaseGravity):
             cost_func=cost_func,
             o_vars=self.ov,
             d_vars=self.dv,
+            origins=origins,
+            destinations=destinations,
             constant=constant,
             framework=framework,
             SF=SF,
@@ -572,21 +685,32 @@ class Production(BaseGravity):
                       True to estimate QuasiPoisson model; should result in same
                       parameters as Poisson but with altered covariance; default
                       to true which estimates Poisson model
-    SF              : array
-                      n x 1; eigenvector spatial filter to include in the model;
-                      default to None which does not include a filter; not yet
-                      implemented
-    CD              : array
-                      n x 1; competing destination term that accounts for the
+    SF              : array, EigenFilter or spatial weight
+                      n x q eigenvectors to include in the model as a spatial
+                      filter, or an EigenFilter (or a spatial weight for the OD
+                      pairs, e.g. ODW or netW, used with the EigenFilter
+                      defaults) from which eigenvectors are selected; default to
+                      None which does not include a filter
+    CD              : boolean, string, function or array
+                      competing destination term that accounts for the
                       likelihood that alternative destinations are considered
                       along with each destination under consideration for every
-                      OD pair; defaults to None which does not include a CD
-                      term; not yet implemented
-    Lag             : W object
-                      spatial weight for n observations (OD pairs) used to
-                      construct a spatial autoregressive model and estimator;
-                      defaults to None which does not include an autoregressive
-                      term; not yet implemented
+                      OD pair, included as a log covariate; True, 'pow', 'exp'
+                      or a decay function computes the term from the origins,
+                      destinations, cost and first destination variable (mass)
+                      of the model (see competing_destinations; True is 'pow'),
+                      or an n x 1 array gives the term directly; defaults to
+                      None which does not include a CD term
+    Lag             : ODW object
+                      origin-destination weight for the n observations (OD
+                      pairs) used to construct a spatial autoregressive model
+                      with origin, destination and network dependence that is
+                      estimated by maximum likelihood on the logged flows (see
+                      ODLag); defaults to None which does not include an
+                      autoregressive term
+    destinations    : array of strings (optional)
+                      n x 1; unique identifiers of destinations of n flows;
+                      only used for the CD term; default is None
 
     Attributes
     ----------
@@ -683,6 +807,7 @@ class Production(BaseGravity):
         CD=None,
         Lag=None,
         Quasi=False,
+        destinations=None,
     ):
         self.constant = constant
         self.f = self.reshape(flows)
@@ -704,6 +829,7 @@ class Production(BaseGravity):
             cost_func=cost_func,
             d_vars=self.dv,
             origins=self.o,
+            destinations=destinations,
             constant=constant,
             framework=framework,
             SF=SF,
@@ -803,21 +929,27 @@ class Attraction(BaseGravity):
                       True to estimate QuasiPoisson model; should result in same
                       parameters as Poisson but with altered covariance; default
                       to true which estimates Poisson model
-    SF              : array
-                      n x 1; eigenvector spatial filter to include in the model;
-                      default to None which does not include a filter; not yet
-                      implemented
+    SF              : array, EigenFilter or spatial weight
+                      n x q eigenvectors to include in the model as a spatial
+                      filter, or an EigenFilter (or a spatial weight for the OD
+                      pairs, e.g. ODW or netW, used with the EigenFilter
+                      defaults) from which eigenvectors are selected; default to
+                      None which does not include a filter
     CD              : array
                       n x 1; competing destination term that accounts for the
                       likelihood that alternative destinations are considered
                       along with each destination under consideration for every
-                      OD pair; defaults to None which does not include a CD
-                      term; not yet implemented
-    Lag             : W object
-                      spatial weight for n observations (OD pairs) used to
-                      construct a spatial autoregressive model and estimator;
-                      defaults to None which does not include an autoregressive
-                      term; not yet implemented
+                      OD pair, included as a log covariate (see
+                      competing_destinations); the term cannot be computed by
+                      the model since it has no destination variables (mass);
+                      defaults to None which does not include a CD term
+    Lag             : ODW object
+                      origin-destination weight for the n observations (OD
+                      pairs) used to construct a spatial autoregressive model
+                      with origin, destination and network dependence that is
+                      estimated by maximum likelihood on the logged flows (see
+                      ODLag); defaults to None which does not include an
+                      autoregressive term
 
     Attributes
     ----------
@@ -1024,21 +1156,27 @@ class Doubly(BaseGravity):
                       True to estimate QuasiPoisson model; should result in same
                       parameters as Poisson but with altered covariance; default
                       to true which estimates Poisson model
-    SF              : array
-                      n x 1; eigenvector spatial filter to include in the model;
-                      default to None which does not include a filter; not yet
-                      implemented
+    SF              : array, EigenFilter or spatial weight
+                      n x q eigenvectors to include in the model as a spatial
+                      filter, or an EigenFilter (or a spatial weight for the OD
+                      pairs, e.g. ODW or netW, used with the EigenFilter
+                      defaults) from which eigenvectors are selected; default to
+                      None which does not include a filter
     CD              : array
                       n x 1; competing destination term that accounts for the
                       likelihood that alternative destinations are considered
                       along with each destination under consideration for every
-                      OD pair; defaults to None which does not include a CD
-                      term; not yet implemented
-    Lag             : W object
-                      spatial weight for n observations (OD pairs) used to
-                      construct a spatial autoregressive model and estimator;
-                      defaults to None which does not include an autoregressive
-                      term; not yet implemented
+                      OD pair, included as a log covariate (see
+                      competing_destinations); the term cannot be computed by
+                      the model since it has no destination variables (mass);
+                      defaults to None which does not include a CD term
+    Lag             : ODW object
+                      origin-destination weight for the n observations (OD
+                      pairs) used to construct a spatial autoregressive model
+                      with origin, destination and network dependence that is
+                      estimated by maximum likelihood on the logged flows (see
+                      ODLag); defaults to None which does not include an
+                      autoregressive term
 
     Attributes
     ----------
@@ -0,0 +1,325 @@
+"""
+Maximum likelihood estimation of spatial autoregressive interaction models with
+origin, destination and origin-to-destination (network) dependence for flows
+between o origins and d destinations (LeSage and Pace, 2008).
+"""
+
+__author__ = "Taylor Oshan tayoshan@gmail.com"
+
+import numpy as np
+import scipy.stats as stats
+from scipy import sparse as sp
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+from scipy.sparse.linalg import LinearOperator, gmres
+
+from .spintW import ODW
+from .utils import LagOperator
+
+# factor weights up to this size use the eigenvalues of the factors, which
+# gives the exact log-determinant of the n x n system
+EIG_MAX = 5000
+# larger factors use a series of this order in the traces of their powers,
+# estimated from this many random probes
+TRACE_ORDER = 50
+TRACE_PROBES = 50
+
+
+class ODLag:
+    """
+    Origin-destination spatial lag model estimated by maximum likelihood
+
+    y = rho_o Wo y + rho_d Wd y + rho_w Ww y + X beta + e,  e ~ N(0, sig2 I)
+
+    where y are the logged flows ordered by origin and then by destination, and
+    the origin, destination and network lags are Wo y = (Wo (x) I) y,
+    Wd y = (I (x) Wd) y and Ww y = (Wo (x) Wd) y. The lags are computed on the
+    o x d flow matrix F as Wo F, F Wd' and Wo F Wd', so no n x n weight is
+    formed. All three weights share the eigenvectors of the factors, so the
+    log-determinant of I - rho_o Wo - rho_d Wd - rho_w Ww is the sum of
+    log|1 - rho_o l_i - rho_d m_j - rho_w l_i m_j| over the eigenvalues l of Wo
+    and m of Wd; only the o x o and d x d factors are decomposed. The
+    likelihood is concentrated with respect to beta and sig2 (LeSage and Pace,
+    2008), so each evaluation costs O(o * d) after four regressions on X.
+
+    Factors larger than EIG_MAX units are not decomposed. The log-determinant
+    is then the series -sum_k tr(B^k) / k of B = rho_o Wo + rho_d Wd + rho_w Ww
+    truncated at TRACE_ORDER, where tr(Wo^p (x) Wd^q) = tr(Wo^p) tr(Wd^q) and
+    the traces of the powers of each factor are estimated from TRACE_PROBES
+    random vectors (Barry and Pace, 1999). This approximation assumes
+    row-standardized weights and |rho_o| + |rho_d| + |rho_w| < 1.
+
+    Parameters
+    ----------
+    y               : array
+                      n x 1; positive flows, ordered by origin and then by
+                      destination
+    X               : array or sparse matrix
+                      n x k; exogenous covariates, excluding the constant
+    w               : ODW
+                      origin-destination weight; its Wo and Wd define the
+                      three lags
+    constant        : boolean
+                      True to include intercept in model; True by default
+
+    Attributes
+    ----------
+    y               : array
+                      n x 1; logged flows
+    X               : array or sparse matrix
+                      n x k; design matrix including any constant
+    n               : integer
+                      number of flows
+    k               : integer
+                      number of parameters, including the three rho
+    betas           : array
+                      k-3 x 1; estimated coefficients of X
+    rho             : array
+                      estimated (rho_o, rho_d, rho_w)
+    params          : array
+                      k; betas followed by rho_o, rho_d and rho_w
+    sig2            : float
+                      estimated variance of the errors
+    cov_params      : array
+                      k x k; asymptotic variance covariance matrix of params
+    std_err         : array
+                      k; standard errors of params
+    tvalues         : array
+                      k; z-statistics of params
+    pvalues         : array
+                      k; two-tailed p-values of params
+    llf             : float
+                      value of the log-likelihood function at params
+    AIC             : float
+                      Akaike information criterion
+    predy           : array
+                      n x 1; reduced form prediction of y,
+                      (I - rho_o Wo - rho_d Wd - rho_w Ww)^-1 X beta
+    yhat            : array
+                      n x 1; predicted flows, exp(predy)
+    resid           : array
+                      n x 1; y - predy
+
+    References
+    ----------
+    Barry, R. P. and Pace, R. K. (1999). Monte Carlo estimates of the log
+        determinant of large sparse matrices. Linear Algebra and its
+        Applications, 289, 41-54.
+
+    LeSage, J. P. and Pace, R. K. (2008). Spatial econometric modeling of
+        origin-destination flows. Journal of Regional Science, 48(5), 941-967.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from libpysal.weights import lat2W
+    >>> from spint.spintW import ODW
+    >>> from spint.od_lag import ODLag
+    >>> w = ODW(lat2W(5, 5), lat2W(5, 5))
+    >>> rng = np.random.default_rng(0)
+    >>> X = rng.random((w.n, 1))
+    >>> e = 0.1 * rng.standard_normal((w.n, 1))
+    >>> mu = (1.0 + 2.0 * X + e).reshape((25, 25))
+    >>> F = mu.copy()
+    >>> for i in range(100):
+    ...     F = mu + 0.3 * (w.Wo @ F) + 0.2 * w.lag(F)
+    >>> model = ODLag(np.exp(F.reshape((-1, 1))), X, w)
+    >>> np.round(model.rho, 2)
+    array([0.3 , 0.02, 0.19])
+
+    """
+
+    def __init__(self, y, X, w, constant=True):
+        if not isinstance(w, ODW):
+            raise TypeError("Lag model requires an origin-destination weight, ODW")
+        y = np.asarray(y, dtype=float).reshape((-1, 1))
+        if y.shape[0] != w.n:
+            raise ValueError("Number of flows does not match spatial weight, W")
+        if (y <= 0).any():
+            raise ValueError(
+                "Zero flows detected: the lag model is estimated on the"
+                " logarithm of the flows which is undefined at 0"
+            )
+        self.w = w
+        self._lag = tuple(LagOperator(weights) for weights in (w.Wo, w.Wd, w))
+        self.y = np.log(y)
+        self.n = n = w.n
+        if constant:
+            ones = np.ones((n, 1))
+            X = (
+                sp.hstack((ones, X), format="csr")
+                if sp.issparse(X)
+                else np.hstack((ones, np.reshape(X, (n, -1))))
+            )
+        self.X = X
+        self._xtx = cho_factor(_dense(X.T @ X))
+        if max(w.o, w.d) <= EIG_MAX:
+            self._lo, self._ld = _eigvals(w.Wo), _eigvals(w.Wd)
+            self._traces = None
+        else:
+            self._traces = (_traces(w.Wo), _traces(w.Wd))
+
+        # e(rho) = e0 - rho_o eo - rho_d ed - rho_w ew from regressions of y and
+        # its three lags on X; e'e only needs their 4 x 4 cross-products
+        Y = np.hstack((self.y, self._lags(self.y)))
+        B = cho_solve(self._xtx, _dense(X.T @ Y))
+        E = Y - X @ B
+        self._ee = E.T @ E
+
+        opt = minimize(
+            lambda rho: -self._concentrated(rho),
+            np.zeros(3),
+            jac=lambda rho: -self._gradient(rho),
+            method="L-BFGS-B",
+            bounds=[(-0.999, 0.999)] * 3,
+        )
+        self.rho = rho = opt.x
+        coefs = np.hstack((1.0, -rho))
+        self.betas = B @ coefs.reshape((-1, 1))
+        self.sig2 = coefs @ self._ee @ coefs / n
+        self.params = np.hstack((self.betas.ravel(), rho))
+        self.k = len(self.params)
+        self.llf = self._concentrated(rho)
+        self.AIC = -2.0 * self.llf + 2.0 * self.k
+
+        self.predy = self._solve(X @ self.betas)
+        self.yhat = np.exp(self.predy)
+        self.resid = self.y - self.predy
+        self.cov_params = self._cov()
+        self.std_err = np.sqrt(np.diag(self.cov_params))
+        self.tvalues = self.params / self.std_err
+        self.pvalues = 2.0 * stats.norm.sf(np.abs(self.tvalues))
+
+    def _lags(self, y):
+        # origin, destination and network lags of one or more n x 1 columns
+        lag_o, lag_d, lag_w = self._lag
+        o, d, k = self.w.o, self.w.d, y.shape[1]
+        F = y.reshape((o, d, k))
+        lo = lag_o.lag(F.reshape((o, d * k)))
+        ld = lag_d.lag(F.transpose((1, 0, 2)).reshape((d, o * k)))
+        ld = ld.reshape((d, o, k)).transpose((1, 0, 2))
+        lw = lag_w.lag(y)
+        return np.hstack([lag.reshape((self.n, k)) for lag in (lo, ld, lw)])
+
+    def _a(self, rho):
+        lo, ld = self._lo[:, None], self._ld[None, :]
+        return 1.0 - rho[0] * lo - rho[1] * ld - rho[2] * lo * ld
+
+    def _series(self, rho):
+        # coefficients of l^p m^q in the power series of log(1 - x) and of
+        # 1 / (1 - x), x = rho_o l + rho_d m + rho_w l m, up to TRACE_ORDER
+        P = np.zeros((TRACE_ORDER + 1, TRACE_ORDER + 1))
+        P[0, 0] = 1.0
+        log, inv = np.zeros_like(P), P.copy()
+        for k in range(1, TRACE_ORDER + 1):
+            Q = np.zeros_like(P)
+            Q[1:] += rho[0] * P[:-1]
+            Q[:, 1:] += rho[1] * P[:, :-1]
+            Q[1:, 1:] += rho[2] * P[:-1, :-1]
+            P = Q
+            log -= P / k
+            inv += P
+        return log, inv
+
+    def logdet(self, rho):
+        """
+        log|I - rho_o Wo - rho_d Wd - rho_w Ww| from the eigenvalues of the
+        factors, or from the traces of their powers above EIG_MAX units
+        """
+        if self._traces is not None:
+            to, td = self._traces
+            return to @ self._series(rho)[0] @ td
+        return np.sum(np.log(np.abs(self._a(rho))))
+
+    def _concentrated(self, rho):
+        coefs = np.hstack((1.0, -rho))
+        ee = coefs @ self._ee @ coefs
+        n = self.n
+        return self.logdet(rho) - n / 2.0 * (np.log(2 * np.pi * ee / n) + 1.0)
+
+    def _gradient(self, rho):
+        if self._traces is not None:
+            # d log(1 - x) / d rho = -(l, m, l m) / (1 - x)
+            to, td = self._traces
+            inv = self._series(rho)[1][:-1, :-1]
+            dlogdet = -np.array(
+                [to[1:] @ inv @ td[:-1], to[:-1] @ inv @ td[1:], to[1:] @ inv @ td[1:]]
+            )
+        else:
+            lo, ld = self._lo[:, None], self._ld[None, :]
+            inv = 1.0 / self._a(rho)
+            dlogdet = -np.real(
+                [np.sum(lo * inv), np.sum(ld * inv), np.sum(lo * ld * inv)]
+            )
+        coefs = np.hstack((1.0, -rho))
+        ee = coefs @ self._ee @ coefs
+        dee = -2.0 * (self._ee @ coefs)[1:]
+        return dlogdet - self.n / 2.0 * dee / ee
+
+    def _solve(self, b):
+        # (I - rho_o Wo - rho_d Wd - rho_w Ww)^-1 b with matrix-free lags
+        rho = self.rho
+
+        def matvec(x):
+            x = np.reshape(x, (-1, 1))
+            return (x - self._lags(x) @ rho.reshape((-1, 1))).ravel()
+
+        A = LinearOperator((self.n, self.n), matvec=matvec, dtype=float)
+        x, info = gmres(A, np.ravel(b), rtol=1e-10, atol=0.0)
+        if info != 0:
+            raise RuntimeError(
+                f"Reduced form prediction failed: GMRES did not converge (info={info})"
+            )
+        return x.reshape((-1, 1))
+
+    def _cov(self):
+        # the rho block is the inverse of the numerical Hessian of the
+        # concentrated log-likelihood; the beta block adds the uncertainty of
+        # rho to sig2 (X'X)^-1 through the information cross-products X'Wz/sig2,
+        # z = (I - rho W)^-1 X beta (block inversion of the information matrix)
+        h = 1e-5
+        H = np.empty((3, 3))
+        for i in range(3):
+            ei = np.eye(3)[i] * h
+            H[i] = (self._gradient(self.rho + ei) - self._gradient(self.rho - ei)) / (
+                2 * h
+            )
+        V_rho = np.linalg.inv(-(H + H.T) / 2.0)
+        xtx_inv = cho_solve(self._xtx, np.eye(self.X.shape[1]))
+        Ibr = _dense(self.X.T @ self._lags(self.predy)) / self.sig2
+        C = self.sig2 * xtx_inv @ Ibr
+        V_beta = self.sig2 * xtx_inv + C @ V_rho @ C.T
+        cov_br = -C @ V_rho
+        return np.block([[V_beta, cov_br], [cov_br.T, V_rho]])
+
+
+def _eigvals(W):
+    evals = np.linalg.eigvals(W.toarray())
+    if np.abs(evals.imag).max() < 1e-10:
+        evals = evals.real
+    return evals
+
+
+def _traces(W):
+    # tr(W^p) for p = 0, ..., TRACE_ORDER: from the eigenvalues up to EIG_MAX
+    # units, otherwise exact for p <= 2 and Hutchinson estimates z'W^p z from
+    # Rademacher probes z with a fixed seed, so that fits are reproducible
+    m = W.shape[0]
+    if m <= EIG_MAX:
+        evals = _eigvals(W)
+        return np.real([np.sum(evals**p) for p in range(TRACE_ORDER + 1)])
+    W = sp.csr_matrix(W)
+    Z = np.random.default_rng(0).choice([-1.0, 1.0], size=(m, TRACE_PROBES))
+    t = np.empty(TRACE_ORDER + 1)
+    V = Z
+    for p in range(1, TRACE_ORDER + 1):
+        V = W @ V
+        t[p] = np.sum(Z * V) / TRACE_PROBES
+    t[0] = m
+    t[1] = W.diagonal().sum()
+    t[2] = W.multiply(W.T).sum()
+    return t
+
+
+def _dense(a):
+    return a.toarray() if sp.issparse(a) else np.asarray(a)
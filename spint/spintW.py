@@ -0,0 +1,545 @@
+"""
+Weights for origin-destination flows and vectors used in spatial interaction
+models and vector-based spatial autocorrelation statistics.
+"""
+
+__author__ = "Taylor Oshan tayoshan@gmail.com"
+
+import numpy as np
+from libpysal.weights import WSP, W
+from libpysal.weights.distance import DistanceBand
+from scipy import sparse as sp
+from scipy.sparse.linalg import LinearOperator
+from scipy.spatial import cKDTree
+from spglm.utils import cache_readonly
+
+
+class ODW(LinearOperator):
+    """
+    Origin-destination spatial weight for o*d flows, Wo (x) Wd, constructed from
+    spatial weights on o origins and d destinations. The Kronecker product is
+    never formed: the spatial lag of the flows is computed as Wo F Wd' on the
+    o x d flow matrix F, so a lag costs O(nnz(Wo) * d + nnz(Wd) * o) rather than
+    O(nnz(Wo) * nnz(Wd)). Flows are assumed to be ordered by origin and then by
+    destination (i.e., F.ravel()).
+
+    Parameters
+    ----------
+    Wo              : W object, WSP object or sparse matrix
+                      o x o spatial weight for the origins of the flows
+    Wd              : W object, WSP object or sparse matrix
+                      d x d spatial weight for the destinations of the flows
+    transform       : string
+                      'r' (default) for row-standardized weights or 'b' for
+                      binary weights; row-standardizing Wo and Wd separately
+                      yields the row-standardized Kronecker product. Valued
+                      weights (e.g. inverse distance) keep their values
+                      before row-standardization
+
+    Attributes
+    ----------
+    Wo              : sparse matrix
+                      o x o transformed origin weights
+    Wd              : sparse matrix
+                      d x d transformed destination weights
+    o               : integer
+                      number of origins
+    d               : integer
+                      number of destinations
+    n               : integer
+                      number of flows, o * d
+    transform       : string
+                      weights transformation
+    s0              : float
+                      sum of all weights
+    s1              : float
+                      1/2 sum_ij (w_ij + w_ji)^2
+    s2              : float
+                      sum_i (w_i. + w_.i)^2
+    trW             : float
+                      trace of W
+    trWtW           : float
+                      trace of W'W
+    trWW            : float
+                      trace of WW
+    sparse          : sparse matrix
+                      n x n materialized Kronecker product; only built when
+                      accessed
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from libpysal.weights import lat2W
+    >>> from spint.spintW import ODW
+    >>> ODw = ODW(lat2W(3, 3), lat2W(5, 5))
+    >>> print(ODw.n, 9 * 25)
+    225 225
+    >>> flows = np.arange(225.0)
+    >>> lagged = ODw.lag(flows.reshape((9, 25)))
+    >>> np.allclose(lagged.ravel(), ODw.sparse @ flows)
+    True
+
+    """
+
+    def __init__(self, Wo, Wd, transform="r"):
+        self._cache = {}
+        self.transform = transform
+        self.Wo = self._transform(Wo, transform)
+        self.Wd = self._transform(Wd, transform)
+        self.o = self.Wo.shape[0]
+        self.d = self.Wd.shape[0]
+        self.n = self.o * self.d
+        ids = [getattr(w, "id_order", None) for w in (Wo, Wd)]
+        self._ids = (
+            ids if None not in ids else [list(range(self.o)), list(range(self.d))]
+        )
+        super().__init__(dtype=np.float64, shape=(self.n, self.n))
+
+    @staticmethod
+    def _transform(w, transform):
+        if isinstance(w, (W, WSP)):
+            w = w.sparse
+        w = sp.csr_matrix(w, dtype=float, copy=True)
+        w.eliminate_zeros()
+        if transform.lower() == "b":
+            w.data[:] = 1.0
+        elif transform.lower() == "r":
+            rows = np.asarray(w.sum(axis=1)).ravel()
+            rows[rows == 0] = 1.0
+            w = sp.diags(1.0 / rows) @ w
+        else:
+            raise ValueError("Parameter 'transform' must be 'r' or 'b'")
+        return sp.csr_matrix(w)
+
+    def lag(self, F):
+        """
+        Spatial lag of an o x d flow matrix (or o x d x k stack), Wo F Wd'
+        """
+        return _kron_lag(self.Wo, self.Wd, F)
+
+    def rlag(self, F):
+        """
+        Reverse spatial lag of an o x d flow matrix (or o x d x k stack), Wo' F Wd
+        """
+        return _kron_lag(self._transposed[0], self._transposed[1], F)
+
+    @cache_readonly
+    def _transposed(self):
+        return self.Wo.T.tocsr(), self.Wd.T.tocsr()
+
+    def _matvec(self, x):
+        return self.lag(np.reshape(x, (self.o, self.d))).reshape(np.shape(x))
+
+    def _matmat(self, X):
+        k = X.shape[1]
+        return self.lag(np.reshape(X, (self.o, self.d, k))).reshape((self.n, k))
+
+    def _rmatvec(self, x):
+        return self.rlag(np.reshape(x, (self.o, self.d))).reshape(np.shape(x))
+
+    def _rmatmat(self, X):
+        k = X.shape[1]
+        return self.rlag(np.reshape(X, (self.o, self.d, k))).reshape((self.n, k))
+
+    @cache_readonly
+    def s0(self):
+        return self.Wo.sum() * self.Wd.sum()
+
+    @cache_readonly
+    def s1(self):
+        return self.trWtW + self.trWW
+
+    @cache_readonly
+    def trW(self):
+        return self.Wo.diagonal().sum() * self.Wd.diagonal().sum()
+
+    @cache_readonly
+    def trWtW(self):
+        return _frobenius(self.Wo) * _frobenius(self.Wd)
+
+    @cache_readonly
+    def trWW(self):
+        return _cross(self.Wo) * _cross(self.Wd)
+
+    @cache_readonly
+    def s2(self):
+        ro, co = _margins(self.Wo)
+        rd, cd = _margins(self.Wd)
+        return (
+            ro.dot(ro) * rd.dot(rd)
+            + 2.0 * ro.dot(co) * rd.dot(cd)
+            + co.dot(co) * cd.dot(cd)
+        )
+
+    @cache_readonly
+    def sparse(self):
+        return sp.kron(self.Wo, self.Wd, format="csr")
+
+    @cache_readonly
+    def id_order(self):
+        return [(i, j) for i in self._ids[0] for j in self._ids[1]]
+
+    def to_W(self, silence_warnings=True):
+        """
+        Materialize the Kronecker product as a libpysal W object
+        """
+        return WSP(self.sparse, id_order=self.id_order).to_W(
+            silence_warnings=silence_warnings
+        )
+
+    def full(self):
+        """
+        Materialize the Kronecker product as a dense array
+
+        Returns
+        -------
+        implicit    : tuple
+                      first element being a dense n x n array and second
+                      element being the list of (origin, destination) ids
+        """
+        return self.sparse.toarray(), self.id_order
+
+
+def netW(link_list, share="A", transform="r", max_degree=None):
+    """
+    Create a network-contiguity based weight object based on different nodal
+    relationships encoded in a network. Neighboring links are found with
+    products of sparse link-node incidence matrices (e.g., Bo Bo' for links
+    that share an origin), so construction scales with the number of
+    neighbor pairs rather than the squared number of links.
+
+    Parameters
+    ----------
+    link_list       : list or array
+                      of tuples (or an L x 2 array) where each tuple is of the
+                      form (o,d) where o is an origin id and d is a destination
+                      id; integer-coded ids are used directly
+    share           : string
+                      denoting how to define the nodal relationship used to
+                      determine neighboring edges; defualt is 'A' for any
+                      shared nodes between two network edges; options include:
+
+                      'A': any shared nodes
+                      'O': a shared origin node
+                      'D': a shared destination node
+                      'OD': a shared origin node or a shared destination node
+                      'C': a shared node that is the destination of the first
+                      edge and the origin of the second edge - i.e., a directed
+                      chain is formed moving from edge one to edge two.
+
+    transform       : string
+                      'r' (default) for row-standardized weights or 'b' for
+                      binary weights
+    max_degree      : integer
+                      optional cap on the number of links incident to a node;
+                      nodes with more links (e.g., hubs) do not create
+                      neighbor relationships, which bounds the number of
+                      neighbor pairs; default is None for no cap
+
+    Returns
+    -------
+    W               : WSP object
+                      CSR-backed spatial weights for the L links; use
+                      to_W() to obtain a full W object
+
+    Examples
+    --------
+    >>> from spint.spintW import netW
+    >>> link_list = [('a', 'b'), ('a', 'c'), ('b', 'a'), ('c', 'b')]
+    >>> w = netW(link_list, share='O', transform='b')
+    >>> w.sparse.toarray()
+    array([[0., 1., 0., 0.],
+           [1., 0., 0., 0.],
+           [0., 0., 0., 0.],
+           [0., 0., 0., 0.]])
+
+    """
+    links = np.asarray(link_list)
+    if links.ndim != 2 or links.shape[1] != 2:
+        raise ValueError("link_list must contain (origin, destination) pairs")
+    if links.dtype.kind in "iu":
+        o_codes, d_codes = links[:, 0], links[:, 1]
+        n_nodes = links.max() + 1 if len(links) else 0
+    else:
+        nodes, codes = np.unique(links.ravel(), return_inverse=True)
+        o_codes, d_codes = codes[0::2], codes[1::2]
+        n_nodes = len(nodes)
+    n = len(links)
+    Bo = _incidence(o_codes, n_nodes)
+    Bd = _incidence(d_codes, n_nodes)
+    if max_degree is not None:
+        degree = np.bincount(o_codes, minlength=n_nodes) + np.bincount(
+            d_codes, minlength=n_nodes
+        )
+        keep = sp.diags((degree <= max_degree).astype(float))
+        Bo = Bo @ keep
+        Bd = Bd @ keep
+
+    share = share.upper()
+    if share == "O":
+        neighbors = Bo @ Bo.T
+    elif share == "D":
+        neighbors = Bd @ Bd.T
+    elif share == "OD":
+        neighbors = Bo @ Bo.T + Bd @ Bd.T
+    elif share == "C":
+        neighbors = Bd @ Bo.T
+    elif share == "A":
+        B = Bo + Bd
+        neighbors = B @ B.T
+    else:
+        raise AttributeError("Parameter 'share' must be 'A', 'O', 'D', 'OD', or 'C'")
+    neighbors = sp.csr_matrix(neighbors)
+    neighbors.setdiag(0)
+    neighbors.eliminate_zeros()
+    neighbors.data[:] = 1.0
+    if transform.lower() == "r":
+        rows = np.asarray(neighbors.sum(axis=1)).ravel()
+        rows[rows == 0] = 1.0
+        neighbors = sp.csr_matrix(sp.diags(1.0 / rows) @ neighbors)
+    elif transform.lower() != "b":
+        raise ValueError("Parameter 'transform' must be 'r' or 'b'")
+    ids = [tuple(link) for link in links.tolist()]
+    if len(set(ids)) != n:
+        ids = list(range(n))
+    return WSP(neighbors, id_order=ids)
+
+
+def mat2L(mat):
+    """
+    Convert a matrix that denotes network connectivity into a list of edges
+
+    Parameters
+    ----------
+    mat             : array or sparse matrix
+                      n x n; nonzero entries denote a link from the row node to
+                      the column node
+
+    Returns
+    -------
+    links           : array
+                      L x 2; (origin, destination) pairs of integer node ids
+    """
+    if len(mat.shape) != 2 or mat.shape[0] != mat.shape[1]:
+        raise AttributeError("Matrix must be square")
+    if sp.issparse(mat):
+        mat = sp.csr_matrix(mat)
+        mat.eliminate_zeros()
+        o, d = (mat > 0).nonzero()
+    else:
+        o, d = np.nonzero(np.asarray(mat) > 0)
+    return np.column_stack([o, d])
+
+
+def _incidence(codes, n_nodes):
+    """
+    Sparse link-node incidence matrix
+    """
+    n = len(codes)
+    return sp.csr_matrix((np.ones(n), (np.arange(n), codes)), shape=(n, n_nodes))
+
+
+def _kron_lag(A, B, F):
+    """
+    (A (x) B) vec(F) computed as A F B' for an o x d (x k) array F
+    """
+    F = np.asarray(F)
+    o, d = A.shape[0], B.shape[0]
+    k = F.shape[2:]
+    AF = (A @ F.reshape((o, -1))).reshape((o, d, -1))
+    AF = AF.transpose((1, 0, 2)).reshape((d, -1))
+    lagged = (B @ AF).reshape((d, o, -1)).transpose((1, 0, 2))
+    return lagged.reshape((o, d) + k)
+
+
+def _frobenius(w):
+    """
+    Sum of squared weights, tr(W'W)
+    """
+    return w.multiply(w).sum()
+
+
+def _cross(w):
+    """
+    Sum of products of reciprocal weights, tr(WW)
+    """
+    return w.multiply(w.T).sum()
+
+
+def _margins(w):
+    """
+    Row and column sums of a sparse weight
+    """
+    return np.asarray(w.sum(axis=1)).ravel(), np.asarray(w.sum(axis=0)).ravel()
+
+
+class VecDistanceBand(DistanceBand):
+    """
+    Distance band weights for vectors built from the 4-dimensional distance
+    between the origin (x, y) and destination (x, y) coordinates of each
+    vector. Pairs are found using a KD-tree sparse distance matrix; when
+    chunk_size is given, the pairs are queried for blocks of chunk_size vectors
+    at a time so that the intermediate pair lists stay bounded for large n.
+
+    Parameters
+    ----------
+    data            : array
+                      n x 4; origin x, origin y, destination x, destination y
+                      coordinates of n vectors
+    threshold       : float
+                      distance band
+    p               : float
+                      Minkowski p-norm distance metric parameter
+    alpha           : float
+                      distance decay parameter for weight (default -1.0); only
+                      used when binary is False
+    binary          : boolean
+                      If True w_{ij}=1 if d_{i,j}<=threshold, otherwise
+                      w_{i,j}=d_{i,j}^{alpha}
+    ids             : list
+                      values to use for keys of the neighbors and weights dicts
+    chunk_size      : int
+                      number of vectors queried at a time; default is None
+                      which queries all vectors at once
+    silence_warnings: boolean
+                      True to silence island warnings; default is False
+
+    Attributes
+    ----------
+    chunk_size      : int
+                      number of vectors queried at a time
+    dmat            : sparse matrix
+                      n x n; distances between all pairs of vectors within the
+                      threshold
+    """
+
+    def __init__(
+        self,
+        data,
+        threshold,
+        p=2,
+        alpha=-1.0,
+        binary=True,
+        ids=None,
+        chunk_size=None,
+        silence_warnings=False,
+    ):
+        data = np.asarray(data, dtype=float)
+        if data.ndim != 2 or data.shape[1] != 4:
+            raise ValueError(
+                "Vector data must be n x 4: origin x, origin y, destination x,"
+                " destination y"
+            )
+        self.chunk_size = chunk_size
+        DistanceBand.__init__(
+            self,
+            cKDTree(data),
+            threshold,
+            p=p,
+            alpha=alpha,
+            binary=binary,
+            ids=ids,
+            silence_warnings=silence_warnings,
+        )
+
+    def _band(self):
+        """Find all pairs within threshold, optionally in blocks of vectors."""
+        n = self.data.shape[0]
+        if not self.chunk_size or self.chunk_size >= n:
+            self.dmat = self.kdtree.sparse_distance_matrix(
+                self.kdtree, max_distance=self.threshold, p=self.p
+            ).tocsr()
+            return
+        rows, cols, vals = [], [], []
+        for start in range(0, n, self.chunk_size):
+            block = cKDTree(self.data[start : start + self.chunk_size])
+            pairs = block.sparse_distance_matrix(
+                self.kdtree,
+                max_distance=self.threshold,
+                p=self.p,
+                output_type="ndarray",
+            )
+            rows.append(pairs["i"] + start)
+            cols.append(pairs["j"])
+            vals.append(pairs["v"])
+        self.dmat = sp.csr_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n, n),
+        )
+
+
+def vecW(
+    origin_x,
+    origin_y,
+    dest_x,
+    dest_y,
+    threshold,
+    p=2,
+    alpha=-1.0,
+    binary=True,
+    ids=None,
+    chunk_size=None,
+    silence_warnings=False,
+):
+    """
+    Distance-based spatial weight for vectors that is computed using a
+    4-dimensional distance between the origin x,y-coordinates and the
+    destination x,y-coordinates
+
+    Parameters
+    ----------
+    origin_x        : list or array
+                      of vector origin x-coordinates
+    origin_y        : list or array
+                      of vector origin y-coordinates
+    dest_x          : list or array
+                      of vector destination x-coordinates
+    dest_y          : list or array
+                      of vector destination y-coordinates
+    threshold       : float
+                      distance band
+    p               : float
+                      Minkowski p-norm distance metric parameter
+    alpha           : float
+                      distance decay parameter for weight (default -1.0); only
+                      used when binary is False
+    binary          : boolean
+                      If True w_{ij}=1 if d_{i,j}<=threshold, otherwise
+                      w_{i,j}=d_{i,j}^{alpha}
+    ids             : list
+                      values to use for keys of the neighbors and weights dicts
+    chunk_size      : int
+                      number of vectors queried at a time; default is None
+                      which queries all vectors at once
+    silence_warnings: boolean
+                      True to silence island warnings; default is False
+
+    Returns
+    -------
+    W               : VecDistanceBand
+                      spatial weights object
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from spint.spintW import vecW
+    >>> vecs = np.array([[55, 60, 100, 500],
+    ...                  [60, 55, 105, 501],
+    ...                  [500, 55, 155, 500],
+    ...                  [505, 60, 160, 500]])
+    >>> w = vecW(*vecs.T, threshold=100)
+    >>> w.neighbors
+    {0: [1], 1: [0], 2: [3], 3: [2]}
+
+    """
+    data = np.column_stack([origin_x, origin_y, dest_x, dest_y])
+    return VecDistanceBand(
+        data,
+        threshold,
+        p=p,
+        alpha=alpha,
+        binary=binary,
+        ids=ids,
+        chunk_size=chunk_size,
+        silence_warnings=silence_warnings,
+    )
@@ -9,8 +9,19 @@ manually calculated values, using very simple dummy dataset.
 __author__ = "Lenka Hasova haska.lenka@gmail.com"
 
 import numpy as np
+import pytest
+from scipy import sparse as sp
 
-from ..flow_accessibility import Accessibility, _generate_dummy_flows
+from ..flow_accessibility import (
+    Accessibility,
+    IncrementalAccessibility,
+    _generate_dummy_flows,
+    bipartite_accessibility,
+    chunked_accessibility,
+    competing_destinations,
+    decay_accessibility,
+    sparse_accessibility,
+)
 
 
 class TestAccessibility:
@@ -36,3 +47,308 @@ class TestAccessibility:
         )
 
         np.testing.assert_array_equal(flow["results_all=False"], flow["acc_uni"])
+
+    def test_competing_destinations(self):
+        flow = _generate_dummy_flows()
+        acc = competing_destinations(
+            flow["origin_ID"],
+            flow["destination_ID"],
+            flow["distances"],
+            flow["dest_masses"],
+        )
+        cost = flow.set_index(["origin_ID", "destination_ID"])["distances"]
+        cost = cost.to_dict()
+        mass = flow.groupby("destination_ID")["dest_masses"].first().to_dict()
+        pairs = flow[["origin_ID", "destination_ID"]].to_numpy()
+        expected = [
+            sum(mass[k] / cost[(j, k)] for k in mass if k not in (i, j))
+            for i, j in pairs
+        ]
+        np.testing.assert_allclose(acc.ravel(), expected)
+        acc = competing_destinations(
+            flow["origin_ID"],
+            flow["destination_ID"],
+            flow["distances"],
+            flow["dest_masses"],
+            decay="exp",
+        )
+        expected = [
+            sum(mass[k] * np.exp(-cost[(j, k)]) for k in mass if k not in (i, j))
+            for i, j in pairs
+        ]
+        np.testing.assert_allclose(acc.ravel(), expected)
+
+    def test_accessibility_all_destinations(self):
+        flow = _generate_dummy_flows()
+        acc = Accessibility(
+            dest_nodes=flow["origin_ID"],
+            distances=flow["distances"],
+            weights=flow["volume_in_unipartite"],
+            masses=flow["dest_masses"],
+            all_destinations=True,
+        )
+        dm = flow["distances"].to_numpy().reshape(5, 5)
+        dm = dm * flow["dest_masses"].to_numpy().reshape(5, 5).T
+        expected = [dm[:, z].sum() - dm[x, z] for x in range(5) for z in range(5)]
+        np.testing.assert_array_equal(acc, expected)
+
+    def test_sparse_accessibility(self):
+        flow = _generate_dummy_flows()
+        flow["acc_uni"] = sparse_accessibility(
+            flow["origin_ID"],
+            flow["destination_ID"],
+            flow["distances"],
+            flow["dest_masses"],
+            weights=flow["volume_in_unipartite"],
+        )
+        np.testing.assert_array_equal(flow["results_all=False"], flow["acc_uni"])
+
+        # an incomplete edgelist in any order equals the complete edgelist where
+        # the missing pairs have no flow and a distance of 0
+        observed = flow["volume_in_unipartite"] > 0
+        observed[[2, 7]] = True
+        complete = flow.copy()
+        complete.loc[~observed, "distances"] = 0
+        expected = Accessibility(
+            dest_nodes=complete["origin_ID"],
+            distances=complete["distances"],
+            weights=complete["volume_in_unipartite"],
+            masses=complete["dest_masses"],
+        )
+        edges = flow[observed].iloc[::-1]
+        acc = sparse_accessibility(
+            edges["origin_ID"],
+            edges["destination_ID"],
+            edges["distances"],
+            edges["dest_masses"],
+            weights=edges["volume_in_unipartite"],
+            chunk_size=4,
+        )
+        np.testing.assert_array_equal(acc.ravel(), expected[edges.index])
+
+    def test_accessibility_bipartite_all_destinations(self):
+        flow = _generate_dummy_flows()
+        kwargs = {
+            "dest_nodes": flow["origin_ID"],
+            "distances": flow["distances"],
+            "weights": flow["volume_in_bipartite"],
+            "masses": flow["dest_masses"],
+            "all_destinations": True,
+        }
+        acc = Accessibility(is_bipartite=True, **kwargs)
+        # only C, D and E receive flows, so the origins A and B do not compete
+        dm = flow["distances"].to_numpy().reshape(5, 5)
+        dm = dm * flow["dest_masses"].to_numpy().reshape(5, 5).T
+        expected = [
+            sum(dm[y, z] for y in (2, 3, 4) if y != x)
+            for x in range(5)
+            for z in range(5)
+        ]
+        np.testing.assert_array_equal(acc, expected)
+        acc = sparse_accessibility(
+            flow["origin_ID"],
+            flow["destination_ID"],
+            flow["distances"],
+            flow["dest_masses"],
+            weights=flow["volume_in_bipartite"],
+            all_destinations=True,
+            is_bipartite=True,
+        )
+        np.testing.assert_array_equal(acc.ravel(), expected)
+
+    def test_bipartite_accessibility(self):
+        flow = _generate_dummy_flows()
+        # origins A and B, destinations C, D and E
+        volumes = flow["volume_in_bipartite"].to_numpy().reshape(5, 5)[:2, 2:]
+        distances = flow["distances"].to_numpy().reshape(5, 5)[2:, 2:]
+        masses = flow["dest_masses"].to_numpy()[2:5]
+        for all_destinations in (False, True):
+            expected = Accessibility(
+                flow["origin_ID"],
+                flow["distances"],
+                flow["volume_in_bipartite"],
+                flow["dest_masses"],
+                all_destinations=all_destinations,
+                is_bipartite=True,
+            ).reshape(5, 5)[:2, 2:]
+            acc = bipartite_accessibility(
+                volumes, distances, masses, all_destinations, chunk_size=1
+            )
+            np.testing.assert_array_equal(acc, expected)
+
+        rng = np.random.default_rng(0)
+        distances = rng.random((9, 9))
+        masses = rng.random((9, 2))
+        weights = (rng.random((7, 9)) < 0.4) * 10
+        for w in (weights, sp.csr_matrix(weights)):
+            acc = bipartite_accessibility(w, distances, masses, chunk_size=3)
+            assert acc.shape == (7, 9, 2)
+            expected = [
+                [
+                    sum(
+                        distances[y, z] * masses[y]
+                        for y in range(9)
+                        if y != z and weights[x, y]
+                    )
+                    for z in range(9)
+                ]
+                for x in range(7)
+            ]
+            np.testing.assert_allclose(acc, expected)
+        acc = bipartite_accessibility(weights, distances, masses[:, 0], True)
+        expected = [
+            sum(distances[y, z] * masses[y, 0] for y in range(9) if y != z)
+            for z in range(9)
+        ]
+        np.testing.assert_allclose(acc, np.tile(expected, (7, 1)))
+        assert (
+            bipartite_accessibility(
+                weights, distances.astype(np.float32), masses.astype(np.float32)
+            ).dtype
+            == np.float32
+        )
+        with pytest.raises(ValueError):
+            bipartite_accessibility(weights, distances[:, :8], masses)
+
+    def test_decay_accessibility(self):
+        rng = np.random.default_rng(0)
+        distances = rng.random((7, 7)) + 0.5
+        # read-only, like a memory map, and never modified in place
+        distances.setflags(write=False)
+        original = distances.copy()
+        masses = rng.random(7)
+        weights = (rng.random((7, 7)) < 0.5) * 10
+        decays = [
+            ("pow", lambda d: d**-2.0),
+            ("exp", lambda d: np.exp(-2.0 * d)),
+            (None, lambda d: d),
+            (np.sqrt, np.sqrt),
+            (lambda d: d, lambda d: d),
+        ]
+        for decay, f in decays:
+            fm = f(distances) * masses * (weights > 0)
+            np.fill_diagonal(fm, 0)
+            acc = decay_accessibility(
+                distances, masses, weights, decay=decay, beta=2.0, chunk_size=3
+            )
+            np.testing.assert_allclose(acc.ravel(), fm.sum(axis=1))
+            acc = decay_accessibility(
+                distances,
+                masses,
+                weights,
+                decay=decay,
+                beta=2.0,
+                per_flow=True,
+                chunk_size=3,
+            )
+            np.testing.assert_allclose(acc, fm.sum(axis=1, keepdims=True) - fm)
+        np.testing.assert_array_equal(distances, original)
+        acc = decay_accessibility(
+            distances.astype(np.float32), masses.astype(np.float32), decay="exp"
+        )
+        assert acc.dtype == np.float32
+        with pytest.raises(ValueError):
+            decay_accessibility(distances - distances[0, 1], masses, exclude_self=False)
+
+    def test_incremental_accessibility(self):
+        rng = np.random.default_rng(0)
+        distances = rng.random((40, 40)) + 0.5
+        masses = rng.random(40)
+        weights = (rng.random((40, 40)) < 0.5) * 10
+        acc = IncrementalAccessibility(
+            distances, masses, weights, decay="exp", beta=2.0, chunk_size=7
+        )
+        acc.set_mass([3, 5], [2.0, 0.1])
+        masses[[3, 5]] = [2.0, 0.1]
+        acc.set_link(1, 2, not weights[1, 2])
+        weights[1, 2] = 10 - weights[1, 2]
+        acc.set_distance(6, 7, 3.0)
+        distances[6, 7] = 3.0
+        expected = decay_accessibility(distances, masses, weights, "exp", 2.0)
+        np.testing.assert_allclose(acc.accessibility, expected)
+        np.testing.assert_allclose(
+            acc.per_flow(),
+            decay_accessibility(distances, masses, weights, "exp", 2.0, per_flow=True),
+        )
+        acc.refresh()
+        np.testing.assert_allclose(acc.accessibility, expected)
+
+    def test_accessibility_mass_columns(self):
+        flow = _generate_dummy_flows()
+        masses = flow[["dest_masses"]].assign(pop=flow["dest_masses"] * 3 % 7)
+        for all_destinations in (False, True):
+            acc = Accessibility(
+                flow["origin_ID"],
+                flow["distances"],
+                flow["volume_in_unipartite"],
+                masses,
+                all_destinations=all_destinations,
+            )
+            assert acc.shape == (25, 2)
+            for k, column in enumerate(masses):
+                np.testing.assert_array_equal(
+                    acc[:, k],
+                    Accessibility(
+                        flow["origin_ID"],
+                        flow["distances"],
+                        flow["volume_in_unipartite"],
+                        masses[column],
+                        all_destinations=all_destinations,
+                    ),
+                )
+
+        rng = np.random.default_rng(0)
+        distances = rng.random((30, 20)) + 0.5
+        masses = rng.random((20, 3))
+        weights = rng.random((30, 20)) < 0.5
+        acc = decay_accessibility(distances, masses, weights, chunk_size=7)
+        flows = decay_accessibility(distances, masses, weights, per_flow=True)
+        assert acc.shape == (30, 3)
+        assert flows.shape == (30, 20, 3)
+        for k in range(3):
+            np.testing.assert_allclose(
+                acc[:, k : k + 1], decay_accessibility(distances, masses[:, k], weights)
+            )
+            np.testing.assert_allclose(
+                flows[:, :, k],
+                decay_accessibility(distances, masses[:, k], weights, per_flow=True),
+            )
+
+    def test_chunked_accessibility(self, tmp_path):
+        rng = np.random.default_rng(0)
+        xy = rng.random((50, 2))
+        masses = rng.random((50, 2))
+        distances = np.linalg.norm(xy[:, None] - xy[None], axis=-1)
+        weights = sp.random(50, 50, density=0.5, random_state=0, format="csr")
+        expected = decay_accessibility(distances, masses, weights.toarray(), "exp")
+        path = tmp_path / "distances.npy"
+        np.save(path, distances)
+        for source in (distances, path):
+            np.testing.assert_allclose(
+                chunked_accessibility(source, masses, weights, "exp", chunk_size=7),
+                expected,
+            )
+        np.testing.assert_allclose(
+            chunked_accessibility(
+                None, masses, weights, "exp", coordinates=xy, chunk_size=7, n_jobs=2
+            ),
+            expected,
+        )
+        np.testing.assert_allclose(
+            chunked_accessibility(
+                None,
+                masses[:20, 0],
+                decay="exp",
+                coordinates=(xy, xy[:20]),
+                exclude_self=False,
+            ),
+            decay_accessibility(
+                distances[:, :20], masses[:20, 0], decay="exp", exclude_self=False
+            ),
+        )
+        np.testing.assert_allclose(
+            chunked_accessibility(path, masses, weights, "exp", chunk_size=7, n_jobs=2),
+            expected,
+        )
+        with pytest.raises(ValueError):
+            chunked_accessibility(None, masses)
@@ -0,0 +1,67 @@
+"""
+Tests for eigenvector spatial filtering of spatial interaction models.
+"""
+
+import numpy as np
+import pytest
+from libpysal.weights import lat2W
+
+from ..eigenfilter import EigenFilter, mcm_eigs
+from ..gravity import Gravity
+from ..spintW import ODW, netW
+from . import test_gravity
+
+
+def _mcm(A):
+    A = A.toarray()
+    C = (A + A.T) / 2.0
+    M = np.eye(len(A)) - 1.0 / len(A)
+    return M @ C @ M
+
+
+class TestEigenFilter:
+    def setup_method(self):
+        data = test_gravity.TestGravity()
+        data.setup_method()
+        self.data = data
+        self.w = netW(np.column_stack((data.o, data.d)), share="C")
+
+    def test_kron_candidates(self):
+        w = ODW(lat2W(4, 4), lat2W(3, 5))
+        ef = EigenFilter(w, k=20, threshold=0)
+        K = np.kron(_mcm(w.Wo), _mcm(w.Wd))
+        evals = np.linalg.eigvalsh(K)[::-1]
+        np.testing.assert_allclose(ef.evals, evals[: len(ef.evals)], atol=1e-10)
+        E = ef.candidates(np.arange(len(ef.evals)))
+        np.testing.assert_allclose(K @ E, E * ef.evals, atol=1e-10)
+        np.testing.assert_allclose(E.T @ E, np.eye(len(ef.evals)), atol=1e-10)
+        np.testing.assert_allclose(E.sum(axis=0), 0, atol=1e-10)
+
+    def test_mcm_eigs(self):
+        evals, evecs = mcm_eigs(self.w, 5)
+        np.testing.assert_allclose(
+            evals, np.linalg.eigvalsh(_mcm(self.w.sparse))[::-1][:5], atol=1e-10
+        )
+        # Lanczos path
+        w = lat2W(40, 30)
+        evals, evecs = mcm_eigs(w, 4)
+        np.testing.assert_allclose(
+            evals, np.linalg.eigvalsh(_mcm(w.sparse))[::-1][:4], atol=1e-8
+        )
+
+    def test_Gravity_SF(self):
+        d = self.data
+        model = Gravity(d.f, d.o_var, d.d_var, d.dij, "pow", SF=EigenFilter(self.w))
+        assert len(model.SF.selected) == 4
+        assert model.k == 8
+        np.testing.assert_allclose(
+            model.params[:4],
+            [2.77782979, 0.52895041, 0.61107768, -1.25681287],
+            atol=1e-06,
+        )
+        assert pytest.approx(model.AIC) == 6653.125926016481
+        # selected eigenvectors passed as an array give the same model
+        fixed = Gravity(d.f, d.o_var, d.d_var, d.dij, "pow", SF=model.SF.vectors)
+        np.testing.assert_allclose(fixed.params, model.params, atol=1e-06)
+        with pytest.raises(ValueError):
+            Gravity(d.f, d.o_var, d.d_var, d.dij, "pow", SF=lat2W(4, 4))
@@ -0,0 +1,57 @@
+"""
+Tests for analysis of spatial autocorrelation amongst flows
+
+"""
+
+import numpy as np
+import pytest
+from libpysal.weights import WSP, lat2W
+from scipy import sparse as sp
+
+from ..flow_SA import FlowMoran
+from ..spintW import ODW, netW
+
+
+class TestFlowMoran:
+    """Tests FlowMoran class"""
+
+    def setup_method(self):
+        rng = np.random.default_rng(123456)
+        self.Wo = lat2W(4, 4)
+        self.Wd = lat2W(3, 5)
+        self.odw = ODW(self.Wo, self.Wd)
+        flows = rng.poisson(20, (16, 15)).astype(float)
+        self.flows = flows + 2 * self.odw.lag(flows)
+
+    def test_matches_materialized(self):
+        fm = FlowMoran(self.flows, self.odw)
+        w = WSP(sp.kron(self.Wo.sparse, self.Wd.sparse)).to_W(silence_warnings=True)
+        w.transform = "r"
+        fm_w = FlowMoran(self.flows.ravel(), w)
+        assert pytest.approx(fm.I) == 0.351157483938
+        assert pytest.approx(fm.I) == fm_w.I
+        assert pytest.approx(fm.VI_norm) == fm_w.VI_norm
+        assert pytest.approx(fm.VI_rand) == fm_w.VI_rand
+        assert pytest.approx(fm.z_norm) == 11.3670020070
+        assert fm.p_norm < 1e-10
+
+    def test_permutations(self):
+        # restore the global random state so that other test modules are not
+        # affected by this seed
+        state = np.random.get_state()
+        np.random.seed(1)
+        try:
+            fm = FlowMoran(self.flows, self.odw, permutations=99, batch_size=40)
+        finally:
+            np.random.set_state(state)
+        assert fm.sim.shape == (99,)
+        assert pytest.approx(fm.p_sim) == 0.01
+        assert fm.z_sim > 5
+
+    def test_network_weights(self):
+        links = [(i, j) for i in range(6) for j in range(6) if i != j]
+        flows = np.arange(len(links), dtype=float)
+        fm = FlowMoran(flows, netW(links, share="O"))
+        assert fm.I > 0
+        with pytest.raises(ValueError):
+            FlowMoran(flows[:-1], netW(links, share="O"))
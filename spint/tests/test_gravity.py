@@ -17,6 +17,7 @@ import numpy as np
 import pytest
 
 from ..gravity import Attraction, BaseGravity, Doubly, Gravity, Production
+from ..spintW import netW
 
 
 class TestGravity:
@@ -2108,3 +2109,34 @@ class TestGravity:
         assert pytest.approx(model.pseudoR2) == 0.943539912198
         assert pytest.approx(model.adj_pseudoR2) == 0.943335452826
         assert pytest.approx(model.SRMSE) == 0.37925654532618808
+
+    def test_resid_moran(self):
+        w = netW(np.column_stack((self.o, self.d)), share="OD")
+        model = Doubly(self.f, self.o, self.d, self.dij, "exp")
+        res = model.resid_moran(w)
+        assert pytest.approx(res.I) == -0.08083814363520886
+        assert pytest.approx(res.EI) == -0.11302505818572708
+        assert pytest.approx(res.VI) == 0.00013096669903793316
+        assert pytest.approx(res.z) == 2.8125412863185915
+        assert pytest.approx(res.p) == 0.004915171316913958
+        assert pytest.approx(res.LM) == 3.2935419550588723
+        assert pytest.approx(res.p_LM) == 0.06955283276513144
+        res = model.resid_moran(w, resid="deviance", chunk_size=5)
+        assert pytest.approx(res.I) == -0.08250820344351781
+        assert pytest.approx(res.VI) == 0.00013096669903793316
+        with pytest.raises(ValueError):
+            model.resid_moran(netW(np.column_stack((self.o, self.d))[:-1]))
+
+    def test_Production_CD(self):
+        model = Production(
+            self.f, self.o, self.d_var, self.dij, "pow", CD=True, destinations=self.d
+        )
+        np.testing.assert_allclose(
+            model.params[-3:], [0.82280699, -0.93653985, -0.53246345], atol=1e-06
+        )
+        assert pytest.approx(model.AIC) == 9534.15532846954
+        acc = model.cd
+        fixed = Production(self.f, self.o, self.d_var, self.dij, "pow", CD=acc)
+        np.testing.assert_allclose(fixed.params, model.params)
+        with pytest.raises(ValueError):
+            Production(self.f, self.o, self.d_var, self.dij, "pow", CD=True)
@@ -0,0 +1,107 @@
+"""
+Tests for origin-destination spatial lag models.
+"""
+
+from functools import partial
+
+import numpy as np
+import pytest
+from libpysal.weights import lat2W
+
+from .. import od_lag
+from ..gravity import Gravity
+from ..od_lag import ODLag
+from ..spintW import ODW
+
+
+class TestODLag:
+    def setup_method(self):
+        self.w = w = ODW(lat2W(5, 5), lat2W(4, 6))
+        rng = np.random.default_rng(0)
+        self.X = X = rng.random((w.n, 2))
+        mu = 1.0 + X @ [[2.0], [-1.0]] + 0.2 * rng.standard_normal((w.n, 1))
+        mu = mu.reshape((w.o, w.d))
+        F = mu.copy()
+        for _i in range(200):
+            F = mu + 0.3 * (w.Wo @ F) + 0.1 * (F @ w.Wd.T) + 0.2 * w.lag(F)
+        self.flows = np.exp(F.reshape((-1, 1)))
+
+    def test_ODLag(self):
+        w = self.w
+        model = ODLag(self.flows, self.X, w)
+        np.testing.assert_allclose(
+            model.params,
+            [1.00153704, 2.07361386, -1.01633701, 0.3021342, 0.08468864, 0.20526009],
+            atol=1e-6,
+        )
+        np.testing.assert_allclose(
+            model.std_err,
+            [0.11794028, 0.02945987, 0.02982593, 0.01809524, 0.01960026, 0.03132898],
+            atol=1e-6,
+        )
+        # log-determinant, likelihood and reduced form against dense matrices
+        A = (
+            np.eye(w.n)
+            - model.rho[0] * np.kron(w.Wo.toarray(), np.eye(w.d))
+            - model.rho[1] * np.kron(np.eye(w.o), w.Wd.toarray())
+            - model.rho[2] * w.sparse.toarray()
+        )
+        logdet = np.linalg.slogdet(A)[1]
+        assert pytest.approx(model.logdet(model.rho)) == logdet
+        e = A @ model.y - model.X @ model.betas
+        llf = logdet - w.n / 2.0 * np.log(2 * np.pi * model.sig2)
+        llf -= (e.T @ e).item() / (2 * model.sig2)
+        assert pytest.approx(model.llf) == llf
+        np.testing.assert_allclose(
+            model.predy, np.linalg.solve(A, model.X @ model.betas), atol=1e-8
+        )
+
+    def test_Gravity_Lag(self):
+        flows = np.round(10 * self.flows).astype(int)
+        o_vars, d_vars = np.exp(self.X[:, :1]), np.exp(self.X[:, 1:])
+        cost = np.exp(np.arange(self.w.n) % 7 / 7.0)
+        model = Gravity(flows, o_vars, d_vars, cost, "pow", Lag=self.w)
+        X = np.column_stack((self.X, np.log(cost)))
+        np.testing.assert_allclose(
+            model.params, ODLag(flows, X, self.w).params, atol=1e-10
+        )
+        np.testing.assert_allclose(model.rho, model.params[-3:])
+        assert model.k == 7
+        assert model.params.shape == model.std_err.shape == model.tvalues.shape == (7,)
+        assert 0 < model.SSI < 1
+        with pytest.raises(ValueError):
+            model.resid_moran(self.w)
+        with pytest.raises(ValueError):
+            Gravity(flows, o_vars, d_vars, cost, "pow", Lag=self.w, SF=cost)
+
+    def test_trace_logdet(self, monkeypatch):
+        exact = ODLag(self.flows, self.X, self.w)
+        # estimated traces of the powers of the factors instead of eigenvalues
+        monkeypatch.setattr(od_lag, "EIG_MAX", 3)
+        model = ODLag(self.flows, self.X, self.w)
+        np.testing.assert_allclose(model.params, exact.params, atol=5e-3)
+        for rho in (exact.rho, [0.5, 0.2, 0.1], [-0.3, 0.4, 0.1]):
+            rho = np.asarray(rho)
+            assert model.logdet(rho) == pytest.approx(exact.logdet(rho), rel=0.02)
+            grad = model._gradient(rho)
+            for i in range(3):
+                h = np.eye(3)[i] * 1e-6
+                fd = (
+                    model._concentrated(rho + h) - model._concentrated(rho - h)
+                ) / 2e-6
+                assert grad[i] == pytest.approx(fd, rel=1e-5)
+
+    def test_errors(self, monkeypatch):
+        # a solver that stops before converging
+        monkeypatch.setattr(
+            od_lag, "gmres", partial(od_lag.gmres, maxiter=1, restart=2)
+        )
+        with pytest.raises(RuntimeError):
+            ODLag(self.flows, self.X, self.w)
+        monkeypatch.undo()
+        with pytest.raises(TypeError):
+            ODLag(self.flows, self.X, self.w.sparse)
+        flows = self.flows.copy()
+        flows[0] = 0
+        with pytest.raises(ValueError):
+            ODLag(flows, self.X, self.w)
@@ -0,0 +1,167 @@
+"""
+Tests for weights of origin-destination flows and vectors
+
+"""
+
+__author__ = "Taylor Oshan tayoshan@gmail.com"
+
+
+import numpy as np
+import pytest
+from libpysal.weights import WSP, lat2W
+from libpysal.weights.distance import DistanceBand
+from scipy import sparse as sp
+
+from ..spintW import ODW, VecDistanceBand, mat2L, netW, vecW
+
+
+class TestODW:
+    """Tests ODW class"""
+
+    def setup_method(self):
+        self.Wo = lat2W(3, 4)
+        self.Wd = lat2W(2, 5)
+        rng = np.random.default_rng(123456)
+        self.X = rng.uniform(0, 100, (120, 3))
+
+    def kron(self, transform):
+        w = WSP(sp.kron(self.Wo.sparse, self.Wd.sparse)).to_W(silence_warnings=True)
+        w.transform = transform
+        return w
+
+    def test_lag(self):
+        for transform in ("r", "b"):
+            odw = ODW(self.Wo, self.Wd, transform=transform)
+            dense = self.kron(transform).full()[0]
+            assert odw.shape == (120, 120)
+            np.testing.assert_allclose(odw @ self.X[:, 0], dense @ self.X[:, 0])
+            np.testing.assert_allclose(odw @ self.X, dense @ self.X)
+            np.testing.assert_allclose(odw.T @ self.X, dense.T @ self.X)
+            F = self.X[:, 0].reshape((12, 10))
+            np.testing.assert_allclose(odw.lag(F).ravel(), dense @ self.X[:, 0])
+
+    def test_sums(self):
+        for transform in ("r", "b"):
+            odw = ODW(self.Wo, self.Wd, transform=transform)
+            w = self.kron(transform)
+            assert pytest.approx(odw.s0) == w.s0
+            assert pytest.approx(odw.s1) == w.s1
+            assert pytest.approx(odw.s2) == w.s2
+
+    def test_valued(self):
+        rng = np.random.default_rng(0)
+        Wo = self.Wo.sparse.multiply(rng.uniform(0.5, 2, (12, 12))).tocsr()
+        Wd = self.Wd.sparse.multiply(rng.uniform(0.5, 2, (10, 10))).tocsr()
+        kron = sp.kron(Wo, Wd).toarray()
+        odw = ODW(Wo, Wd, transform="r")
+        np.testing.assert_allclose(
+            odw @ self.X, kron / kron.sum(axis=1, keepdims=True) @ self.X
+        )
+        np.testing.assert_allclose(
+            ODW(Wo, Wd, transform="b") @ self.X, (kron > 0) @ self.X
+        )
+
+    def test_materialize(self):
+        odw = ODW(self.Wo, self.Wd, transform="b")
+        full, ids = odw.full()
+        np.testing.assert_array_equal(full, self.kron("b").full()[0])
+        assert ids[:2] == [(0, 0), (0, 1)]
+        assert odw.to_W().n == 120
+        with pytest.raises(ValueError):
+            ODW(self.Wo, self.Wd, transform="v")
+
+
+class TestNetW:
+    """Tests netW function"""
+
+    def setup_method(self):
+        self.link_list = [
+            ("a", "b"),
+            ("a", "c"),
+            ("a", "d"),
+            ("b", "a"),
+            ("b", "c"),
+            ("b", "d"),
+            ("c", "a"),
+            ("c", "b"),
+            ("c", "d"),
+            ("d", "a"),
+            ("d", "b"),
+            ("d", "c"),
+        ]
+
+    def neighbors(self, share):
+        rules = {
+            "A": lambda k, n: k[0] in n or k[1] in n,
+            "O": lambda k, n: k[0] == n[0],
+            "D": lambda k, n: k[1] == n[1],
+            "OD": lambda k, n: k[0] == n[0] or k[1] == n[1],
+            "C": lambda k, n: k[1] == n[0],
+        }
+        return np.array(
+            [
+                [key != neigh and rules[share](key, neigh) for neigh in self.link_list]
+                for key in self.link_list
+            ],
+            dtype=float,
+        )
+
+    def test_netW(self):
+        for share in ("A", "O", "D", "OD", "C"):
+            w = netW(self.link_list, share=share, transform="b")
+            np.testing.assert_array_equal(w.sparse.toarray(), self.neighbors(share))
+        w = netW(self.link_list, share="OD")
+        np.testing.assert_allclose(w.sparse.sum(axis=1), 1)
+        assert w.to_W().id_order[0] == ("a", "b")
+        with pytest.raises(AttributeError):
+            netW(self.link_list, share="X")
+
+    def test_integer_links(self):
+        links = mat2L(np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0]]))
+        np.testing.assert_array_equal(
+            links, [[0, 1], [0, 2], [1, 0], [1, 2], [2, 0], [2, 1]]
+        )
+        w = netW(links, share="C", transform="b")
+        assert w.n == 6
+        assert w.sparse.nnz == 12
+
+    def test_max_degree(self):
+        links = [(0, 1), (0, 2), (0, 3), (0, 4), (5, 1), (5, 2)]
+        w = netW(links, share="O", transform="b", max_degree=3)
+        assert w.sparse.nnz == 2
+        np.testing.assert_array_equal(w.sparse[4].toarray(), [[0, 0, 0, 0, 0, 1]])
+
+
+class TestVecW:
+    """Tests vecW function"""
+
+    def setup_method(self):
+        rng = np.random.default_rng(123456)
+        self.vecs = rng.uniform(0, 100, (300, 4))
+
+    def test_vecW(self):
+        w = vecW(*self.vecs.T, threshold=25, silence_warnings=True)
+        dw = DistanceBand(self.vecs, threshold=25, silence_warnings=True)
+        assert isinstance(w, VecDistanceBand)
+        assert w.n == 300
+        assert w.s0 == dw.s0
+        assert (w.sparse != dw.sparse).nnz == 0
+
+    def test_vecW_chunked_decay(self):
+        w = vecW(
+            *self.vecs.T,
+            threshold=25,
+            binary=False,
+            alpha=-1.5,
+            chunk_size=41,
+            silence_warnings=True,
+        )
+        dw = DistanceBand(
+            self.vecs, threshold=25, binary=False, alpha=-1.5, silence_warnings=True
+        )
+        assert pytest.approx(w.s0) == dw.s0
+        np.testing.assert_allclose(w.sparse.toarray(), dw.sparse.toarray())
+
+    def test_vecW_shape(self):
+        with pytest.raises(ValueError):
+            VecDistanceBand(self.vecs[:, :2], threshold=25)
@@ -15,9 +15,10 @@ __author__ = "Tyler Hoffman tylerhoff1@gmail.com"
 
 
 import numpy as np
+import pytest
 from scipy.stats import pearsonr
 
-from ..universal import PWO, Lenormand, Radiation
+from ..universal import PWO, Ensemble, Lenormand, Radiation
 
 np.random.seed(123456)
 
@@ -582,6 +583,144 @@ class TestUniversal:
             pearsonr(T_L.flatten(), T_obs.flatten()), (-0.0724832, 0.5201876)
         )
 
+    def test_Lenormand_batches(self):
+        outflows, inflows, locs, dists, T_obs = self.ready()
+        model = Lenormand(inflows, outflows, dists, beta=0.01)
+        T = model.flowmat(batch=0.01, rng=np.random.default_rng(0))
+        np.testing.assert_array_equal(T.sum(axis=1), outflows)
+        np.testing.assert_array_equal(T.sum(axis=0), inflows)
+        np.testing.assert_array_equal(
+            model.flowmat(batch=0.01, rng=1), model.flowmat(batch=0.01, rng=1)
+        )
+        # one trip per round
+        small = Lenormand(inflows // 100, outflows // 100, dists, beta=0.01)
+        T = small.flowmat(rng=0)
+        np.testing.assert_array_equal(T.sum(axis=1), outflows // 100)
+        assert (T.sum(axis=0) <= inflows // 100).all()
+        np.testing.assert_array_equal(small.flowmat(rng=2), small.flowmat(rng=2))
+        with pytest.raises(ValueError):
+            Lenormand(inflows / 7, outflows, dists).flowmat()
+
+    def test_Lenormand_expected(self):
+        outflows, inflows, locs, dists, T_obs = self.ready()
+        model = Lenormand(inflows, outflows, dists, beta=0.01)
+        T = model.flowmat(mode="expected")
+        np.testing.assert_allclose(T.sum(axis=1), outflows)
+        np.testing.assert_allclose(T.sum(axis=0), inflows)
+        # balancing factors a_i b_j of the decay
+        ab = T / np.exp(-0.01 * dists)
+        np.testing.assert_allclose(ab, np.outer(ab[:, 0], ab[0] / ab[0, 0]))
+        with pytest.raises(ValueError):
+            model.flowmat(mode="mean")
+
+    def test_Lenormand_ensemble(self):
+        outflows, inflows, locs, dists, T_obs = self.ready()
+        model = Lenormand(inflows // 100, outflows // 100, dists, beta=0.01)
+        ens = model.ensemble(8, seed=0)
+        seeds = np.random.SeedSequence(0).spawn(8)
+        T = np.array([model.flowmat(rng=np.random.default_rng(s)) for s in seeds])
+        assert ens.realizations == 8
+        np.testing.assert_allclose(ens.mean, T.mean(axis=0))
+        np.testing.assert_allclose(ens.var, T.var(axis=0, ddof=1))
+        parallel = model.ensemble(8, seed=0, n_jobs=2)
+        np.testing.assert_array_equal(parallel.mean, ens.mean)
+        np.testing.assert_array_equal(parallel.quantiles, ens.quantiles)
+
+    def test_Ensemble(self):
+        rng = np.random.default_rng(0)
+        X = rng.standard_normal((1000, 4, 5)) * np.arange(1, 6)
+        ens = Ensemble((4, 5), (0.1, 0.5, 0.9))
+        for i, x in enumerate(X):
+            ens.update(x)
+            if i in (2, 4, 5):
+                # exact for the first realizations
+                np.testing.assert_allclose(
+                    ens.quantiles, np.quantile(X[: i + 1], ens.probs, axis=0)
+                )
+        np.testing.assert_allclose(ens.mean, X.mean(axis=0))
+        np.testing.assert_allclose(ens.std, X.std(axis=0, ddof=1))
+        error = (ens.quantiles - np.quantile(X, ens.probs, axis=0)) / X.std(axis=0)
+        assert np.abs(error).max() < 0.1
+
+    def test_Ensemble_skewed(self):
+        rng = np.random.default_rng(0)
+        X = rng.lognormal(0, 1.5, (500, 3, 4))
+        probs = (0.05, 0.5, 0.95)
+        ens = Ensemble((3, 4), probs)
+        for x in X:
+            ens.update(x)
+
+        # one cell and probability at a time, following Jain and Chlamtac (1985)
+        # with the markers started at their desired positions
+        def p2(xs, p):
+            f = np.array([0, p / 2, p, (1 + p) / 2, 1])
+            q = list(np.quantile(xs[:6], f))
+            n = list(1 + 5 * f)
+            for count, x in enumerate(xs[6:], 7):
+                if x < q[0]:
+                    q[0], k = x, 0
+                elif x >= q[4]:
+                    q[4], k = x, 3
+                else:
+                    k = max(i for i in range(4) if q[i] <= x)
+                for i in range(k + 1, 5):
+                    n[i] += 1
+                desired = 1 + (count - 1) * f
+                for i in (1, 2, 3):
+                    d = desired[i] - n[i]
+                    if (d >= 1 and n[i + 1] - n[i] > 1) or (
+                        d <= -1 and n[i - 1] - n[i] < -1
+                    ):
+                        s = 1 if d > 0 else -1
+                        qp = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                            (n[i] - n[i - 1] + s)
+                            * (q[i + 1] - q[i])
+                            / (n[i + 1] - n[i])
+                            + (n[i + 1] - n[i] - s)
+                            * (q[i] - q[i - 1])
+                            / (n[i] - n[i - 1])
+                        )
+                        if q[i - 1] < qp < q[i + 1]:
+                            q[i] = qp
+                        else:
+                            q[i] += s * (q[i + s] - q[i]) / (n[i + s] - n[i])
+                        n[i] += s
+            return q[2]
+
+        expected = [
+            [[p2(X[:, i, j], p) for j in range(4)] for i in range(3)] for p in probs
+        ]
+        np.testing.assert_allclose(ens.quantiles, expected, rtol=1e-12)
+
+    def test_locations(self):
+        rng = np.random.default_rng(0)
+        locs = rng.random((30, 2))
+        dists = np.linalg.norm(locs[:, None] - locs[None], axis=-1)
+        inflows = rng.integers(1, 100, 30)
+        outflows = rng.multinomial(inflows.sum(), np.full(30, 1 / 30))
+        for model in (Radiation, PWO):
+            np.testing.assert_allclose(
+                model(inflows, outflows, None, locs, locs).flowmat(chunk_size=7),
+                model(inflows, outflows, dists, locs, locs).flowmat(),
+            )
+        lazy = Lenormand(inflows, outflows, beta=2, ilocs=locs, olocs=locs)
+        dense = Lenormand(inflows, outflows, dists, beta=2)
+        np.testing.assert_array_equal(lazy.flowmat(rng=0), dense.flowmat(rng=0))
+        np.testing.assert_allclose(
+            lazy.flowmat(mode="expected", chunk_size=7), dense.flowmat(mode="expected")
+        )
+        # distinct origin and destination locations, asymmetric distances
+        olocs = rng.random((30, 2))
+        odists = np.linalg.norm(olocs[:, None] - locs[None], axis=-1)
+        # PWO reads the distances from destination j to the origins in row j
+        for model, d in ((Radiation, odists), (PWO, odists.T)):
+            np.testing.assert_allclose(
+                model(inflows, outflows, None, locs, olocs).flowmat(chunk_size=7),
+                model(inflows, outflows, d, locs, olocs).flowmat(),
+            )
+        with pytest.raises(ValueError):
+            Radiation(inflows, outflows, None, locs)
+
     # x: array([5.0901729e-01, 1.2200025e-06])
     # y: array([0.053846 , 0.6330569])
     def test_Radiation(self):
@@ -605,3 +744,69 @@ class TestUniversal:
             pearsonr(T_P.flatten(), T_obs.flatten()),
             (0.23623562773229048, 0.033734908271368574),
         )
+
+    def test_Radiation_chunks(self):
+        rng = np.random.default_rng(0)
+        locs = rng.random((30, 2))
+        dists = np.linalg.norm(locs[:, None] - locs[None], axis=-1)
+        inflows = rng.integers(1, 1000, 30)
+        outflows = rng.integers(1, 1000, 30)
+        T = Radiation(inflows, outflows, dists, locs, locs).flowmat(chunk_size=7)
+
+        # one origin at a time, following Simini et al. (2012)
+        total = outflows.sum()
+        for i in range(30):
+            s = 0.0
+            for j in np.argsort(dists[i]):
+                m, n = outflows[i], inflows[j]
+                expected = m * n / ((m + s) * (m + n + s)) / (1 - m / total)
+                np.testing.assert_allclose(T[i, j], expected, rtol=1e-12)
+                s += n
+
+    def test_PWO_chunks(self):
+        rng = np.random.default_rng(0)
+        locs = rng.random((20, 2))
+        dists = np.linalg.norm(locs[:, None] - locs[None], axis=-1)
+        inflows = rng.integers(1, 1000, 20)
+        outflows = rng.integers(1, 1000, 20)
+        T = PWO(inflows, outflows, dists, locs, locs).flowmat(chunk_size=7)
+        np.testing.assert_allclose(
+            T, self.pwo_reference(inflows, outflows, dists), rtol=1e-12
+        )
+
+    def test_PWO_rectangular(self):
+        rng = np.random.default_rng(0)
+        for n, m in ((5, 3), (3, 5)):
+            olocs = rng.random((n, 2))
+            ilocs = rng.random((m, 2))
+            dists = np.linalg.norm(ilocs[:, None] - olocs[None], axis=-1)
+            inflows = rng.integers(1, 1000, m)
+            outflows = rng.integers(1, 1000, n)
+            expected = self.pwo_reference(inflows, outflows, dists)
+            for model in (
+                PWO(inflows, outflows, dists, ilocs, olocs),
+                PWO(inflows, outflows, None, ilocs, olocs),
+            ):
+                T = model.flowmat(chunk_size=2)
+                assert T.shape == (n, m)
+                np.testing.assert_allclose(T, expected, rtol=1e-12)
+
+    @staticmethod
+    def pwo_reference(inflows, outflows, dists):
+        # one destination at a time, following Yan et al. (2014)
+        M, N = dists.shape
+        total = inflows.sum()
+        T = np.zeros((N, M))
+        for j in range(M):
+            didxs = np.argsort(dists[j])
+            pop_in_radius = inflows[j]
+            for i, origin in enumerate(didxs):
+                pop_in_radius += outflows[origin]
+                denom = 0
+                denom_pop_in_radius = outflows[origin]
+                for k in range(M):
+                    denom_pop_in_radius += inflows[k]
+                    if k != i:
+                        denom += inflows[k] * (1 / denom_pop_in_radius - 1 / total)
+                T[origin, j] = inflows[j] * (1 / pop_in_radius - 1 / total) / denom
+        return T
@@ -0,0 +1,61 @@
+"""
+Tests for utility functions for analyzing spatial interaction data
+
+"""
+
+__author__ = "Taylor Oshan tayoshan@gmail.com"
+
+
+import numpy as np
+import pytest
+from libpysal.weights import lat2W
+from scipy.sparse.linalg import aslinearoperator
+
+from ..utils import LagOperator, lag_spatial
+
+
+class TestLagOperator:
+    """Tests LagOperator class"""
+
+    def setup_method(self):
+        self.w = lat2W(4, 3)
+        self.w.transform = "r"
+        self.dense = self.w.full()[0]
+        rng = np.random.default_rng(123456)
+        self.y = rng.normal(size=12)
+        self.Y = rng.normal(size=(12, 3))
+
+    def test_lag(self):
+        lag = LagOperator(self.w)
+        np.testing.assert_allclose(lag.lag(self.y), self.dense @ self.y)
+        np.testing.assert_allclose(lag.lag(self.Y), self.dense @ self.Y)
+        np.testing.assert_allclose(lag.rlag(self.Y), self.dense.T @ self.Y)
+        np.testing.assert_allclose(lag @ self.y, lag_spatial(self.w, self.y))
+
+    def test_reuse(self, monkeypatch):
+        lag = LagOperator(self.w)
+        built = []
+        init = LagOperator.__init__
+        monkeypatch.setattr(
+            LagOperator, "__init__", lambda op, w: built.append(w) or init(op, w)
+        )
+        np.testing.assert_allclose(lag_spatial(lag, self.Y), self.dense @ self.Y)
+        assert not built
+
+    def test_linear_operator(self):
+        lag = LagOperator(aslinearoperator(self.w.sparse))
+        assert lag.sparse is None
+        np.testing.assert_allclose(lag.lag(self.Y), self.dense @ self.Y)
+        np.testing.assert_allclose(lag.rlag(self.y), self.dense.T @ self.y)
+
+    def test_sums(self):
+        lag = LagOperator(self.w.sparse)
+        assert pytest.approx(lag.s0) == self.w.s0
+        assert pytest.approx(lag.s1) == self.w.s1
+        assert pytest.approx(lag.s2) == self.w.s2
+
+    def test_errors(self):
+        with pytest.raises(TypeError):
+            LagOperator([1, 2, 3])
+        with pytest.raises(ValueError):
+            LagOperator(np.ones((2, 3)))
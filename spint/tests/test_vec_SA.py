@@ -6,11 +6,14 @@ Tests for analysis of spatial autocorrelation within vectors
 __author__ = "Taylor Oshan tayoshan@gmail.com"
 
 
+import tracemalloc
+
 import numpy as np
 import pytest
 from libpysal.weights.distance import DistanceBand
 
-from ..vec_SA import VecMoran
+from ..spintW import vecW
+from ..vec_SA import VecMoran, VecMoranBatch, VecMoranCorrelogram
 
 
 class TestVecMoran:
@@ -57,3 +60,163 @@ class TestVecMoran:
         vmd = VecMoran(self.vecs, wd, focus="destination", rand="B")
         assert pytest.approx(vmd.I) == -0.764603695022
         assert pytest.approx(vmd.p_z_sim) == 0.12411761124197379
+
+    def test_od_focused(self):
+        w = vecW(*self.vecs[:, 1:5].T, threshold=9999, alpha=-1.5, binary=False)
+        np.random.seed(1)
+        vm = VecMoran(self.vecs, w, focus="od", rand="A")
+        assert pytest.approx(vm.I) == 0.639012087865
+        assert pytest.approx(vm.p_z_sim) == 0.292547262007
+        wo = DistanceBand(self.origins, threshold=9999, alpha=-1.5, binary=False)
+        with pytest.raises(TypeError):
+            VecMoran(self.vecs, wo, focus="od")
+
+
+class TestVecMoranScaling:
+    """Analytical VecMoran inference for 1,000,000 vectors
+
+    The analytical path (permutations=None) only keeps arrays of length n and
+    sparse lags of length n, so 1,000,000 vectors with roughly 5 neighbors each
+    fit in a 64 MB budget, whereas a dense n x n intermediate would need 8 TB.
+    The weight's own sparse matrix and sums are built before tracing since they
+    are cached by the W object and shared with every statistic using it.
+    Building the 1,000,000 point DistanceBand dominates the run time, so the
+    test only runs when selected with ``pytest -m slow``.
+    """
+
+    @pytest.mark.slow
+    def test_analytical_memory(self):
+        n = 1_000_000
+        rng = np.random.default_rng(123456)
+        origins = rng.uniform(0, 1000, (n, 2))
+        dests = origins + rng.normal(0, 1, (n, 2))
+        vecs = np.column_stack([np.arange(n), origins, dests])
+        w = DistanceBand(origins, threshold=1.2, silence_warnings=True)
+        w.sparse, w.s0, w.s1, w.s2  # noqa: B018 - cache weight structure
+        tracemalloc.start()
+        vm = VecMoran(vecs, w, permutations=None)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < 64 * 2**20
+        assert vm.n == n
+        assert np.isfinite(vm.I)
+        assert np.isfinite(vm.VI_rand)
+
+
+class TestVecMoranBatch:
+    """Tests VecMoranBatch class"""
+
+    def setup_method(self):
+        rng = np.random.default_rng(123456)
+        n = 40
+        self.origins = rng.uniform(0, 100, (n, 2))
+        self.ys = np.stack(
+            [
+                np.column_stack(
+                    [
+                        np.arange(n),
+                        self.origins,
+                        self.origins + rng.normal(0, 10, (n, 2)),
+                    ]
+                )
+                for _ in range(5)
+            ]
+        )
+
+    def test_matches_VecMoran(self):
+        w = DistanceBand(self.origins, threshold=30, silence_warnings=True)
+        vmb = VecMoranBatch(self.ys, w)
+        assert vmb.I.shape == (5,)
+        for k, y in enumerate(self.ys):
+            vm = VecMoran(y, w, permutations=None)
+            assert pytest.approx(vmb.I[k]) == vm.I
+            assert pytest.approx(vmb.VI_rand[k]) == vm.VI_rand
+        assert vmb.EI == vm.EI
+
+    def test_mismatched_weights(self):
+        w = DistanceBand(self.origins[:-1], threshold=30, silence_warnings=True)
+        with pytest.raises(ValueError):
+            VecMoranBatch(self.ys, w)
+
+
+class TestVecMoranCorrelogram:
+    """Tests VecMoranCorrelogram class"""
+
+    def setup_method(self):
+        self.vecs = np.array(
+            [
+                [1, 55, 60, 100, 500],
+                [2, 60, 55, 105, 501],
+                [3, 500, 55, 155, 500],
+                [4, 505, 60, 160, 500],
+                [5, 105, 950, 105, 500],
+                [6, 155, 950, 155, 499],
+            ]
+        )
+        self.thresholds = [500, 1000, 9999]
+
+    def test_matches_VecMoran(self):
+        for focus, coords in [("origin", 1), ("destination", 3)]:
+            for binary in (True, False):
+                vmc = VecMoranCorrelogram(
+                    self.vecs,
+                    self.thresholds,
+                    focus=focus,
+                    binary=binary,
+                    alpha=-1.5,
+                )
+                for band, threshold in enumerate(self.thresholds):
+                    w = DistanceBand(
+                        self.vecs[:, coords : coords + 2],
+                        threshold=threshold,
+                        alpha=-1.5,
+                        binary=binary,
+                        silence_warnings=True,
+                    )
+                    vm = VecMoran(self.vecs, w, focus=focus, permutations=None)
+                    assert pytest.approx(vmc.s0[band]) == w.s0
+                    assert pytest.approx(vmc.s1[band]) == w.s1
+                    assert pytest.approx(vmc.s2[band]) == w.s2
+                    assert pytest.approx(vmc.I[band]) == vm.I
+                    assert pytest.approx(vmc.VI_rand[band], nan_ok=True) == vm.VI_rand
+
+    def test_permutations(self):
+        np.random.seed(1)
+        vmc = VecMoranCorrelogram(
+            self.vecs, self.thresholds, binary=False, alpha=-1.5, permutations=99
+        )
+        assert vmc.sim.shape == (99, 3)
+        np.testing.assert_allclose(vmc.I, [0.649853103, 0.645944594, 0.645944594])
+        assert ((vmc.p_sim > 0) & (vmc.p_sim <= 1)).all()
+
+    def test_od_permutations(self):
+        for rand in ("A", "B"):
+            np.random.seed(1)
+            vmc = VecMoranCorrelogram(
+                self.vecs,
+                self.thresholds,
+                focus="od",
+                binary=False,
+                alpha=-1.5,
+                rand=rand,
+                permutations=5,
+            )
+            np.random.seed(1)
+            for perm in range(5):
+                idx = np.random.permutation(6)
+                y = self.vecs.astype(float)
+                if rand == "A":
+                    y[:, 3:5] += y[idx, 1:3] - y[:, 1:3]
+                    y[:, 1:3] = y[idx, 1:3]
+                else:
+                    y[:, 3:5] = y[idx, 3:5]
+                for band, threshold in enumerate(self.thresholds):
+                    w = vecW(
+                        *y[:, 1:5].T,
+                        threshold=threshold,
+                        alpha=-1.5,
+                        binary=False,
+                        silence_warnings=True,
+                    )
+                    vm = VecMoran(y, w, focus="od", permutations=None)
+                    assert pytest.approx(vmc.sim[perm, band]) == vm.I
@@ -18,9 +18,12 @@ Yan, X.-Y., Zhao, C., Fan, Y., Di, Z., and Wang, W.-X. (2014). "Universal
 __author__ = "Tyler Hoffman tylerhoff1@gmail.com"
 
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
+from scipy.spatial.distance import cdist
 from scipy.stats import pearsonr
 
 
@@ -36,7 +39,13 @@ class Universal(ABC):
     outflows        : array of reals
                       M x 1, observed flows out of each location
     dists           : matrix of reals
-                      N x M, pairwise distances between each location
+                      N x M, pairwise distances between each location, or
+                      None to compute Euclidean distances between ilocs and
+                      olocs in chunks of rows when they are needed
+    ilocs           : array of reals
+                      N x 2, inflow node locations
+    olocs           : array of reals
+                      M x 2, outflow node locations
 
     Attributes
     ----------
@@ -48,12 +57,26 @@ class Universal(ABC):
                       estimates flows, implemented by children
     """
 
-    def __init__(self, inflows, outflows, dists):
+    def __init__(self, inflows, outflows, dists=None, ilocs=None, olocs=None):
+        if dists is None and (ilocs is None or olocs is None):
+            raise ValueError("Either dists or both ilocs and olocs are required")
         self.N = len(outflows)  # number of origins
         self.M = len(inflows)  # number of destinations
         self.outflows = outflows.copy()  # list of origin outflows
         self.inflows = inflows.copy()  # list of destination inflows
-        self.dists = dists.copy()  # list of distances
+        self.dists = None if dists is None else dists.copy()  # list of distances
+        self.ilocs = None if ilocs is None else np.asarray(ilocs).copy()
+        self.olocs = None if olocs is None else np.asarray(olocs).copy()
+
+    def _distances(self, rows, from_destinations=False):
+        # Rows of the distance matrix, computed from the locations if no
+        # matrix was given: from the origins in rows to all destinations, or
+        # from the destinations in rows to all origins
+        if self.dists is not None:
+            return self.dists[rows]
+        if from_destinations:
+            return cdist(self.ilocs[rows], self.olocs)
+        return cdist(self.olocs[rows], self.ilocs)
 
     @abstractmethod
     def flowmat(self):
@@ -72,11 +95,18 @@ class Lenormand(Universal):
     outflows        : array of reals
                       M x 1, observed flows out of each location
     dists           : matrix of reals
-                      N x M, pairwise distances between each location
+                      N x M, pairwise distances between each location, or
+                      None to compute them from ilocs and olocs
     beta            : scalar
                       real, universal parameter for the model
     avg_sa          : scalar
                       real, average surface area of units
+    ilocs           : array of reals
+                      N x 2, inflow node locations; only used if dists is
+                      None
+    olocs           : array of reals
+                      M x 2, outflow node locations; only used if dists is
+                      None
 
     Attributes
     ----------
@@ -87,11 +117,27 @@ class Lenormand(Universal):
     calibrate       : method
                       calibrates beta using constants from the paper
     flowmat         : method
-                      estimates flows via the Lenormand model
+                      estimates flows via the Lenormand model; trips are
+                      drawn one at a time (batch=0, the default), or in
+                      approximate rounds of batch times the remaining trips
+                      (multinomial draws per origin), from a numpy Generator
+                      rng, a seed, or None for the global state; the flows
+                      must be integers;
+                      mode='expected' returns the doubly constrained
+                      expectation instead, balanced to the inflows and
+                      outflows by iterative proportional fitting; it is the
+                      doubly constrained gravity model that sampling
+                      approximates rather than the exact mean of the samples
+    ensemble        : method
+                      streams the mean, variance and quantiles of many
+                      realizations of flowmat into an Ensemble, optionally
+                      across a process pool
     """
 
-    def __init__(self, inflows, outflows, dists, beta=1, avg_sa=None):
-        super().__init__(inflows, outflows, dists)
+    def __init__(
+        self, inflows, outflows, dists=None, beta=1, avg_sa=None, ilocs=None, olocs=None
+    ):
+        super().__init__(inflows, outflows, dists, ilocs, olocs)
         self.beta = self.calibrate(avg_sa) if avg_sa is not None else beta
 
     def calibrate(self, avg_sa):
@@ -100,27 +146,104 @@ class Lenormand(Universal):
         alpha = 3.15 * 10 ** (-4)
         self.beta = alpha * avg_sa ** (-nu)
 
-    def flowmat(self):
+    def flowmat(
+        self,
+        mode="sample",
+        batch=0,
+        rng=None,
+        tol=1e-10,
+        max_iter=1000,
+        chunk_size=1000,
+    ):
         # Builds the matrix T from the parameter beta and a matrix of distances
-        T = np.zeros((self.N, self.M))
+        # one trip at a time, the sequential algorithm of the paper; batch > 0
+        # draws a fraction batch of the remaining trips per round instead,
+        # which is faster but only approximates the sequential sampler
+        if mode == "expected":
+            return self._expected(tol, max_iter, chunk_size)
+        if mode != "sample":
+            raise ValueError("mode must be 'sample' or 'expected'")
+        sIN = np.asarray(self.inflows)
+        sOUT = np.asarray(self.outflows)
+        if (sIN != np.round(sIN)).any() or (sOUT != np.round(sOUT)).any():
+            raise ValueError("Sampled flows require integer inflows and outflows")
 
         # Copy class variables so as not to modify
-        sIN = self.inflows.copy()
-        sOUT = self.outflows.copy()
+        sIN = sIN.astype(np.int64)
+        sOUT = sOUT.astype(np.int64)
+
+        # Decay does not change between rounds; from locations it is
+        # computed for the picked origins only
+        decay = None if self.dists is None else np.exp(-self.beta * self.dists)
+        if batch == 0:
+            # None draws from the global state, as np.random.seed expects
+            if rng is not None and not isinstance(rng, np.random.Generator):
+                rng = np.random.default_rng(rng)
+            return self._sequential(sIN, sOUT, decay, np.random if rng is None else rng)
+
+        if not isinstance(rng, np.random.Generator):
+            # seed from the global state so np.random.seed keeps working
+            rng = np.random.default_rng(
+                np.random.randint(2**31) if rng is None else rng
+            )
+        T = np.zeros((self.N, self.M))
 
         # Assembly loop
-        while sum(sOUT) > 0:
+        remaining = sOUT.sum()
+        while remaining > 0:
+            # Pick origins uniformly among those with nonzero sOUT
+            (idxs,) = np.where(sOUT > 0)
+            trips = max(1, int(batch * remaining))
+            counts = rng.multinomial(trips, np.full(len(idxs), 1.0 / len(idxs)))
+            counts = np.minimum(counts, sOUT[idxs])
+            idxs, counts = idxs[counts > 0], counts[counts > 0]
+
+            # Compute Pij's of the picked origins at the current sIN
+            P = sIN * (self._decay(idxs) if decay is None else decay[idxs])
+            totals = P.sum(axis=1, keepdims=True)
+            if (totals == 0).any():
+                raise ValueError(
+                    "Outflows exceed the inflows that are left to assign them to"
+                )
+
+            # Pick destinations for all trips of each origin at once
+            X = rng.multinomial(counts, P / totals)
+
+            # Destinations drawn more often than their remaining inflow keep
+            # a random subset of the trips; the others are drawn again
+            (full,) = np.where(X.sum(axis=0) > sIN)
+            for j in full:
+                X[:, j] = rng.multivariate_hypergeometric(X[:, j], sIN[j])
+
+            # Adjust values
+            T[idxs] += X
+            sIN -= X.sum(axis=0)
+            sOUT[idxs] -= X.sum(axis=1)
+            remaining = sOUT.sum()
+
+        return T
+
+    def _sequential(self, sIN, sOUT, decay, rng):
+        # One trip at a time from a Generator or the np.random module
+        T = np.zeros((self.N, self.M))
+
+        # Assembly loop
+        while sOUT.sum() > 0:
             # Pick random nonzero sOUT
             (idxs,) = np.where(sOUT > 0)
-            i = np.random.choice(idxs)
+            i = rng.choice(idxs)
 
             # Compute Pij's (not memoized b/c it changes on iteration)
-            Pi = np.multiply(sIN, np.exp(-self.beta * self.dists[i, :])) / np.dot(
-                sIN, np.exp(-self.beta * self.dists[i, :])
-            )
+            f = self._decay([i])[0] if decay is None else decay[i]
+            total = np.dot(sIN, f)
+            if total == 0:
+                raise ValueError(
+                    "Outflows exceed the inflows that are left to assign them to"
+                )
+            Pi = np.multiply(sIN, f) / total
 
             # Pick random j according to Pij
-            j = np.random.choice(range(self.N), p=Pi)
+            j = rng.choice(range(self.M), p=Pi)
 
             # Adjust values
             T[i, j] += 1
@@ -129,6 +252,222 @@ class Lenormand(Universal):
 
         return T
 
+    def ensemble(
+        self,
+        realizations=100,
+        quantiles=(0.05, 0.5, 0.95),
+        seed=None,
+        n_jobs=1,
+        batch=0,
+    ):
+        # Streams realizations of flowmat into an Ensemble, each drawn from an
+        # independent Generator spawned from one SeedSequence, optionally on a
+        # pool of n_jobs processes; results are consumed in order so that the
+        # ensemble only depends on the seed
+        if seed is None:
+            seed = np.random.randint(2**31)
+        seeds = np.random.SeedSequence(seed).spawn(realizations)
+        ens = Ensemble((self.N, self.M), quantiles)
+        if n_jobs == 1:
+            for child in seeds:
+                ens.update(self.flowmat(batch=batch, rng=np.random.default_rng(child)))
+            return ens
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_set_model, initargs=(self,)
+        ) as pool:
+            # at most 2 * n_jobs matrices are pending at any time
+            pending = deque()
+            for child in seeds:
+                pending.append(pool.submit(_realization, child, batch))
+                if len(pending) >= 2 * n_jobs:
+                    ens.update(pending.popleft().result())
+            while pending:
+                ens.update(pending.popleft().result())
+        return ens
+
+    def _expected(self, tol, max_iter, chunk_size):
+        # Doubly constrained expectation T_ij = a_i exp(-beta d_ij) b_j with
+        # rows summing to the outflows and columns to the inflows, rescaled to
+        # the total outflow, by iterative proportional fitting (balancing)
+        outflows = np.asarray(self.outflows, dtype=float)
+        inflows = np.asarray(self.inflows, dtype=float)
+        inflows = inflows * (outflows.sum() / inflows.sum())
+        if self.dists is None:
+            # matrix-vector products over chunks of rows computed from the
+            # locations, so the N x M decay is never formed
+            chunks = [
+                slice(start, start + chunk_size)
+                for start in range(0, self.N, chunk_size)
+            ]
+
+            def matvec(b):
+                return np.concatenate([self._decay(rows) @ b for rows in chunks])
+
+            def rmatvec(a):
+                return sum(a[rows] @ self._decay(rows) for rows in chunks)
+        else:
+            decay = np.exp(-self.beta * self.dists)
+
+            def matvec(b):
+                return decay @ b
+
+            def rmatvec(a):
+                return decay.T @ a
+
+        a = np.ones(self.N)
+        for _i in range(max_iter):
+            b = inflows / rmatvec(a)
+            rows = matvec(b)
+            if np.max(np.abs(a * rows - outflows)) <= tol * outflows.max():
+                break
+            a = outflows / rows
+        else:
+            raise RuntimeError(f"Balancing did not converge in {max_iter} iterations")
+        if self.dists is not None:
+            return a[:, None] * decay * b[None, :]
+        T = np.empty((self.N, self.M))
+        for rows in chunks:
+            T[rows] = a[rows, None] * self._decay(rows) * b[None, :]
+        return T
+
+    def _decay(self, rows):
+        return np.exp(-self.beta * self._distances(rows))
+
+
+class Ensemble:
+    """
+    Running summaries of an ensemble of flow matrices that are updated one
+    realization at a time, so the realizations are never stored: mean and
+    variance by Welford's algorithm and quantiles by the P-squared algorithm
+    of Jain and Chlamtac (1985), vectorised over the cells of the matrix.
+
+    Parameters
+    ----------
+    shape           : tuple
+                      N x M, shape of the flow matrices
+    quantiles       : array of reals
+                      probabilities of the quantiles to estimate
+
+    Attributes
+    ----------
+    realizations    : integer
+                      number of realizations seen
+    mean            : array
+                      N x M, mean of the flows
+    var             : array
+                      N x M, sample variance of the flows
+    std             : array
+                      N x M, sample standard deviation of the flows
+    probs           : array
+                      probabilities of the quantiles
+    quantiles       : array
+                      len(probs) x N x M, estimated quantiles of the flows;
+                      exact for up to 6 realizations
+    update          : method
+                      adds a realization to the summaries
+
+    References
+    ----------
+    Jain, R. and Chlamtac, I. (1985). "The P2 algorithm for dynamic
+        calculation of quantiles and histograms without storing
+        observations." Communications of the ACM, 28, 1076-1085.
+    """
+
+    def __init__(self, shape, quantiles=(0.05, 0.5, 0.95)):
+        self.shape = tuple(shape)
+        self.probs = np.atleast_1d(np.asarray(quantiles, dtype=float))
+        self.realizations = 0
+        self.mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+        self._first = []  # the first six realizations initialise P-squared
+        self._q = None  # marker heights, quantiles x 5 x cells
+        self._n = None  # marker positions, quantiles x 5 x cells
+
+    def update(self, T):
+        T = np.asarray(T, dtype=float)
+        self.realizations += 1
+        delta = T - self.mean
+        self.mean += delta / self.realizations
+        self._m2 += delta * (T - self.mean)
+
+        x = T.ravel()
+        p = self.probs[:, None]
+        # desired marker positions after this realization
+        desired = (self.realizations - 1) * np.hstack(
+            (0 * p, p / 2, p, (1 + p) / 2, 1 + 0 * p)
+        )
+        if self._q is None:
+            self._first.append(x.copy())
+            if len(self._first) > 5:
+                # start each probability's markers at their desired
+                # positions, so the middle marker is its exact quantile
+                self._q = np.quantile(
+                    self._first, desired / (self.realizations - 1), axis=0
+                )
+                self._n = np.repeat(desired[:, :, None], x.size, axis=2)
+                self._first = None
+            return
+
+        q, n = self._q, self._n
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        n[:, 1:4] += x < q[:, 1:4]
+        n[:, 4] += 1
+
+        # move the middle markers by one position towards the desired
+        # positions, with piecewise-parabolic (or else linear) heights
+        for i in (1, 2, 3):
+            qi, ql, qr = q[:, i], q[:, i - 1], q[:, i + 1]
+            ni, nl, nr = n[:, i], n[:, i - 1], n[:, i + 1]
+            d = desired[:, i, None] - ni
+            up = (d >= 1) & (nr - ni > 1)
+            down = (d <= -1) & (nl - ni < -1)
+            move = up | down
+            if not move.any():
+                continue
+            s = np.where(up, 1.0, -1.0)
+            # markers of the probabilities 0 and 1 can share a position
+            with np.errstate(divide="ignore", invalid="ignore"):
+                parabolic = qi + s / (nr - nl) * (
+                    (ni - nl + s) * (qr - qi) / (nr - ni)
+                    + (nr - ni - s) * (qi - ql) / (ni - nl)
+                )
+                linear = qi + s * np.where(
+                    up, (qr - qi) / (nr - ni), (ql - qi) / (nl - ni)
+                )
+            new = np.where((ql < parabolic) & (parabolic < qr), parabolic, linear)
+            q[:, i] = np.where(move, new, qi)
+            n[:, i] = ni + np.where(move, s, 0.0)
+
+    @property
+    def var(self):
+        return self._m2 / max(self.realizations - 1, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def quantiles(self):
+        if self._q is None:
+            q = np.quantile(self._first, self.probs, axis=0)
+        else:
+            q = self._q[:, 2]
+        return q.reshape((len(self.probs),) + self.shape)
+
+
+_model = None
+
+
+def _set_model(model):
+    # worker initializer, so the model is only sent once to each process
+    global _model
+    _model = model
+
+
+def _realization(seed, batch):
+    return _model.flowmat(batch=batch, rng=np.random.default_rng(seed))
+
 
 class Radiation(Universal):
     """
@@ -143,7 +482,8 @@ class Radiation(Universal):
     outflows        : array of reals
                       M x 1, observed flows out of each location
     dists           : matrix of reals
-                      N x M, pairwise distances between each location
+                      N x M, pairwise distances between each location, or
+                      None to compute them from ilocs and olocs
     ilocs           : array of reals
                       N x 2, inflow node locations
     olocs           : array of reals
@@ -156,47 +496,48 @@ class Radiation(Universal):
     M               : integer
                       number of destinations
     flowmat         : method
-                      estimates flows via the Radiation model
+                      estimates flows via the Radiation model; the
+                      intervening population of each destination is a
+                      cumulative sum of the inflows sorted by distance from
+                      the origin, computed for chunk_size origins at once
     """
 
-    def __init__(self, inflows, outflows, dists, ilocs, olocs):
-        super().__init__(inflows, outflows, dists)
-        self.ilocs = ilocs.copy()
-        self.olocs = olocs.copy()
+    def __init__(self, inflows, outflows, dists=None, ilocs=None, olocs=None):
+        super().__init__(inflows, outflows, dists, ilocs, olocs)
 
-    def _from_origin(self, idx, total_origins):
-        # Sort destinations by distance from origin
-        didxs = np.argsort(self.dists[idx, :])
-        inflows = self.inflows[didxs]
+    def _from_origins(self, rows, total_origins):
+        # Sort destinations by distance from each origin
+        didxs = np.argsort(self._distances(rows), axis=1)
+        inflows = self.inflows.astype(float)[didxs]
+        outflows = self.outflows[rows].astype(float).reshape((-1, 1))
 
         # Normalization
-        F = 1.0 / (1.0 - self.outflows[idx] / total_origins)
-
-        pop_in_radius = 0
-        flows = np.zeros((self.M,))
-        for j in range(self.M):
-            # Use formula from the paper
-            flows[j] = (
-                F
-                * (self.outflows[idx] * inflows[j])
-                / (
-                    (self.outflows[idx] + pop_in_radius)
-                    * (self.outflows[idx] + inflows[j] + pop_in_radius)
-                )
-            )
+        F = 1.0 / (1.0 - outflows / total_origins)
 
-            pop_in_radius += inflows[j]
+        # Population within the radius, excluding the origin and destination
+        pop_in_radius = np.cumsum(inflows, axis=1) - inflows
+
+        # Use formula from the paper
+        flows = (
+            F
+            * (outflows * inflows)
+            / ((outflows + pop_in_radius) * (outflows + inflows + pop_in_radius))
+        )
 
         # Unsort list
-        return flows[didxs.argsort()]
+        T = np.empty_like(flows)
+        np.put_along_axis(T, didxs, flows, axis=1)
+        return T
 
-    def flowmat(self):
-        # Builds the OD matrix T from the inputted data
+    def flowmat(self, chunk_size=1000):
+        # Builds the OD matrix T from the inputted data, chunk_size origins at
+        # a time so that memory stays O(chunk_size * M)
         T = np.zeros((self.N, self.M))
         total_origins = sum(self.outflows)
 
-        for i in range(self.N):
-            T[i, :] = self._from_origin(i, total_origins)
+        for start in range(0, self.N, chunk_size):
+            rows = slice(start, start + chunk_size)
+            T[rows] = self._from_origins(rows, total_origins)
 
         return T
 
@@ -215,7 +556,9 @@ class PWO(Universal):
     outflows        : array of reals
                       M x 1, observed flows out of each location
     dists           : matrix of reals
-                      N x M, pairwise distances between each location
+                      pairwise distances between each location, where row j
+                      holds the distances from destination j to the origins
+                      (M x N), or None to compute them from ilocs and olocs
     ilocs           : array of reals
                       N x 2, inflow node locations
     olocs           : array of reals
@@ -228,48 +571,68 @@ class PWO(Universal):
     M               : integer
                       number of destinations
     flowmat         : method
-                      estimates flows via the Radiation model
+                      estimates flows via the PWO model; the populations
+                      within the radius are cumulative sums of the outflows
+                      sorted by distance from the destination, computed for
+                      chunk_size destinations at once
     """
 
-    def __init__(self, inflows, outflows, dists, ilocs, olocs):
-        super().__init__(inflows, outflows, dists)
-        self.ilocs = ilocs.copy()
-        self.olocs = olocs.copy()
+    def __init__(self, inflows, outflows, dists=None, ilocs=None, olocs=None):
+        super().__init__(inflows, outflows, dists, ilocs, olocs)
         self.total = sum(inflows)  # total population of the system
 
-    def _from_destination(self, jdx):
-        # Sort origins by distance from destination
-        didxs = np.argsort(self.dists[jdx, :])
-        outflows = self.outflows[didxs]
-        pop_in_radius = self.inflows[jdx]  # here pop_in_radius includes endpts
-        flows = np.zeros((self.N,))
-
-        # Loop over origins
-        for i in range(self.N):
-            pop_in_radius += outflows[i]  # add other endpt
-
-            # Compute denominator
-            denom = 0
-            denom_pop_in_radius = outflows[i]
-            for k in range(self.M):  # loop over destinations
-                denom_pop_in_radius += self.inflows[k]
-                if k != i:
-                    denom += self.inflows[k] * (
-                        1 / denom_pop_in_radius - 1 / self.total
-                    )
-
-            # Use formula from the paper
-            flows[i] = self.inflows[jdx] * (1 / pop_in_radius - 1 / self.total) / denom
+    def _denominators(self, chunk_size):
+        # The denominator of origin i sums I_k (1/(O_i + C_k) - 1/total) over
+        # the destinations k, where C_k is the cumulative inflow up to k, so it
+        # only depends on the outflow of the origin and is computed once per
+        # origin; the term k == i is removed per destination
+        inflows = self.inflows.astype(float)
+        outflows = self.outflows.astype(float).reshape((-1, 1))
+        cum_inflows = np.cumsum(inflows)
+        denoms = np.empty(self.N)
+        for start in range(0, self.N, chunk_size):
+            rows = slice(start, start + chunk_size)
+            denoms[rows] = (
+                inflows * (1 / (outflows[rows] + cum_inflows) - 1 / self.total)
+            ).sum(axis=1)
+        return denoms
+
+    def _from_destinations(self, cols, denoms):
+        # Sort origins by distance from each destination
+        didxs = np.argsort(self._distances(cols, from_destinations=True), axis=1)
+        outflows = self.outflows.astype(float)[didxs]
+        inflows = self.inflows.astype(float)
+        dest_inflows = inflows[cols].reshape((-1, 1))
+
+        # here pop_in_radius includes endpts
+        pop_in_radius = dest_inflows + np.cumsum(outflows, axis=1)
+
+        # Denominator without the destination k == i, i the rank of the origin;
+        # origins ranked past the last destination have no term to remove
+        ranks = np.arange(self.N)
+        k = np.minimum(ranks, self.M - 1)
+        cum_inflows = np.cumsum(inflows)[k]
+        denom = denoms[didxs] - (ranks < self.M) * inflows[k] * (
+            1 / (outflows + cum_inflows) - 1 / self.total
+        )
+
+        # Use formula from the paper
+        flows = dest_inflows * (1 / pop_in_radius - 1 / self.total) / denom
 
         # Unsort list
-        return flows[didxs.argsort()]
+        T = np.empty_like(flows)
+        np.put_along_axis(T, didxs, flows, axis=1)
+        return T
 
-    def flowmat(self):
-        # Builds the OD matrix T from the inputted data
+    def flowmat(self, chunk_size=1000):
+        # Builds the OD matrix T from the inputted data, chunk_size
+        # destinations at a time so that memory stays O(chunk_size * N)
         T = np.zeros((self.N, self.M))
+        denoms = self._denominators(chunk_size)
 
-        for j in range(self.M):
-            T[:, j] = self._from_destination(j)
+        for start in range(0, self.M, chunk_size):
+            cols = slice(start, start + chunk_size)
+            T[:, cols] = self._from_destinations(cols, denoms).T
 
         return T
 
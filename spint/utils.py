@@ -9,7 +9,10 @@ from functools import partial
 from itertools import count
 
 import numpy as np
+from libpysal.weights import WSP, W
 from scipy import sparse as sp
+from scipy.sparse.linalg import LinearOperator
+from spglm.utils import cache_readonly
 
 ''' see `<<<<<` below - `Y` not defined
 def CPC(model):
@@ -98,6 +101,169 @@ def spcategorical(index):
         raise IndexError(f"The index {index} is not understood")
 
 
+class LagOperator:
+    """
+    Spatial lag operator shared across spint. Works directly on the CSR
+    structure of a spatial weight (or on a linear operator that implements the
+    lag implicitly) for vector and matrix (batched) right-hand sides. The
+    transposed structure used for the reverse lag is built once and cached.
+
+    Parameters
+    ----------
+    w           : W, WSP, sparse matrix, array or LinearOperator
+                  n x n spatial weights
+
+    Attributes
+    ----------
+    n           : integer
+                  number of observations
+    sparse      : sparse matrix
+                  n x n CSR weights; None if w is a LinearOperator
+    operator    : LinearOperator
+                  implicit weights; None if w is a sparse structure
+    s0          : float
+                  sum of all weights
+    s1          : float
+                  1/2 sum_ij (w_ij + w_ji)^2
+    s2          : float
+                  sum_i (w_i. + w_.i)^2
+    trW         : float
+                  trace of W
+    trWtW       : float
+                  trace of W'W
+    trWW        : float
+                  trace of WW
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from libpysal.weights import lat2W
+    >>> from spint.utils import LagOperator
+    >>> lag = LagOperator(lat2W(2, 2))
+    >>> lag.lag(np.arange(4.0))
+    array([3., 3., 3., 3.])
+    >>> lag.lag(np.arange(8.0).reshape((4, 2)))
+    array([[6., 8.],
+           [6., 8.],
+           [6., 8.],
+           [6., 8.]])
+    """
+
+    def __init__(self, w):
+        self._cache = {}
+        self.sparse = None
+        self.operator = None
+        if isinstance(w, LagOperator):
+            self.sparse = w.sparse
+            self.operator = w.operator
+            self._cache = w._cache
+        elif isinstance(w, (W, WSP)):
+            self.sparse = w.sparse.tocsr()
+        elif sp.issparse(w):
+            self.sparse = w.tocsr()
+        elif isinstance(w, LinearOperator):
+            self.operator = w
+        elif isinstance(w, np.ndarray) and w.ndim == 2:
+            self.sparse = sp.csr_matrix(w)
+        else:
+            raise TypeError(
+                "Spatial weight must be a W, WSP, sparse matrix, 2D array or "
+                "LinearOperator"
+            )
+        weights = self.sparse if self.operator is None else self.operator
+        if weights.shape[0] != weights.shape[1]:
+            raise ValueError("Spatial weight must be square")
+        self.n = weights.shape[0]
+
+    @cache_readonly
+    def _transposed(self):
+        return self.sparse.T.tocsr()
+
+    def lag(self, y):
+        """
+        Spatial lag Wy for an n x 1 vector or an n x k matrix of k right-hand
+        sides; output has the same shape as y
+        """
+        y = np.asarray(y)
+        if self.operator is not None:
+            return self.operator @ y
+        return self.sparse @ y
+
+    def rlag(self, y):
+        """
+        Reverse spatial lag W'y using the cached transposed structure
+        """
+        y = np.asarray(y)
+        if self.operator is not None:
+            return self.operator.T @ y
+        return self._transposed @ y
+
+    def __matmul__(self, y):
+        return self.lag(y)
+
+    @cache_readonly
+    def s0(self):
+        if self.operator is not None:
+            return self.operator.s0
+        return self.sparse.sum()
+
+    @cache_readonly
+    def s1(self):
+        if self.operator is not None:
+            return self.operator.s1
+        t = self.sparse + self._transposed
+        return t.multiply(t).sum() / 2.0
+
+    @cache_readonly
+    def s2(self):
+        if self.operator is not None:
+            return self.operator.s2
+        rows = np.asarray(self.sparse.sum(axis=1)).ravel()
+        cols = np.asarray(self.sparse.sum(axis=0)).ravel()
+        return np.sum((rows + cols) ** 2)
+
+    @cache_readonly
+    def trW(self):
+        if self.operator is not None:
+            return self.operator.trW
+        return self.sparse.diagonal().sum()
+
+    @cache_readonly
+    def trWtW(self):
+        if self.operator is not None:
+            return self.operator.trWtW
+        return self.sparse.multiply(self.sparse).sum()
+
+    @cache_readonly
+    def trWW(self):
+        if self.operator is not None:
+            return self.operator.trWW
+        return self.sparse.multiply(self._transposed).sum()
+
+
+def lag_spatial(w, y):
+    """
+    Spatial lag of y for vector or matrix (batched) right-hand sides; see
+    LagOperator. Pass a LagOperator to reuse its CSR structure across
+    repeated lags
+
+    Parameters
+    ----------
+    w           : W, WSP, sparse matrix, LinearOperator or LagOperator
+                  n x n spatial weights
+    y           : array
+                  n x 1 or n x k values to be lagged
+
+    Returns
+    -------
+    wy          : array
+                  spatial lag of y with the same shape as y
+    """
+    if not isinstance(w, LagOperator):
+        w = LagOperator(w)
+    return w.lag(y)
+
+
 # old and slow
 """
 def spcategorical(n_cat_ids):
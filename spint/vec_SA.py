@@ -6,6 +6,10 @@ vectors.
 import numpy as np
 import scipy.stats as stats
 from libpysal.weights.distance import DistanceBand
+from scipy.spatial import cKDTree
+
+from .spintW import VecDistanceBand, vecW
+from .utils import LagOperator, lag_spatial
 
 __author__ = "Taylor Oshan tayoshan@gmail.com, Levi Wolf levi.john.wolf@gmail.com"
 
@@ -24,10 +28,13 @@ class VecMoran:
                       spatial weights instance
     focus           : string
                       denotes whether to calculate the statistic with a focus on
-                      spatial proximity between origins or destinations; default
-                      is 'origin' but option include:
+                      spatial proximity between origins, destinations or
+                      both; default is 'origin' but option include:
+
+                      'origin' | 'destination' | 'od'
 
-                      'origin' | 'destination'
+                      'od' requires w to be a 4-dimensional vector weight
+                      built using spint.spintW.vecW
 
     rand            : string
                       denote which randomization technqiue to use for
@@ -54,6 +61,10 @@ class VecMoran:
                       n x 2; 2D coordinates of vector origins
     d               : array
                       n x 2: 2D coordinates of vector destinations
+    u               : array
+                      n x 1; centered x-components of the vectors
+    v               : array
+                      n x 1; centered y-components of the vectors
     alpha           : scalar
                       distance decay parameter harvested from W object
     binary          : boolean
@@ -72,10 +83,13 @@ class VecMoran:
                       default is False; attribute is harvested from W object
     focus           : string
                       denotes whether to calculate the statistic with a focus on
-                      spatial proximity between origins or destinations; default
-                      is 'origin' but option include:
+                      spatial proximity between origins, destinations or
+                      both; default is 'origin' but option include:
+
+                      'origin' | 'destination' | 'od'
 
-                      'origin' | 'destination'
+                      'od' requires w to be a 4-dimensional vector weight
+                      built using spint.spintW.vecW
 
     rand            : string
                       denote which randomization technqiue to use for
@@ -183,8 +197,14 @@ class VecMoran:
         self.two_tailed = two_tailed
         if isinstance(w, DistanceBand):
             self.w = w
+            self._lag = LagOperator(w)
         else:
             raise TypeError("Spatial weight, W, must be of type DistanceBand")
+        if focus.lower() == "od" and not isinstance(w, VecDistanceBand):
+            raise TypeError(
+                "Spatial weight, W, must be a 4-dimensional vector weight "
+                "(see spint.spintW.vecW) when focus is 'od'"
+            )
         try:
             self.threshold = w.threshold
             self.alpha = w.alpha
@@ -198,7 +218,7 @@ class VecMoran:
             ) from None
 
         self.__moments()
-        self.I = self.__calc(self.z)
+        self.I = self.__calc()
         self.z_rand = (self.I - self.EI) / self.seI_rand
 
         if self.z_rand > 0:
@@ -236,39 +256,17 @@ class VecMoran:
 
     def __moments(self):
         self.n = len(self.y)
-        xObar = self.o[:, 0].mean()
-        yObar = self.o[:, 1].mean()
-        xDbar = self.d[:, 0].mean()
-        yDbar = self.d[:, 1].mean()
-        u = (self.y[:, 3] - self.y[:, 1]) - (xDbar - xObar)
-        v = (self.y[:, 4] - self.y[:, 2]) - (yDbar - yObar)
-        z = np.outer(u, u) + np.outer(v, v)
-        self.z = z
+        self.u, self.v = u, v = _deviations(self.y)
         self.uv2ss = np.sum(np.dot(u, u) + np.dot(v, v))
         self.EI = -1.0 / (self.n - 1)
-        n = self.n
-        s1 = self.w.s1
-        W = self.w.s0
-        s2 = self.w.s2
-
-        a2 = np.sum(np.dot(u, u)) / n
-        b2 = np.sum(np.dot(v, v)) / n
-        m2 = a2 + b2
-        a4 = np.sum(np.dot(np.dot(u, u), np.dot(u, u))) / n
-        b4 = np.sum(np.dot(np.dot(v, u), np.dot(v, v))) / n
-        n1 = a2**2 * ((n**2 - 3 * n + 3) * s1 - n * s2 + 3 * W**2)
-        n2 = a4 * ((n**2 - n) * s1 - 2 * n * s2 + 6 * W**2)
-        n3 = b2**2 * ((n**2 - 3 * n + 3) * s1 - n * s2 + 3 * W**2)
-        n4 = b4 * ((n**2 - n) * s1 - 2 * n * s2 + 6 * W**2)
-        d = (n - 1) * (n - 2) * (n - 3)
-        self.VI_rand = 1 / (W**2 * m2**2) * ((n1 - n2) / d + (n3 - n4) / d) + (
-            (a2 * b2) - m2**2
-        ) / (m2**2 * (n - 1) ** 2)
+        self.VI_rand = _vi_rand(self.n, self.w.s0, self.w.s1, self.w.s2, u, v)
         self.seI_rand = self.VI_rand ** (1 / 2.0)
 
-    def __calc(self, z):
-        zl = self._slag(self.w, z)
-        inum = np.sum(zl)
+    def __calc(self):
+        # sum_ij w_ij (u_i u_j + v_i v_j) = u'Wu + v'Wv in O(n + nnz)
+        inum = np.dot(self.u, self._slag(self._lag, self.u)) + np.dot(
+            self.v, self._slag(self._lag, self.v)
+        )
         return self.n / self.w.s0 * inum / self.uv2ss
 
     def _newD(self, oldO, oldD, newO):
@@ -338,13 +336,27 @@ class VecMoran:
                 )
                 for newD in newDs
             ]
+        elif focus.lower() == "od":
+            newOs = [np.random.permutation(self.o) for i in range(self.permutations)]
+            sims = [
+                np.hstack(
+                    [
+                        np.arange(self.n).reshape((-1, 1)),
+                        newO,
+                        self._newD(self.o, self.d, newO),
+                    ]
+                )
+                for newO in newOs
+            ]
+            Ws = [self._vecW(sim) for sim in sims]
         else:
             raise ValueError(
-                "Parameter 'focus' must take value of either 'origin' or 'destination.'"
+                "Parameter 'focus' must take value of either 'origin', "
+                "'destination' or 'od'."
             )
 
         VMs = [VecMoran(y, Ws[i], permutations=None) for i, y in enumerate(sims)]
-        sim = [VM.__calc(VM.z) for VM in VMs]
+        sim = [VM.__calc() for VM in VMs]
         return sim
 
     def __rand_vecs_B(self, focus):
@@ -370,24 +382,50 @@ class VecMoran:
                 )
                 for i in range(self.permutations)
             ]
+        elif focus.lower() == "od":
+            sims = [
+                np.hstack(
+                    [
+                        np.arange(self.n).reshape((-1, 1)),
+                        self.o,
+                        np.random.permutation(self.d),
+                    ]
+                )
+                for i in range(self.permutations)
+            ]
+            VMs = [VecMoran(y, self._vecW(y), permutations=None) for y in sims]
+            return [VM.__calc() for VM in VMs]
         else:
             raise ValueError(
-                "Parameter 'focus' must take value of either 'origin' or 'destination.'"
+                "Parameter 'focus' must take value of either 'origin', "
+                "'destination' or 'od'."
             )
         sims = [VecMoran(y, self.w, permutations=None) for y in sims]
-        sim = [VM.__calc(VM.z) for VM in sims]
+        sim = [VM.__calc() for VM in sims]
         return sim
 
+    def _vecW(self, y):
+        # 4-dimensional weight for redrawn vectors using the parameters of w
+        return vecW(
+            *y[:, 1:5].T,
+            threshold=self.threshold,
+            p=self.w.p,
+            alpha=self.alpha,
+            binary=self.binary,
+            chunk_size=getattr(self.w, "chunk_size", None),
+            silence_warnings=self.silence_warnings,
+        )
+
     def _slag(self, w, y):
         """
-        Dense spatial lag operator for.
+        Sparse spatial lag operator.
         If w is row standardized, returns the average of each observation's neighbors;
         if not, returns the weighted sum of each observation's neighbors.
 
         Parameters
         ----------
-        w : W
-            object
+        w : LagOperator
+            lag operator of the spatial weight, reused across repeated lags
         y : array
             numpy array with dimensionality conforming to w (see examples)
         Returns
@@ -395,4 +433,409 @@ class VecMoran:
         wy : array
             array of numeric values for the spatial lag
         """
-        return np.array(w.sparse.todense()) * y
+        return lag_spatial(w, y)
+
+
+class VecMoranCorrelogram:
+    """Vector-based Moran's I correlogram over a sequence of distance thresholds
+
+    A single KD-tree is built on the focus coordinates and queried once for all
+    pairs of vectors within the largest threshold. The pairs are sorted by
+    distance so that the statistic, its expectation and its analytical variance
+    are accumulated band by band, rather than building a separate
+    DistanceBand and VecMoran for every threshold.
+
+    Parameters
+    ----------
+    y               : array
+                      variable measured across n origin-destination vectors
+    thresholds      : array
+                      distance thresholds; each defines a distance band weight
+                      in which all vectors within the threshold are neighbors
+    focus           : string
+                      denotes whether to calculate the statistic with a focus on
+                      spatial proximity between origins, destinations or
+                      both (4-dimensional distance); default is 'origin' but
+                      option include:
+
+                      'origin' | 'destination' | 'od'
+
+    binary          : boolean
+                      True (default) if all neighbors within a band receive a
+                      weight of 1; False if they are inverse distance weighted
+                      using alpha
+    alpha           : scalar
+                      distance decay parameter used when binary is False
+    p               : float
+                      Minkowski p-norm distance metric parameter
+    rand            : string
+                      denote which randomization technqiue to use for
+                      significance testing; default is 'A' but options are:
+
+                      'A': transate entire vector
+                      'B': shuffle points and redraw vectors
+
+    permutations    : int
+                      number of random permutations shared by all bands for
+                      calculation of pseudo-p_values; default is 0
+    two_tailed      : boolean
+                      If True (default) analytical p-values are two tailed,
+                      otherwise if False, they are one-tailed.
+
+    Attributes
+    ----------
+    thresholds      : array
+                      sorted distance thresholds
+    n               : integer
+                      number of vectors
+    s0              : array
+                      sum of weights for each band
+    I               : array
+                      value of vector-based Moran's I for each band
+    EI              : float
+                      expected value under randomization assumption
+    VI_rand         : array
+                      variance of I under randomization assumption
+    seI_rand        : array
+                      standard deviation of I under randomization assumption
+    z_rand          : array
+                      z-value of I under randomization assumption
+    p_rand          : array
+                      p-value of I under randomization assumption
+    sim             : array
+                      (if permutations>0)
+                      permutations x bands; I values for permuted samples
+    p_sim           : array
+                      (if permutations>0)
+                      p-value based on permutations (one-tailed) for each band
+    EI_sim          : array
+                      (if permutations>0)
+                      average value of I from permutations for each band
+    VI_sim          : array
+                      (if permutations>0)
+                      variance of I from permutations for each band
+    seI_sim         : array
+                      (if permutations>0)
+                      standard deviation of I under permutations.
+    z_sim           : array
+                      (if permutations>0)
+                      standardized I based on permutations
+    p_z_sim         : array
+                      (if permutations>0)
+                      p-value based on standard normal approximation from
+                      permutations
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from spint.vec_SA import VecMoranCorrelogram
+    >>> vecs = np.array([[1, 55, 60, 100, 500],
+    ...                  [2, 60, 55, 105, 501],
+    ...                  [3, 500, 55, 155, 500],
+    ...                  [4, 505, 60, 160, 500],
+    ...                  [5, 105, 950, 105, 500],
+    ...                  [6, 155, 950, 155, 499]])
+    >>> vmc = VecMoranCorrelogram(vecs, [500, 9999], binary=False, alpha=-1.5)
+    >>> np.round(vmc.I, 6)
+    array([0.649853, 0.645945])
+
+    """
+
+    def __init__(
+        self,
+        y,
+        thresholds,
+        focus="origin",
+        binary=True,
+        alpha=-1.0,
+        p=2,
+        rand="A",
+        permutations=0,
+        two_tailed=True,
+    ):
+        self.y = y
+        self.thresholds = np.sort(np.asarray(thresholds, dtype=float).ravel())
+        self.focus = focus
+        self.binary = binary
+        self.alpha = alpha
+        self.rand = rand
+        self.p = p
+        self.permutations = permutations
+        self.two_tailed = two_tailed
+        self.n = n = len(y)
+
+        self._i, self._j, self._wij, self._ends = self.__pairs(y)
+
+        self.s0, self.s1, self.s2 = self.__sums()
+        u, v = _deviations(y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.I = self.__calc(u, v)
+            self.EI = -1.0 / (n - 1)
+            self.VI_rand = _vi_rand(n, self.s0, self.s1, self.s2, u, v)
+            self.seI_rand = self.VI_rand ** (1 / 2.0)
+            self.z_rand = (self.I - self.EI) / self.seI_rand
+        self.p_rand = np.where(
+            self.z_rand > 0,
+            1 - stats.norm.cdf(self.z_rand),
+            stats.norm.cdf(self.z_rand),
+        )
+        if self.two_tailed:
+            self.p_rand *= 2.0
+
+        if permutations:
+            self.sim = sim = self.__permute(u, v)
+            above = sim >= self.I
+            larger = above.sum(axis=0)
+            larger = np.minimum(larger, permutations - larger)
+            self.p_sim = (larger + 1.0) / (permutations + 1.0)
+            self.EI_sim = sim.sum(axis=0) / permutations
+            self.seI_sim = sim.std(axis=0)
+            self.VI_sim = self.seI_sim**2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.z_sim = (self.I - self.EI_sim) / self.seI_sim
+            self.p_z_sim = np.where(
+                self.z_sim > 0,
+                1 - stats.norm.cdf(self.z_sim),
+                stats.norm.cdf(self.z_sim),
+            )
+
+    def __pairs(self, y):
+        # pairs of vectors within the largest threshold sorted by distance,
+        # their weights and the index of the last pair within each band
+        data = _focus_coords(y, self.focus).astype(float)
+        tree = cKDTree(data)
+        pairs = tree.sparse_distance_matrix(
+            tree, max_distance=self.thresholds[-1], p=self.p, output_type="ndarray"
+        )
+        pairs = pairs[pairs["v"] > 0]
+        order = np.argsort(pairs["v"], kind="stable")
+        dist = pairs["v"][order]
+        wij = np.ones(len(dist)) if self.binary else dist**self.alpha
+        ends = np.searchsorted(dist, self.thresholds, side="right")
+        return pairs["i"][order], pairs["j"][order], wij, ends
+
+    def __band(self, x, ends=None):
+        # cumulative totals of a per-pair quantity at the end of each band
+        cum = np.concatenate([[0.0], np.cumsum(x)])
+        return cum[self._ends if ends is None else ends]
+
+    def __sums(self):
+        w = self._wij
+        # the weights are symmetric, so s1 is twice the sum of squared weights and
+        # s2 is four times the sum of squared row sums; row sums are grown pair by
+        # pair, so each pair adds 2 * r_i * w_ij + w_ij ** 2 to the sum of squares
+        grouped = np.argsort(self._i, kind="stable")
+        wg = w[grouped]
+        cum = np.cumsum(wg)
+        starts = np.flatnonzero(np.diff(self._i[grouped], prepend=-1))
+        offset = np.repeat(cum[starts] - wg[starts], np.diff(np.append(starts, len(w))))
+        r_before = np.empty_like(w)
+        r_before[grouped] = cum - wg - offset
+        s0 = self.__band(w)
+        s1 = 2.0 * self.__band(w**2)
+        s2 = 4.0 * self.__band(2.0 * r_before * w + w**2)
+        return s0, s1, s2
+
+    def __calc(self, u, v, pairs=None):
+        if pairs is None:
+            i, j, wij, ends, s0 = self._i, self._j, self._wij, self._ends, self.s0
+        else:
+            i, j, wij, ends = pairs
+            s0 = self.__band(wij, ends)
+        zij = u[i] * u[j] + v[i] * v[j]
+        inum = self.__band(wij * zij, ends)
+        return self.n / s0 * inum / (np.dot(u, u) + np.dot(v, v))
+
+    def __permute(self, u, v):
+        # translating whole vectors (A) amounts to permuting the deviations across
+        # the fixed focus locations, while redrawing vectors (B) pairs the focus
+        # locations with permuted opposite ends; either way the pairs are reused
+        # except for focus 'od', where the 4-dimensional pairs are queried again
+        # for the redrawn vectors as in VecMoran
+        od = self.focus.lower() == "od"
+        rand = self.rand.upper()
+        if rand not in ("A", "B"):
+            raise ValueError("Parameter 'rand' must take a value of either 'A' or 'B'")
+        sim = np.empty((self.permutations, len(self.thresholds)))
+        for perm in range(self.permutations):
+            idx = np.random.permutation(self.n)
+            y = np.array(self.y, dtype=float)
+            if od and rand == "A":
+                # translate each vector to a permuted origin
+                y[:, 3:5] += y[idx, 1:3] - y[:, 1:3]
+                y[:, 1:3] = y[idx, 1:3]
+            elif rand == "A":
+                up, vp = u[idx], v[idx]
+            elif self.focus.lower() == "destination":
+                y[:, 1:3] = y[idx, 1:3]
+            else:
+                y[:, 3:5] = y[idx, 3:5]
+            if rand == "B" or od:
+                up, vp = _deviations(y)
+            pairs = self.__pairs(y) if od else None
+            with np.errstate(divide="ignore", invalid="ignore"):
+                sim[perm] = self.__calc(up, vp, pairs)
+        return sim
+
+
+class VecMoranBatch:
+    """Vector-based Moran's I for several sets of vectors sharing one weight
+
+    The spatial weight is validated once and its sums (s0, s1, s2) and sparse
+    structure are reused, so that the statistic and its analytical inference
+    under the randomization assumption are computed for all sets of vectors in
+    a single pass. Useful for subsets or time slices observed at the same
+    vector locations.
+
+    Parameters
+    ----------
+    ys              : array
+                      k x n x 5; k sets of n origin-destination vectors (or a
+                      list of k n x 5 arrays)
+    w               : W
+                      spatial weights instance shared by all sets of vectors
+    two_tailed      : boolean
+                      If True (default) analytical p-values for Moran are two
+                      tailed, otherwise if False, they are one-tailed.
+
+    Attributes
+    ----------
+    ys              : array
+                      k x n x 5; original variables
+    w               : W
+                      original w object
+    k               : integer
+                      number of sets of vectors
+    n               : integer
+                      number of vectors in each set
+    s0              : float
+                      sum of weights
+    s1              : float
+                      s1 sum of weights
+    s2              : float
+                      s2 sum of weights
+    I               : array
+                      k x 1; value of vector-based Moran's I for each set
+    EI              : float
+                      expected value under randomization assumption
+    VI_rand         : array
+                      k x 1; variance of I under randomization assumption
+    seI_rand        : array
+                      k x 1; standard deviation of I under randomization
+    z_rand          : array
+                      k x 1; z-value of I under randomization assumption
+    p_rand          : array
+                      k x 1; p-value of I under randomization assumption
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from libpysal.weights import DistanceBand
+    >>> from spint.vec_SA import VecMoranBatch
+    >>> vecs = np.array([[1, 55, 60, 100, 500],
+    ...                  [2, 60, 55, 105, 501],
+    ...                  [3, 500, 55, 155, 500],
+    ...                  [4, 505, 60, 160, 500],
+    ...                  [5, 105, 950, 105, 500],
+    ...                  [6, 155, 950, 155, 499]])
+    >>> shifted = vecs.copy()
+    >>> shifted[:, 3:5] = shifted[::-1, 3:5]
+    >>> wo = DistanceBand(vecs[:, 1:3], threshold=9999, alpha=-1.5, binary=False)
+    >>> vmb = VecMoranBatch([vecs, shifted], wo)
+    >>> np.round(vmb.I, 6)
+    array([0.645945, 0.658207])
+
+    """
+
+    def __init__(self, ys, w, two_tailed=True):
+        ys = np.asarray(ys)
+        if ys.ndim != 3 or ys.shape[2] != 5:
+            raise ValueError("Vectors must be stacked as a k x n x 5 array")
+        if not isinstance(w, DistanceBand):
+            raise TypeError("Spatial weight, W, must be of type DistanceBand")
+        if ys.shape[1] != w.n:
+            raise ValueError("Number of vectors does not match spatial weight, W")
+        self.ys = ys
+        self.w = w
+        self.two_tailed = two_tailed
+        self.k, self.n = ys.shape[:2]
+        self.s0 = w.s0
+        self.s1 = w.s1
+        self.s2 = w.s2
+        self._lag = LagOperator(w)
+
+        u, v = _deviations(ys.astype(float))
+        self.I = self.__calc(u, v)
+        self.EI = -1.0 / (self.n - 1)
+        self.VI_rand = _vi_rand(self.n, self.s0, self.s1, self.s2, u, v)
+        with np.errstate(invalid="ignore"):
+            self.seI_rand = self.VI_rand ** (1 / 2.0)
+            self.z_rand = (self.I - self.EI) / self.seI_rand
+        self.p_rand = np.where(
+            self.z_rand > 0,
+            1 - stats.norm.cdf(self.z_rand),
+            stats.norm.cdf(self.z_rand),
+        )
+        if self.two_tailed:
+            self.p_rand *= 2.0
+
+    def __calc(self, u, v):
+        # u'Wu + v'Wv for all k sets at once using the shared sparse weights
+        inum = np.sum(u.T * self._lag.lag(u.T), axis=0) + np.sum(
+            v.T * self._lag.lag(v.T), axis=0
+        )
+        uv2ss = np.sum(u * u, axis=1) + np.sum(v * v, axis=1)
+        return self.n / self.s0 * inum / uv2ss
+
+
+def _focus_coords(y, focus):
+    """
+    Coordinates of n vectors used to measure spatial proximity
+    """
+    if focus.lower() == "origin":
+        return y[:, 1:3]
+    elif focus.lower() == "destination":
+        return y[:, 3:5]
+    elif focus.lower() == "od":
+        return y[:, 1:5]
+    else:
+        raise ValueError(
+            "Parameter 'focus' must take value of either 'origin', "
+            "'destination' or 'od'."
+        )
+
+
+def _deviations(y):
+    """
+    Centered x and y components (u, v) of n vectors; y may also be a k x n x 5
+    stack of k sets of vectors, giving k x n deviations
+    """
+    u = y[..., 3] - y[..., 1]
+    v = y[..., 4] - y[..., 2]
+    u = u - u.mean(axis=-1, keepdims=True)
+    v = v - v.mean(axis=-1, keepdims=True)
+    return u, v
+
+
+def _vi_rand(n, s0, s1, s2, u, v):
+    """
+    Variance of vector-based Moran's I under the randomization assumption; the
+    weight sums s0, s1 and s2 may be scalars or arrays of equal length and the
+    deviations u and v may be stacked as k x n arrays for k sets of vectors.
+    """
+    W = s0
+    uu = np.sum(u * u, axis=-1)
+    vv = np.sum(v * v, axis=-1)
+    a2 = uu / n
+    b2 = vv / n
+    m2 = a2 + b2
+    a4 = uu * uu / n
+    b4 = np.sum(v * u, axis=-1) * vv / n
+    n1 = a2**2 * ((n**2 - 3 * n + 3) * s1 - n * s2 + 3 * W**2)
+    n2 = a4 * ((n**2 - n) * s1 - 2 * n * s2 + 6 * W**2)
+    n3 = b2**2 * ((n**2 - 3 * n + 3) * s1 - n * s2 + 3 * W**2)
+    n4 = b4 * ((n**2 - n) * s1 - 2 * n * s2 + 6 * W**2)
+    d = (n - 1) * (n - 2) * (n - 3)
+    return 1 / (W**2 * m2**2) * ((n1 - n2) / d + (n3 - n4) / d) + (
+        (a2 * b2) - m2**2
+    ) / (m2**2 * (n - 1) ** 2)